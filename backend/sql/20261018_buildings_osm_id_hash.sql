@@ -0,0 +1,8 @@
+-- Migration: keys for incremental (diff-based) building imports
+-- osm_id: 'w<way id>' / 'r<relation id>' (or 'h<hash>' for features without an OSM id)
+-- content_hash: md5 of name, type and EWKB geometry; rows are only rewritten when it changes
+ALTER TABLE buildings
+  ADD COLUMN IF NOT EXISTS osm_id VARCHAR(32),
+  ADD COLUMN IF NOT EXISTS content_hash CHAR(32);
+
+CREATE INDEX IF NOT EXISTS buildings_osm_id_idx ON buildings (osm_id);
@@ -0,0 +1,17 @@
+-- Migration: precomputed per-district station statistics (written by data/district_stats.py)
+-- /api/district-safety reads these instead of joining every district with every station,
+-- as long as charge_stations still matches the snapshot recorded in district_station_stats_meta
+CREATE TABLE IF NOT EXISTS district_station_stats (
+  district_id INTEGER PRIMARY KEY,
+  total_stations INTEGER NOT NULL,
+  battery_stations INTEGER NOT NULL,
+  charging_stations INTEGER NOT NULL,
+  open_stations INTEGER NOT NULL,
+  maintenance_stations INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS district_station_stats_meta (
+  source_updated_at TIMESTAMP,
+  source_count BIGINT NOT NULL,
+  refreshed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
@@ -0,0 +1,17 @@
+-- Migration: log of building geometries repaired or rejected by the importers (data/validate_geometry.py)
+-- action = 'repaired': geom holds the original, the imported row got ST_MakeValid's polygonal result
+-- action = 'rejected': the row was dropped; geom (or raw GeoJSON, when PostGIS could not parse it) is kept for review
+CREATE TABLE IF NOT EXISTS geometry_quarantine (
+  id BIGSERIAL PRIMARY KEY,
+  source_table TEXT NOT NULL,
+  osm_id VARCHAR(32),
+  name TEXT,
+  type TEXT,
+  action VARCHAR(10) NOT NULL, -- repaired | rejected
+  reason TEXT NOT NULL,
+  geom GEOMETRY,
+  raw TEXT,
+  quarantined_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS geometry_quarantine_osm_id_idx ON geometry_quarantine (osm_id);
@@ -0,0 +1,48 @@
+-- Migration: Hilbert-curve clustering key for the spatial tables (see data/hilbert.py)
+-- hilbert_key(geom) is the Hilbert index (2^24 cells per axis) of the geometry's centroid,
+-- over the lon/lat world for EPSG:4326 and the Web Mercator square for EPSG:3857.
+-- The btree on it is recorded as the clustering index; rows are only moved by CLUSTER
+-- (or by re-importing with --hilbert), which locks the table while it rewrites it.
+CREATE OR REPLACE FUNCTION hilbert_key(geom geometry) RETURNS bigint AS $$
+DECLARE
+    c geometry := ST_Centroid(geom);
+    -- EPSG:3857 metres, anything else is taken as lon/lat degrees
+    half_w double precision := CASE WHEN ST_SRID(geom) = 3857 THEN 20037508.342789244 ELSE 180 END;
+    half_h double precision := CASE WHEN ST_SRID(geom) = 3857 THEN 20037508.342789244 ELSE 90 END;
+    n bigint := 1::bigint << 24;
+    x bigint;
+    y bigint;
+    rx bigint;
+    ry bigint;
+    t bigint;
+    s bigint;
+    d bigint := 0;
+BEGIN
+    IF ST_IsEmpty(c) THEN
+        RETURN NULL;
+    END IF;
+    x := LEAST(n - 1, GREATEST(0, floor((ST_X(c) + half_w) / (2 * half_w) * n)))::bigint;
+    y := LEAST(n - 1, GREATEST(0, floor((ST_Y(c) + half_h) / (2 * half_h) * n)))::bigint;
+    s := n >> 1;
+    WHILE s > 0 LOOP
+        rx := CASE WHEN (x & s) <> 0 THEN 1 ELSE 0 END;
+        ry := CASE WHEN (y & s) <> 0 THEN 1 ELSE 0 END;
+        d := d + s * s * ((3 * rx) # ry);
+        IF ry = 0 THEN
+            IF rx = 1 THEN
+                x := n - 1 - x;
+                y := n - 1 - y;
+            END IF;
+            t := x;
+            x := y;
+            y := t;
+        END IF;
+        s := s >> 1;
+    END LOOP;
+    RETURN d;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE STRICT PARALLEL SAFE;
+
+CREATE INDEX IF NOT EXISTS buildings_hilbert_idx ON buildings (hilbert_key(geom));
+ALTER TABLE buildings CLUSTER ON buildings_hilbert_idx;
+-- CLUSTER buildings;  -- one-off rewrite; python data/hilbert.py does the same for the generalized tables
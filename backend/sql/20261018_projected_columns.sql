@@ -0,0 +1,17 @@
+-- Migration: pre-projected geometry columns (kept in step by PostGIS, see data/projections.py)
+-- The API answers in EPSG:4326 while planet_osm_* and charge_stations are stored in EPSG:3857,
+-- so each table also stores the other projection instead of the routes reprojecting every row.
+-- osm2pgsql -c recreates planet_osm_point: run data/projections.py again after a full import.
+ALTER TABLE buildings
+  ADD COLUMN IF NOT EXISTS geom_3857 GEOMETRY(Geometry, 3857) GENERATED ALWAYS AS (ST_Transform(geom, 3857)) STORED,
+  ADD COLUMN IF NOT EXISTS centroid GEOMETRY(Point, 4326) GENERATED ALWAYS AS (ST_Centroid(geom)) STORED;
+CREATE INDEX IF NOT EXISTS buildings_geom_3857_idx ON buildings USING GIST (geom_3857);
+CREATE INDEX IF NOT EXISTS buildings_centroid_idx ON buildings USING GIST (centroid);
+
+ALTER TABLE planet_osm_point
+  ADD COLUMN IF NOT EXISTS way_4326 GEOMETRY(Point, 4326) GENERATED ALWAYS AS (ST_Transform(way, 4326)) STORED;
+CREATE INDEX IF NOT EXISTS planet_osm_point_way_4326_idx ON planet_osm_point USING GIST (way_4326);
+
+ALTER TABLE hanoi_districts
+  ADD COLUMN IF NOT EXISTS geom_3857 GEOMETRY(Geometry, 3857) GENERATED ALWAYS AS (ST_Transform(geom, 3857)) STORED;
+CREATE INDEX IF NOT EXISTS hanoi_districts_geom_3857_idx ON hanoi_districts USING GIST (geom_3857);
@@ -0,0 +1,202 @@
+-- Migration: per-region partitions of buildings and planet_osm_* (see data/regions.py)
+-- import_regions records each region partition's row count and lon/lat bounds; the API
+-- prunes viewport queries to the regions whose bounds meet the viewport.
+-- The functions build, convert and swap partitions; the importers call them
+-- (--region), and regions.py partition converts an existing table in place.
+CREATE TABLE IF NOT EXISTS import_regions (
+    parent VARCHAR(63) NOT NULL,
+    region VARCHAR(32) NOT NULL,
+    partition VARCHAR(63) NOT NULL,
+    row_count BIGINT NOT NULL DEFAULT 0,
+    bounds GEOMETRY(Geometry, 4326),
+    loaded_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (parent, region)
+);
+CREATE INDEX IF NOT EXISTS import_regions_bounds_idx ON import_regions USING GIST (bounds);
+
+-- Row count and lon/lat extent of parent_region
+CREATE OR REPLACE FUNCTION region_record(parent_table text, region_name text) RETURNS void AS $$
+DECLARE
+    part text := parent_table || '_' || region_name;
+    geom_column text;
+    geom_srid integer;
+    n bigint;
+    extent geometry;
+BEGIN
+    SELECT f_geometry_column, COALESCE(NULLIF(srid, 0), 4326) INTO geom_column, geom_srid
+    FROM geometry_columns
+    WHERE f_table_schema = current_schema() AND f_table_name = part AND f_geometry_column IN ('geom', 'way');
+    IF geom_column IS NULL THEN
+        RAISE EXCEPTION '% has no geom or way column', part;
+    END IF;
+    EXECUTE format('SELECT count(*), ST_Transform(ST_SetSRID(ST_Extent(%I)::geometry, %s), 4326) FROM %I',
+                   geom_column, geom_srid, part)
+    INTO n, extent;
+    INSERT INTO import_regions (parent, region, partition, row_count, bounds, loaded_at)
+    VALUES (parent_table, region_name, part, n, ST_Envelope(extent), now())
+    ON CONFLICT (parent, region) DO UPDATE
+    SET partition = EXCLUDED.partition, row_count = EXCLUDED.row_count,
+        bounds = EXCLUDED.bounds, loaded_at = EXCLUDED.loaded_at;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Create source_table's primary key and plain indexes on target_table, renamed to its prefix.
+-- Other unique indexes cannot span partitions without the region column; the
+-- clustering (hilbert_key) index stays per partition.
+CREATE OR REPLACE FUNCTION region_copy_indexes(source_table text, target_table text) RETURNS void AS $$
+DECLARE
+    idx record;
+    index_name text;
+    key_columns text;
+BEGIN
+    FOR idx IN
+        SELECT i.indexrelid, c.relname, i.indisprimary, i.indisunique, i.indisclustered
+        FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = to_regclass(source_table)
+    LOOP
+        index_name := target_table || CASE WHEN starts_with(idx.relname, source_table || '_')
+                                           THEN substr(idx.relname, length(source_table) + 1)
+                                           ELSE '_' || idx.relname END;
+        IF idx.indisprimary THEN
+            SELECT string_agg(quote_ident(a.attname), ', ' ORDER BY k.n) INTO key_columns
+            FROM pg_index i
+            CROSS JOIN LATERAL unnest(i.indkey::int2[]) WITH ORDINALITY AS k(attnum, n)
+            JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+            WHERE i.indexrelid = idx.indexrelid;
+            EXECUTE format('ALTER TABLE %I ADD CONSTRAINT %I PRIMARY KEY (%s)',
+                           target_table, index_name, key_columns);
+        ELSIF NOT idx.indisunique AND NOT idx.indisclustered THEN
+            EXECUTE regexp_replace(pg_get_indexdef(idx.indexrelid), '^CREATE INDEX [^ ]+ ON [^ ]+',
+                                   format('CREATE INDEX %I ON %I', index_name, target_table));
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Rename table's indexes from the old_prefix to the new_prefix
+CREATE OR REPLACE FUNCTION region_rename_indexes(table_name text, old_prefix text, new_prefix text)
+RETURNS void AS $$
+DECLARE
+    idx record;
+BEGIN
+    FOR idx IN
+        SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = to_regclass(table_name)
+    LOOP
+        EXECUTE format('ALTER INDEX %I RENAME TO %I', idx.relname,
+                       new_prefix || CASE WHEN starts_with(idx.relname, old_prefix || '_')
+                                          THEN substr(idx.relname, length(old_prefix) + 1)
+                                          ELSE '_' || idx.relname END);
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Turn an unpartitioned table into a LIST (region) parent whose only partition,
+-- parent_region, is the existing table (renamed, not copied).
+CREATE OR REPLACE FUNCTION region_partition(parent_table text, region_name text) RETURNS text AS $$
+DECLARE
+    part text := parent_table || '_' || region_name;
+    seq text;
+    pkey text;
+    key_columns text;
+BEGIN
+    IF to_regclass(parent_table) IS NULL THEN
+        RAISE EXCEPTION '% does not exist', parent_table;
+    END IF;
+    IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(parent_table)) THEN
+        RETURN part;
+    END IF;
+    IF EXISTS (SELECT 1 FROM pg_attribute
+               WHERE attrelid = to_regclass(parent_table) AND attname = 'id' AND NOT attisdropped) THEN
+        seq := pg_get_serial_sequence(parent_table, 'id');
+    END IF;
+
+    EXECUTE format('ALTER TABLE %I RENAME TO %I', parent_table, part);
+    PERFORM region_rename_indexes(part, parent_table, part);
+    -- Fast default, so no rewrite; the CHECK scan only reads
+    EXECUTE format('ALTER TABLE %I ADD COLUMN IF NOT EXISTS region varchar(32) NOT NULL DEFAULT %L',
+                   part, region_name);
+    EXECUTE format('ALTER TABLE %I ADD CONSTRAINT region_check CHECK (region = %L)', part, region_name);
+
+    -- A partitioned primary key must include the partition key
+    SELECT con.conname, string_agg(quote_ident(a.attname), ', ' ORDER BY k.n) INTO pkey, key_columns
+    FROM pg_constraint con
+    CROSS JOIN LATERAL unnest(con.conkey) WITH ORDINALITY AS k(attnum, n)
+    JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+    WHERE con.conrelid = to_regclass(part) AND con.contype = 'p'
+    GROUP BY con.conname;
+    IF pkey IS NOT NULL THEN
+        EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', part, pkey);
+        EXECUTE format('ALTER TABLE %I ADD CONSTRAINT %I PRIMARY KEY (%s, region)', part, pkey, key_columns);
+    END IF;
+
+    EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING STORAGE) '
+                   'PARTITION BY LIST (region)', parent_table, part);
+    EXECUTE format('ALTER TABLE %I ALTER COLUMN region DROP DEFAULT', parent_table);
+    IF seq IS NOT NULL THEN
+        EXECUTE format('ALTER SEQUENCE %s OWNED BY %I.id', seq, parent_table);
+    END IF;
+    PERFORM region_copy_indexes(part, parent_table);
+    EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES IN (%L)', parent_table, part, region_name);
+    PERFORM region_record(parent_table, region_name);
+    RETURN part;
+END;
+$$ LANGUAGE plpgsql;
+
+-- The partition importers write to in place; an empty unpartitioned parent is converted,
+-- one with rows has to be converted explicitly (regions.py partition)
+CREATE OR REPLACE FUNCTION region_ensure(parent_table text, region_name text) RETURNS text AS $$
+DECLARE
+    part text := parent_table || '_' || region_name;
+    has_rows boolean;
+BEGIN
+    IF to_regclass(parent_table) IS NULL THEN
+        RAISE EXCEPTION '% does not exist', parent_table;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(parent_table)) THEN
+        EXECUTE format('SELECT EXISTS (SELECT 1 FROM %I)', parent_table) INTO has_rows;
+        IF has_rows THEN
+            RAISE EXCEPTION '% holds rows of no region: run python regions.py partition % --region <name> first',
+                parent_table, parent_table;
+        END IF;
+        RETURN region_partition(parent_table, region_name);
+    END IF;
+    IF to_regclass(part) IS NULL THEN
+        EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES IN (%L)', part, parent_table, region_name);
+        EXECUTE format('ALTER TABLE %I ALTER COLUMN region SET DEFAULT %L', part, region_name);
+        PERFORM region_record(parent_table, region_name);
+    END IF;
+    RETURN part;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Swap an offline-built staging table in as parent_region.
+-- Only that region's old partition is detached and dropped; the parent's
+-- ACCESS EXCLUSIVE lock from DETACH lasts until commit, so call it last.
+CREATE OR REPLACE FUNCTION region_attach(parent_table text, region_name text, staging_table text)
+RETURNS text AS $$
+DECLARE
+    part text := parent_table || '_' || region_name;
+BEGIN
+    IF to_regclass(parent_table) IS NULL THEN
+        -- First region of this table: the parent takes its shape from the staging table
+        EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING STORAGE) '
+                       'PARTITION BY LIST (region)', parent_table, staging_table);
+        EXECUTE format('ALTER TABLE %I ALTER COLUMN region DROP DEFAULT', parent_table);
+        PERFORM region_copy_indexes(staging_table, parent_table);
+    ELSIF NOT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(parent_table)) THEN
+        PERFORM region_ensure(parent_table, region_name);
+    END IF;
+    IF to_regclass(part) IS NOT NULL THEN
+        IF EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass(part)) THEN
+            EXECUTE format('ALTER TABLE %I DETACH PARTITION %I', parent_table, part);
+        END IF;
+        EXECUTE format('DROP TABLE %I', part);
+    END IF;
+    EXECUTE format('ALTER TABLE %I RENAME TO %I', staging_table, part);
+    PERFORM region_rename_indexes(part, staging_table, part);
+    EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES IN (%L)', parent_table, part, region_name);
+    PERFORM region_record(parent_table, region_name);
+    RETURN part;
+END;
+$$ LANGUAGE plpgsql;
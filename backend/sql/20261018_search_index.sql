@@ -0,0 +1,30 @@
+-- Migration: unified search table for /api/data/search (filled by data/search_index.py)
+-- search_text is the lower-cased, accent-free name + address ('Đường Láng' -> 'duong lang');
+-- pg_trgm serves substring matches, the tsvector serves 2-character prefix matches
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+CREATE OR REPLACE FUNCTION search_normalize(text) RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+  SELECT regexp_replace(lower(public.unaccent('public.unaccent'::regdictionary, $1)), '\s+', ' ', 'g')
+$$;
+
+CREATE TABLE IF NOT EXISTS search_index (
+  type VARCHAR(20) NOT NULL, -- charging_station | point | polygon
+  source_id TEXT NOT NULL,   -- charge_stations.id / osm_id
+  name TEXT,
+  address TEXT,
+  lon DOUBLE PRECISION,
+  lat DOUBLE PRECISION,
+  search_text TEXT NOT NULL,
+  tsv TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', search_text)) STORED,
+  PRIMARY KEY (type, source_id)
+);
+CREATE INDEX IF NOT EXISTS search_index_trgm_idx ON search_index USING GIN (search_text gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS search_index_tsv_idx ON search_index USING GIN (tsv);
+
+CREATE TABLE IF NOT EXISTS search_index_meta (
+  stations_updated_at TIMESTAMP,
+  stations_count BIGINT NOT NULL,
+  refreshed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
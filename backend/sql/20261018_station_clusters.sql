@@ -0,0 +1,23 @@
+-- Migration: precomputed charging station cluster pyramid (written by data/station_clusters.py)
+-- One row per zoom level (0-18) and cluster or single station, keyed by the tile it falls in at that zoom;
+-- /api/stations/clusters reads it while charge_stations still matches station_clusters_meta
+CREATE TABLE IF NOT EXISTS station_clusters (
+  zoom SMALLINT NOT NULL,
+  tile_x INTEGER NOT NULL,
+  tile_y INTEGER NOT NULL,
+  cluster_id INTEGER,       -- NULL for a single station
+  station_id INTEGER,       -- charge_stations.id of a single station
+  point_count INTEGER NOT NULL,
+  expansion_zoom SMALLINT,  -- first zoom the cluster splits at
+  lon DOUBLE PRECISION NOT NULL,
+  lat DOUBLE PRECISION NOT NULL,
+  categories JSONB NOT NULL, -- {category: station count}
+  statuses JSONB NOT NULL    -- {status: station count}
+);
+CREATE INDEX IF NOT EXISTS station_clusters_tile_idx ON station_clusters (zoom, tile_x, tile_y);
+
+CREATE TABLE IF NOT EXISTS station_clusters_meta (
+  source_updated_at TIMESTAMP,
+  source_count BIGINT NOT NULL,
+  refreshed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
@@ -0,0 +1,15 @@
+-- Migration: prefix crawled charging stations with their source in external_id
+-- The VinFast sync (backend/src/routes/stations.ts) upserts bare store ids on
+-- external_id; charge_Station.py --postgis now writes 'vgreen:<id>' (see
+-- data/station_sink.py). Rows from the crawler are the ones with a content_hash
+-- (the VinFast sync never sets it); rename those that are still unprefixed.
+ALTER TABLE charge_stations ADD COLUMN IF NOT EXISTS content_hash CHAR(32);
+
+UPDATE charge_stations s
+SET external_id = 'vgreen:' || s.external_id
+WHERE s.content_hash IS NOT NULL
+  AND s.external_id NOT LIKE '%:%'
+  AND length(s.external_id) <= 43
+  AND NOT EXISTS (
+      SELECT 1 FROM charge_stations p WHERE p.external_id = 'vgreen:' || s.external_id
+  );
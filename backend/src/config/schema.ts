@@ -0,0 +1,43 @@
+import db from './db';
+
+// Memoise an async check for ttlMs, so a hot route runs it once per TTL instead of once
+// per request. A failed load is forgotten and retried by the next caller; clear() drops
+// the cached value after a write the caller knows about.
+export const cachedFor = <T>(ttlMs: number, load: () => Promise<T>) => {
+  let entry: { at: number; value: Promise<T> } | null = null;
+  const get = (): Promise<T> => {
+    if (!entry || Date.now() - entry.at > ttlMs) {
+      const current = { at: Date.now(), value: load() };
+      entry = current;
+      current.value.catch(() => {
+        if (entry === current) entry = null;
+      });
+    }
+    return entry.value;
+  };
+  return Object.assign(get, { clear: () => { entry = null; } });
+};
+
+// Tables and columns of the public schema. The optional data/ steps (projections.py,
+// regions.py, search_index.py, ...) add tables and columns the routes use when present;
+// reading the catalog once a minute lets them pick one query up front, and a step run
+// while the server is up is picked up without a restart.
+const SCHEMA_TTL_MS = 60 * 1000;
+
+const publicColumns = cachedFor(SCHEMA_TTL_MS, async () => {
+  const result = await db.query(
+    `SELECT table_name, column_name FROM information_schema.columns WHERE table_schema = 'public'`
+  );
+  const columns = new Map<string, Set<string>>();
+  for (const row of result.rows) {
+    const table = columns.get(row.table_name) ?? new Set<string>();
+    table.add(row.column_name);
+    columns.set(row.table_name, table);
+  }
+  return columns;
+});
+
+export const hasTable = async (table: string) => (await publicColumns()).has(table);
+
+export const hasColumn = async (table: string, column: string) =>
+  (await publicColumns()).get(table)?.has(column) ?? false;
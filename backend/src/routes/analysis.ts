@@ -1,5 +1,6 @@
 import { Router, Request, Response } from 'express';
 import db from '../config/db';
+import { hasColumn, hasTable } from '../config/schema';
 
 const router = Router();
 
@@ -38,7 +39,8 @@ router.get('/buffer', async (req: Request, res: Response) => {
 
     // 2. Find features inside the buffer
     // We check if the feature's 'way' (which is in 3857) intersects with our buffer (calculated in 3857)
-    const featuresQuery = `
+    // Output coordinates come from way_4326 (data/projections.py) when it exists
+    const featuresQuery = (projected: boolean) => `
       WITH buffer_geom AS (
         SELECT ST_Buffer(
           ST_Transform(
@@ -55,7 +57,9 @@ router.get('/buffer', async (req: Request, res: Response) => {
             'type', 'Feature',
             'geometry', json_build_object(
               'type', 'Point',
-              'coordinates', json_build_array(ST_X(ST_Transform(way, 4326)), ST_Y(ST_Transform(way, 4326)))
+              'coordinates', ${projected
+                ? 'json_build_array(ST_X(way_4326), ST_Y(way_4326))'
+                : 'json_build_array(ST_X(ST_Transform(way, 4326)), ST_Y(ST_Transform(way, 4326)))'}
             ),
             'properties', json_build_object(
               'name', name,
@@ -71,7 +75,8 @@ router.get('/buffer', async (req: Request, res: Response) => {
       LIMIT 200;
     `;
 
-    const featuresResult = await db.query(featuresQuery, [longitude, latitude, rad]);
+    const projected = await hasColumn('planet_osm_point', 'way_4326'); // else projections.py not run yet
+    const featuresResult = await db.query(featuresQuery(projected), [longitude, latitude, rad]);
     const featuresGeoJSON = featuresResult.rows[0].geojson;
 
     res.json({
@@ -89,6 +94,36 @@ router.get('/buffer', async (req: Request, res: Response) => {
   }
 });
 
+// Precomputed per-cell counts from data/amenity_grid.py (null if the grid is missing,
+// was built for another radius, or does not cover the point → live queries are used)
+async function lookupScoreGrid(longitude: number, latitude: number, radius: number) {
+  const gridQuery = `
+    WITH p AS (SELECT ST_Transform(ST_SetSRID(ST_MakePoint($1, $2), 4326), 3857) AS geom)
+    SELECT
+      m.water_mask,
+      COALESCE(g.water, false) AS water,
+      COALESCE(g.schools, 0) AS schools,
+      COALESCE(g.universities, 0) AS universities,
+      COALESCE(g.kindergartens, 0) AS kindergartens,
+      COALESCE(g.health, 0) AS health,
+      COALESCE(g.services, 0) AS services,
+      COALESCE(g.shopping, 0) AS shopping,
+      COALESCE(g.leisure, 0) AS leisure,
+      COALESCE(g.parking, 0) AS parking,
+      COALESCE(g.fuel, 0) AS fuel
+    FROM amenity_grid_meta m
+    CROSS JOIN p
+    LEFT JOIN amenity_grid g
+      ON g.cell_x = floor(ST_X(p.geom) / m.cell_size)::int
+     AND g.cell_y = floor(ST_Y(p.geom) / m.cell_size)::int
+    WHERE m.radius = $3 AND ST_Contains(m.extent, p.geom)
+    LIMIT 1;
+  `;
+  if (!await hasTable('amenity_grid_meta')) return null; // grid not built yet
+  const result = await db.query(gridQuery, [longitude, latitude, radius]);
+  return result.rows.length > 0 ? result.rows[0] : null;
+}
+
 // Calculate location score based on amenities within 1km
 router.get('/score', async (req: Request, res: Response) => {
   try {
@@ -113,8 +148,15 @@ router.get('/score', async (req: Request, res: Response) => {
       LIMIT 1;
     `;
     
-    const waterCheck = await db.query(waterQuery, [longitude, latitude]);
-    if (waterCheck.rows.length > 0) {
+    const grid = await lookupScoreGrid(longitude, latitude, radius);
+    let onWater: boolean;
+    if (grid && grid.water_mask) {
+      onWater = grid.water;
+    } else {
+      const waterCheck = await db.query(waterQuery, [longitude, latitude]);
+      onWater = waterCheck.rows.length > 0;
+    }
+    if (onWater) {
       return res.json({
         score: 0,
         classification: 'Uninhabitable',
@@ -146,8 +188,7 @@ router.get('/score', async (req: Request, res: Response) => {
       )
     `;
 
-    const result = await db.query(query, [longitude, latitude, radius]);
-    const counts = result.rows[0];
+    const counts = grid ? grid : (await db.query(query, [longitude, latitude, radius])).rows[0];
 
     // Get user weights (default to 1 if not provided)
     const w_edu = req.query.w_edu ? parseFloat(req.query.w_edu as string) : 1;
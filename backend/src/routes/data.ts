@@ -1,12 +1,24 @@
 import { Router, Request, Response } from 'express';
 import db from '../config/db';
+import { cachedFor, hasColumn, hasTable } from '../config/schema';
 
 const router = Router();
 
+// Region partitions (buildings_london, planet_osm_point_hanoi, ...) whose recorded bounds meet
+// the envelope. ARRAY(subquery) is evaluated once at execution time, so the other partitions
+// are pruned without being scanned.
+const regionFilter = (parent: string, envelope: string) =>
+  `region = ANY(ARRAY(SELECT region FROM import_regions WHERE parent = '${parent}' AND bounds && ${envelope}))`;
+
+const isRegional = async (table: string) => await hasTable('import_regions') && await hasColumn(table, 'region');
+
 router.get('/layers', async (_req: Request, res: Response) => {
   try {
+    // Region partitions are listed through their parent table
     const result = await db.query(
-      "SELECT table_name FROM information_schema.tables WHERE table_schema = 'public' AND table_type = 'BASE TABLE'"
+      `SELECT table_name FROM information_schema.tables
+       WHERE table_schema = 'public' AND table_type = 'BASE TABLE'
+         AND table_name NOT IN (SELECT relname FROM pg_class WHERE relispartition)`
     );
     res.json(result.rows);
   } catch (error: any) {
@@ -24,16 +36,18 @@ router.get('/layers/:layerName/features', async (req: Request, res: Response) =>
 
     if (bbox) {
       const [minX, minY, maxX, maxY] = bbox.split(',').map(Number);
-      query += ` WHERE ST_Intersects(geom, ST_MakeEnvelope(${minX}, ${minY}, ${maxX}, ${maxY}, 4326))`;
+      const envelope = `ST_MakeEnvelope(${minX}, ${minY}, ${maxX}, ${maxY}, 4326)`;
+      query += ` WHERE ST_Intersects(geom, ${envelope})`;
+      // Layers partitioned by region (see data/regions.py) only scan the regions in view
+      if (await isRegional(layerName)) query += ` AND ${regionFilter(layerName, envelope)}`;
     }
 
-    query += ' LIMIT 1000';
-
-    const result = await db.query(query);
+    const result = await db.query(`${query} LIMIT 1000`);
 
     const features = result.rows.map((row: any) => ({
       type: 'Feature',
-      properties: { ...row, geometry: undefined },
+      // generated geom_3857 / centroid columns (buildings) are internal, not feature properties
+      properties: { ...row, geometry: undefined, geom_3857: undefined, centroid: undefined, region: undefined },
       geometry: JSON.parse(row.geometry)
     }));
 
@@ -98,6 +112,44 @@ router.get('/identify', async (req: Request, res: Response) => {
   }
 });
 
+// Unified search table built by data/search_index.py: accent-free search_text with a
+// pg_trgm index for substring matches and a tsvector for 2-character prefix matches.
+// Station rows are only trusted while charge_stations still matches the snapshot the
+// index was built from (the VinFast sync writes charge_stations directly). The COUNT/MAX
+// behind that check runs at most every SEARCH_FRESH_TTL_MS, not on every keystroke.
+const SEARCH_FRESH_TTL_MS = 30 * 1000;
+const searchStationsFresh = cachedFor(SEARCH_FRESH_TTL_MS, async () => {
+  const result = await db.query(`
+      SELECT (m.stations_count = c.total AND m.stations_updated_at IS NOT DISTINCT FROM c.latest) AS fresh
+      FROM search_index_meta m,
+           (SELECT COUNT(*) AS total, MAX(last_updated) AS latest FROM charge_stations) c;
+    `);
+  return result.rows.length > 0 && result.rows[0].fresh === true;
+});
+
+const buildIndexedSearchQuery = (shortQuery: boolean, stationsFresh: boolean) => {
+  const match = shortQuery
+    ? `s.tsv @@ to_tsquery('simple', quote_literal(q.text) || ':*')`
+    : `s.search_text LIKE '%' || q.text || '%'`;
+  return `
+      WITH q AS (SELECT search_normalize($1) AS text)
+      SELECT name, address, type, lon, lat FROM (
+        SELECT s.name, s.address, s.type, s.lon, s.lat, similarity(s.search_text, q.text) AS rank
+        FROM search_index s, q
+        WHERE ${match}${stationsFresh ? '' : ` AND s.type <> 'charging_station'`}
+        ${stationsFresh ? '' : `
+        UNION ALL
+
+        SELECT c.name, c.address, 'charging_station' AS type, c.lon, c.lat,
+               similarity(search_normalize(concat_ws(' ', c.name, c.address)), q.text) AS rank
+        FROM charge_stations c, q
+        WHERE c.name ILIKE $2 OR c.address ILIKE $2`}
+      ) matches
+      ${shortQuery ? '' : 'ORDER BY rank DESC'}
+      LIMIT 20;
+    `;
+};
+
 // Search for features by name
 router.get('/search', async (req: Request, res: Response) => {
   try {
@@ -108,6 +160,15 @@ router.get('/search', async (req: Request, res: Response) => {
     }
 
     const searchTerm = `%${q}%`;
+
+    if (await hasTable('search_index')) { // else search_index.py not run yet
+      const stationsFresh = await searchStationsFresh();
+      // Trigrams need 3 characters; shorter queries match word prefixes instead
+      const shortQuery = q.trim().length < 3;
+      const result = await db.query(buildIndexedSearchQuery(shortQuery, stationsFresh),
+                                    stationsFresh ? [q] : [q, searchTerm]);
+      return res.json(result.rows);
+    }
     
     // Search in points, polygons, AND charging stations
     const query = `
@@ -139,23 +200,10 @@ router.get('/search', async (req: Request, res: Response) => {
   }
 });
 
-// Filter features by type (amenity) within a bounding box
-router.get('/filter', async (req: Request, res: Response) => {
-  try {
-    const { type, bbox } = req.query as { type: string; bbox: string };
-    
-    if (!type || !bbox) {
-      return res.status(400).json({ error: 'Missing type or bbox parameter' });
-    }
-
-    // Split, trim, and lowercase types
-    const types = type.split(',').map(t => t.trim().toLowerCase());
-    const [minX, minY, maxX, maxY] = bbox.split(',').map(Number);
-    
-    console.log(`Filtering for types: ${JSON.stringify(types)} in bbox: ${bbox}`);
-
-    // Query points matching the amenity type within the view
-    const query = `
+// way_4326 is a generated copy of way added by data/projections.py: coordinates come
+// straight from it and the bbox test is a plain && against its GIST index.
+// regional limits the scan to the region partitions in view (data/regions.py).
+const buildFilterQuery = (projected: boolean, regional: boolean) => `
       SELECT json_build_object(
         'type', 'FeatureCollection',
         'features', json_agg(
@@ -163,7 +211,9 @@ router.get('/filter', async (req: Request, res: Response) => {
             'type', 'Feature',
             'geometry', json_build_object(
               'type', 'Point',
-              'coordinates', json_build_array(ST_X(ST_Transform(way, 4326)), ST_Y(ST_Transform(way, 4326)))
+              'coordinates', ${projected
+                ? 'json_build_array(ST_X(way_4326), ST_Y(way_4326))'
+                : 'json_build_array(ST_X(ST_Transform(way, 4326)), ST_Y(ST_Transform(way, 4326)))'}
             ),
             'properties', json_build_object(
               'name', name,
@@ -174,11 +224,32 @@ router.get('/filter', async (req: Request, res: Response) => {
       ) as geojson
       FROM planet_osm_point
       WHERE amenity = ANY($1)
-      AND ST_Intersects(way, ST_Transform(ST_MakeEnvelope($2, $3, $4, $5, 4326), 3857))
+      AND ${projected
+        ? 'way_4326 && ST_MakeEnvelope($2, $3, $4, $5, 4326)'
+        : 'ST_Intersects(way, ST_Transform(ST_MakeEnvelope($2, $3, $4, $5, 4326), 3857))'}
+      ${regional ? `AND ${regionFilter('planet_osm_point', 'ST_MakeEnvelope($2, $3, $4, $5, 4326)')}` : ''}
       LIMIT 500;
     `;
 
-    const result = await db.query(query, [types, minX, minY, maxX, maxY]);
+// Filter features by type (amenity) within a bounding box
+router.get('/filter', async (req: Request, res: Response) => {
+  try {
+    const { type, bbox } = req.query as { type: string; bbox: string };
+    
+    if (!type || !bbox) {
+      return res.status(400).json({ error: 'Missing type or bbox parameter' });
+    }
+
+    // Split, trim, and lowercase types
+    const types = type.split(',').map(t => t.trim().toLowerCase());
+    const [minX, minY, maxX, maxY] = bbox.split(',').map(Number);
+    
+    console.log(`Filtering for types: ${JSON.stringify(types)} in bbox: ${bbox}`);
+
+    // Query points matching the amenity type within the view
+    const params = [types, minX, minY, maxX, maxY];
+    const projected = await hasColumn('planet_osm_point', 'way_4326'); // else projections.py not run yet
+    const result = await db.query(buildFilterQuery(projected, await isRegional('planet_osm_point')), params);
     
     // If no results, return empty feature collection
     if (!result.rows[0].geojson) {
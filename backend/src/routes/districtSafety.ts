@@ -3,15 +3,23 @@ import db from '../config/db';
 
 const router = Router();
 
-// GET /district-safety
-router.get('/', async (req: Request, res: Response) => {
-  try {
-    const query = `
+// Ranh giới trả về lấy từ bảng đã đơn giản hóa (data/generalize.py) nếu có;
+// phép đếm trạm vẫn dùng d.geom đầy đủ chi tiết.
+const geomColumn = (simplified: boolean) =>
+  simplified ? 'ST_AsGeoJSON(COALESCE(ds.geom, d.geom), 6)' : 'ST_AsGeoJSON(d.geom)';
+const simplifiedJoin = (simplified: boolean) =>
+  simplified ? 'LEFT JOIN hanoi_districts_simplified ds ON ds.id = d.id' : '';
+
+// d.geom_3857 (data/projections.py) cùng hệ tọa độ với s.geom nên không phải chuyển đổi từng trạm
+const stationJoin = (projected: boolean) =>
+  projected ? 'ST_Intersects(d.geom_3857, s.geom)' : 'ST_Intersects(d.geom, ST_Transform(s.geom, ST_SRID(d.geom)))';
+
+const buildQuery = (simplified: boolean, projected: boolean) => `
       SELECT 
         d.id,
         d.ten_xa,
         d.dan_so,
-        ST_AsGeoJSON(d.geom) AS geom_geojson,
+        ${geomColumn(simplified)} AS geom_geojson,
         -- Sử dụng DISTINCT geom để tránh đếm trùng các trạm có cùng tọa độ (do lỗi import hoặc dữ liệu rác)
         COUNT(DISTINCT s.geom) AS total_stations,
         
@@ -23,11 +31,60 @@ router.get('/', async (req: Request, res: Response) => {
         COUNT(DISTINCT CASE WHEN s.status = 'Open' OR s.status = 'Hoạt động' OR s.status = 'Đang hoạt động' OR s.status = '1' THEN s.geom END) AS open_stations,
         COUNT(DISTINCT CASE WHEN s.status = 'Maintenance' OR s.status = 'Bảo trì' THEN s.geom END) AS maintenance_stations
       FROM hanoi_districts d
+      ${simplifiedJoin(simplified)}
       LEFT JOIN charge_stations s
-        ON ST_Intersects(d.geom, ST_Transform(s.geom, ST_SRID(d.geom)))
-      GROUP BY d.id, d.ten_xa, d.dan_so, d.geom;
+        ON ${stationJoin(projected)}
+      GROUP BY d.id, d.ten_xa, d.dan_so, ${simplified ? 'ds.id' : 'd.geom'};
+    `;
+
+// Thống kê tính sẵn bởi data/district_stats.py (cùng quy tắc đếm như truy vấn trên)
+const buildPrecomputedQuery = (simplified: boolean) => `
+      SELECT
+        d.id,
+        d.ten_xa,
+        d.dan_so,
+        ${geomColumn(simplified)} AS geom_geojson,
+        COALESCE(st.total_stations, 0)::bigint AS total_stations,
+        COALESCE(st.battery_stations, 0)::bigint AS battery_stations,
+        COALESCE(st.charging_stations, 0)::bigint AS charging_stations,
+        COALESCE(st.open_stations, 0)::bigint AS open_stations,
+        COALESCE(st.maintenance_stations, 0)::bigint AS maintenance_stations
+      FROM hanoi_districts d
+      ${simplifiedJoin(simplified)}
+      LEFT JOIN district_station_stats st ON st.district_id = d.id;
+    `;
+
+// Bảng thống kê chỉ dùng được khi charge_stations chưa thay đổi kể từ lần tính
+const freshnessQuery = `
+      SELECT (m.source_count = c.total AND m.source_updated_at IS NOT DISTINCT FROM c.latest) AS fresh
+      FROM district_station_stats_meta m,
+           (SELECT COUNT(*) AS total, MAX(last_updated) AS latest FROM charge_stations) c;
     `;
-    const result = await db.query(query);
+
+const statsAreFresh = async () => {
+  try {
+    const result = await db.query(freshnessQuery);
+    return result.rows.length > 0 && result.rows[0].fresh === true;
+  } catch (err: any) {
+    if (err.code === '42P01') return false; // undefined_table: chưa chạy district_stats.py
+    throw err;
+  }
+};
+
+// GET /district-safety
+router.get('/', async (req: Request, res: Response) => {
+  try {
+    const fresh = await statsAreFresh();
+    const run = async (simplified: boolean, projected: boolean): Promise<any> => {
+      try {
+        return await db.query(fresh ? buildPrecomputedQuery(simplified) : buildQuery(simplified, projected));
+      } catch (err: any) {
+        if (err.code === '42P01' && simplified) return run(false, projected); // undefined_table: chưa chạy generalize.py
+        if (err.code === '42703' && projected) return run(simplified, false); // undefined_column: chưa chạy projections.py
+        throw err;
+      }
+    };
+    const result = await run(true, true);
     
     // DEBUG: Log first row to see if counts are working
     if (result.rows.length > 0) {
@@ -1,5 +1,6 @@
 import { Router, Request, Response } from 'express';
 import db from '../config/db';
+import { cachedFor, hasTable } from '../config/schema';
 import https from 'https';
 import fs from 'fs';
 import { chromium } from 'playwright';
@@ -166,6 +167,7 @@ export const syncChargingStations = async (force: boolean = false) => {
         }
         
         console.log(`Đồng bộ hoàn tất. Mới: ${newCount}, Cập nhật: ${updateCount}`);
+        clustersAreFresh.clear(); // charge_stations vừa đổi: kiểm tra lại bảng cụm ở request sau
         return { total: data.length, new: newCount, updated: updateCount };
 
     } catch (error: any) {
@@ -249,4 +251,105 @@ router.get('/geojson', async (req: Request, res: Response) => {
     }
 });
 
+// 3. API: Cụm trạm theo khung nhìn và mức zoom (bảng station_clusters do data/station_clusters.py tính sẵn)
+// GET /clusters?bbox=minLon,minLat,maxLon,maxLat&zoom=12
+const CLUSTER_MAX_ZOOM = 18;
+
+// Ô slippy-map chứa (lon, lat) ở mức zoom, cùng cách tính tile_x/tile_y trong station_clusters.py
+const tileX = (lon: number, zoom: number) => {
+    const n = 2 ** zoom;
+    return Math.min(n - 1, Math.max(0, Math.floor((lon / 360 + 0.5) * n)));
+};
+const tileY = (lat: number, zoom: number) => {
+    const n = 2 ** zoom;
+    const sin = Math.sin((Math.max(-85.0511, Math.min(85.0511, lat)) * Math.PI) / 180);
+    const y = 0.5 - (0.25 * Math.log((1 + sin) / (1 - sin))) / Math.PI;
+    return Math.min(n - 1, Math.max(0, Math.floor(y * n)));
+};
+
+// Bảng cụm chỉ dùng được khi charge_stations chưa thay đổi kể từ lần tính.
+// COUNT/MAX trên charge_stations chỉ chạy mỗi CLUSTERS_FRESH_TTL_MS thay vì mỗi request;
+// đồng bộ VinFast xoá kết quả ngay, station_sink.py / station_clusters.py có hiệu lực sau tối đa TTL.
+const CLUSTERS_FRESH_TTL_MS = 30 * 1000;
+const clustersAreFresh = cachedFor(CLUSTERS_FRESH_TTL_MS, async () => {
+    if (!await hasTable('station_clusters_meta')) return false; // chưa chạy station_clusters.py
+    const result = await db.query(`
+        SELECT (m.source_count = c.total AND m.source_updated_at IS NOT DISTINCT FROM c.latest) AS fresh
+        FROM station_clusters_meta m,
+             (SELECT COUNT(*) AS total, MAX(last_updated) AS latest FROM charge_stations) c
+    `);
+    return result.rows.length > 0 && result.rows[0].fresh === true;
+});
+
+const stationProperties = (row: any) => ({
+    id: row.id,
+    name: row.name,
+    address: row.address,
+    category: row.category,
+    hotline: row.hotline,
+    status: row.status,
+    open_time: row.open_time,
+    close_time: row.close_time,
+    type: 'charging_station'
+});
+
+router.get('/clusters', async (req: Request, res: Response) => {
+    try {
+        const bbox = String(req.query.bbox || '').split(',').map(Number);
+        const zoom = Math.floor(Number(req.query.zoom));
+        if (bbox.length !== 4 || bbox.some(isNaN) || isNaN(zoom)) {
+            return res.status(400).json({ error: 'Cần bbox=minLon,minLat,maxLon,maxLat và zoom' });
+        }
+        const [minLon, minLat, maxLon, maxLat] = bbox;
+        // Trên zoom 18 không còn gộp thêm: dùng luôn mức 18
+        const z = Math.max(0, Math.min(CLUSTER_MAX_ZOOM, zoom));
+
+        let features: any[];
+        if (await clustersAreFresh()) {
+            // Mỗi ô ở mức z chỉ chứa một số cụm giới hạn nên payload không tăng theo số trạm
+            const result = await db.query(`
+                SELECT c.cluster_id, c.point_count, c.expansion_zoom, c.lon, c.lat, c.categories, c.statuses,
+                       s.id, s.name, s.address, s.category, s.hotline, s.status, s.open_time, s.close_time
+                FROM station_clusters c
+                LEFT JOIN charge_stations s ON s.id = c.station_id
+                WHERE c.zoom = $1 AND c.tile_x BETWEEN $2 AND $3 AND c.tile_y BETWEEN $4 AND $5
+            `, [z, tileX(minLon, z), tileX(maxLon, z), tileY(maxLat, z), tileY(minLat, z)]);
+            features = result.rows.map((row: any) => ({
+                type: 'Feature',
+                properties: row.cluster_id === null ? { ...stationProperties(row), point_count: 1 } : {
+                    cluster: true,
+                    cluster_id: row.cluster_id,
+                    point_count: row.point_count,
+                    expansion_zoom: row.expansion_zoom,
+                    categories: row.categories,
+                    statuses: row.statuses,
+                    type: 'station_cluster'
+                },
+                geometry: { type: 'Point', coordinates: [row.lon, row.lat] }
+            }));
+        } else {
+            // Chưa tính hoặc đã cũ: trả từng trạm trong khung nhìn
+            const result = await db.query(`
+                SELECT id, name, address, category, hotline, status, open_time, close_time,
+                       ST_X(ST_Transform(geom, 4326)) AS lon, ST_Y(ST_Transform(geom, 4326)) AS lat
+                FROM charge_stations
+                WHERE geom && ST_Transform(ST_MakeEnvelope($1, $2, $3, $4, 4326), 3857)
+            `, [Math.max(minLon, 102), Math.max(minLat, 8), Math.min(maxLon, 115), Math.min(maxLat, 24)]);
+            features = result.rows.map((row: any) => ({
+                type: 'Feature',
+                properties: { ...stationProperties(row), point_count: 1 },
+                geometry: { type: 'Point', coordinates: [row.lon, row.lat] }
+            }));
+        }
+
+        res.json({
+            type: 'FeatureCollection',
+            features: features
+        });
+
+    } catch (error: any) {
+        res.status(500).json({ error: error.message });
+    }
+});
+
 export default router;
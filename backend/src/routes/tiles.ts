@@ -1,10 +1,120 @@
 import { Router, Request, Response } from 'express';
+import fs from 'fs';
+import Database from 'better-sqlite3';
 // import * as path from 'path';
 // import mapnik = require('mapnik');
 // @ts-ignore
 import SphericalMercator = require('@mapbox/sphericalmercator');
 
 const router = Router();
+
+// Tile đã render sẵn bởi data/seed_tiles.py (docker-compose mount ./data vào /data).
+// Raster không có bộ render: chỉ phục vụ nếu có sẵn một file MBTiles dạng png/jpg/webp.
+const VECTOR_MBTILES = process.env.VECTOR_MBTILES || '/data/tiles.mbtiles';
+const RASTER_MBTILES = process.env.RASTER_MBTILES || '/data/raster.mbtiles';
+
+// Một file MBTiles chỉ đọc; mở lại khi file bị thay thế (seed lại từ đầu)
+class MBTiles {
+    private db: Database.Database | null = null;
+    private inode = 0;
+    private meta: Record<string, string> = {};
+
+    constructor(private file: string) {}
+
+    private open(): boolean {
+        let stat: fs.Stats;
+        try {
+            stat = fs.statSync(this.file);
+        } catch {
+            this.close();
+            return false;
+        }
+        if (this.db && stat.ino === this.inode) return true;
+        this.close();
+        this.db = new Database(this.file, { readonly: true, fileMustExist: true });
+        this.inode = stat.ino;
+        const rows = this.db.prepare('SELECT name, value FROM metadata').all() as { name: string; value: string }[];
+        this.meta = Object.fromEntries(rows.map(r => [r.name, r.value]));
+        return true;
+    }
+
+    private close() {
+        this.db?.close();
+        this.db = null;
+    }
+
+    get format() {
+        return this.meta.format || 'pbf';
+    }
+
+    // Ô nằm trong vùng đã seed: thiếu trong bảng tiles nghĩa là tile rỗng (seed_tiles.py xoá tile rỗng)
+    private seeded(z: number, x: number, y: number) {
+        const minZoom = parseInt(this.meta.minzoom ?? '0', 10);
+        const maxZoom = parseInt(this.meta.maxzoom ?? '22', 10);
+        if (z < minZoom || z > maxZoom) return false;
+        if (!this.meta.bounds) return true;
+        const [minLon, minLat, maxLon, maxLat] = this.meta.bounds.split(',').map(Number);
+        const n = 2 ** z;
+        const lon = (v: number) => (v / n) * 360 - 180;
+        const lat = (v: number) => (Math.atan(Math.sinh(Math.PI * (1 - (2 * v) / n))) * 180) / Math.PI;
+        return lon(x + 1) >= minLon && lon(x) <= maxLon && lat(y + 1) <= maxLat && lat(y) >= minLat;
+    }
+
+    // undefined: chưa có file MBTiles; null: tile không được seed
+    tile(z: number, x: number, y: number): Buffer | null | undefined {
+        if (!this.open()) return undefined;
+        // MBTiles đánh số hàng theo TMS
+        const row = this.db!.prepare(
+            'SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?'
+        ).get(z, x, 2 ** z - 1 - y) as { tile_data: Buffer } | undefined;
+        if (row) return row.tile_data;
+        return this.seeded(z, x, y) ? Buffer.alloc(0) : null;
+    }
+}
+
+const vectorTiles = new MBTiles(VECTOR_MBTILES);
+const rasterTiles = new MBTiles(RASTER_MBTILES);
+
+const MIME_TYPES: Record<string, string> = {
+    pbf: 'application/x-protobuf',
+    png: 'image/png',
+    jpg: 'image/jpeg',
+    webp: 'image/webp',
+};
+
+// Trả tile đã render sẵn; false khi không có file MBTiles
+const serveTile = (tiles: MBTiles, req: Request, res: Response): boolean => {
+    const z = parseInt(req.params.z, 10);
+    const x = parseInt(req.params.x, 10);
+    const y = parseInt(req.params.y, 10);
+    if ([z, x, y].some(isNaN) || z < 0 || x < 0 || y < 0 || x >= 2 ** z || y >= 2 ** z) {
+        res.status(400).send('Invalid tile coordinates');
+        return true;
+    }
+    let data: Buffer | null | undefined;
+    try {
+        data = tiles.tile(z, x, y);
+    } catch (error: any) {
+        console.error('MBTiles error:', error);
+        res.status(500).json({ error: error.message });
+        return true;
+    }
+    if (data === undefined) return false;
+    if (data === null) {
+        res.status(404).send('Tile not pre-seeded');
+        return true;
+    }
+    res.setHeader('Cache-Control', 'public, max-age=300');
+    if (data.length === 0) {
+        res.status(204).end();
+        return true;
+    }
+    res.type(MIME_TYPES[tiles.format] || 'application/octet-stream');
+    // seed_tiles.py lưu pbf dạng gzip
+    if (data[0] === 0x1f && data[1] === 0x8b) res.setHeader('Content-Encoding', 'gzip');
+    res.send(data);
+    return true;
+};
 // const mercator = new (SphericalMercator as any)({ size: 256 });
 
 /*
@@ -14,7 +124,8 @@ if ((mapnik as any).register_default_input_plugins) {
 */
 
 router.get('/raster/:z/:x/:y.png', async (req: Request, res: Response) => {
-    res.status(503).send('Mapnik disabled');
+    if (serveTile(rasterTiles, req, res)) return;
+    res.status(503).send('Mapnik disabled and no raster MBTiles at ' + RASTER_MBTILES);
     /*
     const { z, x, y } = req.params;
     const zoom = parseInt(z, 10);
@@ -41,7 +152,8 @@ router.get('/raster/:z/:x/:y.png', async (req: Request, res: Response) => {
 });
 
 router.get('/vector/:z/:x/:y.mvt', async (req: Request, res: Response) => {
-    res.status(503).send('Mapnik disabled');
+    if (serveTile(vectorTiles, req, res)) return;
+    res.status(503).send('Mapnik disabled and no pre-seeded tiles at ' + VECTOR_MBTILES + ' (run data/seed_tiles.py)');
     /*
     const { z, x, y } = req.params;
     const zoom = parseInt(z, 10);
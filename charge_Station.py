@@ -1,6 +1,15 @@
-import requests
+import argparse
+import asyncio
+import csv
+import hashlib
 import json
-import pandas as pd
+import os
+import random
+import sys
+import time
+from urllib.parse import urlencode
+
+import aiohttp
 
 # Giả lập Header để không bị website chặn (403 Forbidden)
 headers = {
@@ -9,34 +18,334 @@ headers = {
 }
 
 # URL API mà bạn 'bắt' được ở Bước 2
-api_url = "https://api.v-green.vn/v1/stations/public" 
+api_url = "https://api.v-green.vn/v1/stations/public"
+
+# Tên tham số phân trang / lọc theo tỉnh của API (chỉnh theo API thực tế)
+PAGE_PARAM = 'page'
+SIZE_PARAM = 'limit'
+PROVINCE_PARAM = 'province'
+PAGE_SIZE = 100
+
+# Tiền tố external_id trong charge_stations, để không trùng với store id của VinFast
+STATION_SOURCE = 'vgreen'
+
+CONCURRENCY = 4          # số request song song tối đa
+RATE_LIMIT = 5.0         # request / giây
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0       # giây, nhân đôi sau mỗi lần thử lại
+TIMEOUT = 30             # giây cho mỗi request
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+CACHE_DIR = '.station_cache'  # ETag / Last-Modified + body của từng trang
+OUTPUT_CSV = 'tram_sac_2026.csv'
+CSV_FIELDS = ['name', 'lat', 'lng', 'address', 'type', 'status']
+
+# Các module nạp PostGIS nằm trong data/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+
+
+class RateLimiter:
+    """Token bucket: tối đa `rate` request mỗi giây, cho phép burst bằng `rate`"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class PageCache:
+    """Lưu validator (ETag / Last-Modified) và body của từng URL để gửi request có điều kiện"""
+
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.json')
+
+    def load(self, url):
+        try:
+            with open(self._path(url), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, url, etag, last_modified, body):
+        with open(self._path(url), 'w', encoding='utf-8') as f:
+            json.dump({'url': url, 'etag': etag, 'last_modified': last_modified, 'body': body}, f)
+
+
+class StationCrawler:
+    """
+    Crawler asyncio dùng chung một aiohttp session (connection pool):
+    - tải song song các trang / tỉnh, giới hạn bởi CONCURRENCY và RATE_LIMIT
+    - thử lại với exponential backoff (tôn trọng Retry-After)
+    - gửi If-None-Match / If-Modified-Since; trang 304 được đọc lại từ cache
+    """
+
+    def __init__(self, url=api_url, concurrency=CONCURRENCY, rate=RATE_LIMIT,
+                 page_size=PAGE_SIZE, cache_dir=CACHE_DIR):
+        self.url = url
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.limiter = RateLimiter(rate)
+        self.cache = PageCache(cache_dir)
+        self.stats = {'requests': 0, 'not_modified': 0, 'retries': 0, 'pages': 0}
+
+    async def fetch_page(self, session, params):
+        """Trả về (JSON của trang, có thay đổi hay không)"""
+        key = f"{self.url}?{urlencode(sorted(params.items()))}"
+        cached = self.cache.load(key)
+        conditional = {}
+        if cached and cached.get('etag'):
+            conditional['If-None-Match'] = cached['etag']
+        if cached and cached.get('last_modified'):
+            conditional['If-Modified-Since'] = cached['last_modified']
+
+        for attempt in range(MAX_RETRIES + 1):
+            await self.limiter.acquire()
+            self.stats['requests'] += 1
+            try:
+                async with session.get(self.url, params=params, headers=conditional) as resp:
+                    if resp.status == 304 and cached:
+                        self.stats['not_modified'] += 1
+                        return json.loads(cached['body']), False
+                    if resp.status in RETRY_STATUSES and attempt < MAX_RETRIES:
+                        retry_after = resp.headers.get('Retry-After', '')
+                        await self._backoff(attempt, float(retry_after) if retry_after.isdigit() else None)
+                        continue
+                    resp.raise_for_status()
+                    body = await resp.text()
+                    data = json.loads(body)
+                    self.cache.save(key, resp.headers.get('ETag'), resp.headers.get('Last-Modified'), body)
+                    return data, True
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt == MAX_RETRIES:
+                    raise
+                await self._backoff(attempt)
+        raise aiohttp.ClientError(f"Hết số lần thử lại cho {key}")
+
+    async def _backoff(self, attempt, retry_after=None):
+        self.stats['retries'] += 1
+        delay = retry_after if retry_after is not None else BACKOFF_BASE * 2 ** attempt
+        await asyncio.sleep(delay + random.uniform(0, BACKOFF_BASE / 2))
+
+    @staticmethod
+    def _items(data):
+        # Tùy vào cấu trúc JSON trả về
+        if isinstance(data, list):
+            return data
+        items = data.get('data', [])
+        if isinstance(items, dict):  # {"data": {"items": [...], "total": N}}
+            items = items.get('items', [])
+        return items
 
-def crawl_stations():
+    @staticmethod
+    def _page_count(data, page_size):
+        """Số trang nếu API trả về tổng số (total / last_page), ngược lại None"""
+        if not isinstance(data, dict):
+            return None
+        for meta in (data, data.get('meta') or {}, data.get('data') if isinstance(data.get('data'), dict) else {}):
+            if meta.get('last_page'):
+                return int(meta['last_page'])
+            if meta.get('total'):
+                return -(-int(meta['total']) // page_size)
+        return None
+
+    async def _crawl_listing(self, session, province, queue):
+        """Tải mọi trang của một listing (một tỉnh hoặc toàn bộ), đẩy từng trang vào queue"""
+        base = {SIZE_PARAM: self.page_size}
+        if province:
+            base[PROVINCE_PARAM] = province
+
+        first, changed = await self.fetch_page(session, dict(base, **{PAGE_PARAM: 1}))
+        await queue.put((self._items(first), changed))
+        if len(self._items(first)) < self.page_size:
+            return
+
+        pages = self._page_count(first, self.page_size)
+        if pages:
+            # Biết trước số trang: tải song song tất cả
+            async def fetch(page):
+                data, page_changed = await self.fetch_page(session, dict(base, **{PAGE_PARAM: page}))
+                await queue.put((self._items(data), page_changed))
+            await asyncio.gather(*(fetch(page) for page in range(2, pages + 1)))
+            return
+
+        # Không biết số trang: tải từng cửa sổ CONCURRENCY trang cho tới khi gặp trang thiếu
+        page = 2
+        while True:
+            window = range(page, page + self.concurrency)
+            results = await asyncio.gather(
+                *(self.fetch_page(session, dict(base, **{PAGE_PARAM: p})) for p in window))
+            done = False
+            for data, page_changed in results:
+                items = self._items(data)
+                if items:
+                    await queue.put((items, page_changed))
+                if len(items) < self.page_size:
+                    done = True
+            if done:
+                return
+            page += self.concurrency
+
+    async def iter_stations(self, provinces=None, changed_only=False):
+        """
+        Async generator trả về từng trạm thô (dict) ngay khi trang của nó tải xong.
+        changed_only=True bỏ qua các trang không đổi (304).
+        """
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        timeout = aiohttp.ClientTimeout(total=TIMEOUT)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        async with aiohttp.ClientSession(headers=headers, timeout=timeout, connector=connector) as session:
+            async def produce():
+                try:
+                    await asyncio.gather(*(self._crawl_listing(session, p, queue) for p in (provinces or [None])))
+                finally:
+                    await queue.put(None)
+
+            producer = asyncio.create_task(produce())
+            try:
+                while True:
+                    page = await queue.get()
+                    if page is None:
+                        break
+                    items, changed = page
+                    self.stats['pages'] += 1
+                    if changed_only and not changed:
+                        continue
+                    for item in items:
+                        yield item
+                await producer  # lỗi của producer (nếu có) được ném ra ở đây
+            finally:
+                if not producer.done():
+                    producer.cancel()
+
+
+def refine(s):
+    # Trích xuất các trường cần thiết cho GIS
+    return {
+        'name': s.get('name'),
+        'lat': s.get('latitude'),
+        'lng': s.get('longitude'),
+        'address': s.get('address'),
+        'type': s.get('station_type'), # Sạc nhanh/thường
+        'status': s.get('status')      # Đang trống/Đầy
+    }
+
+
+def to_station_record(s):
+    # Bản ghi cho PostGIS sink (data/station_sink.py)
+    return {
+        'external_id': s.get('id') or s.get('station_id') or s.get('code'),
+        'name': s.get('name'),
+        'lat': s.get('latitude'),
+        'lng': s.get('longitude'),
+        'address': s.get('address'),
+        'city': s.get('province') or s.get('city'),
+        'category': s.get('station_type'),
+        'status': s.get('status')
+    }
+
+
+async def crawl_to_postgis(crawler, provinces=None):
+    """Đẩy thẳng vào charge_stations: COPY vào bảng tạm + một lệnh INSERT ... ON CONFLICT"""
+    import psycopg2
+    from import_osm_data import DB_CONFIG
+    from station_sink import sink_stations
+
+    async def records():
+        async for station in crawler.iter_stations(provinces):
+            yield to_station_record(station)
+
+    conn = psycopg2.connect(**DB_CONFIG)
     try:
-        response = requests.get(api_url, headers=headers)
-        if response.status_code == 200:
-            data = response.json()
-            stations = data.get('data', []) # Tùy vào cấu trúc JSON trả về
-            
-            # Trích xuất các trường cần thiết cho GIS
-            refined_data = []
-            for s in stations:
-                refined_data.append({
-                    'name': s.get('name'),
-                    'lat': s.get('latitude'),
-                    'lng': s.get('longitude'),
-                    'address': s.get('address'),
-                    'type': s.get('station_type'), # Sạc nhanh/thường
-                    'status': s.get('status')      # Đang trống/Đầy
-                })
-            
-            # Lưu ra file CSV để dễ kiểm tra
-            df = pd.DataFrame(refined_data)
-            df.to_csv('tram_sac_2026.csv', index=False, encoding='utf-8-sig')
-            print(f"Đã cào xong {len(refined_data)} trạm sạc!")
-            
+        counts = await sink_stations(conn, records(), source=STATION_SOURCE)
+        if counts['inserted'] or counts['updated']:
+            # Thống kê theo xã/phường, search_index và cụm trạm phụ thuộc vào charge_stations
+            from district_stats import refresh_district_stats
+            from search_index import refresh_search_index
+            from station_clusters import refresh_station_clusters
+            refresh_district_stats(conn)
+            refresh_search_index(conn, ['charging_station'])
+            refresh_station_clusters(conn)
+    finally:
+        conn.close()
+    return counts['received']
+
+
+async def crawl_to_parquet(crawler, output, provinces=None):
+    """Ghi GeoParquet (cột có kiểu, hình học WKB) theo từng row group khi dữ liệu về"""
+    from geoparquet import CRAWLER_COLUMNS, SnapshotWriter, point_wkb
+
+    count = 0
+    with SnapshotWriter(output, CRAWLER_COLUMNS, ['Point']) as writer:
+        async for station in crawler.iter_stations(provinces):
+            row = refine(station)
+            try:
+                lat, lng = float(row['lat']), float(row['lng'])
+            except (TypeError, ValueError):
+                lat = lng = None
+            geometry = point_wkb(lng, lat) if lat is not None else None
+            bbox = (lng, lat, lng, lat) if lat is not None else None
+            writer.write((row['name'], lat, lng, row['address'],
+                          None if row['type'] is None else str(row['type']),
+                          None if row['status'] is None else str(row['status']), geometry, bbox))
+            count += 1
+    return count
+
+
+async def crawl_to_csv(crawler, output=OUTPUT_CSV, provinces=None):
+    """Ghi từng trạm ra CSV ngay khi nhận được (không giữ toàn bộ trong bộ nhớ)"""
+    count = 0
+    with open(output, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        async for station in crawler.iter_stations(provinces):
+            writer.writerow(refine(station))
+            count += 1
+    return count
+
+
+def crawl_stations(url=api_url, output=OUTPUT_CSV, provinces=None,
+                   concurrency=CONCURRENCY, rate=RATE_LIMIT, postgis=False):
+    crawler = StationCrawler(url, concurrency, rate)
+    try:
+        if postgis:
+            count = asyncio.run(crawl_to_postgis(crawler, provinces))
+        elif output.endswith('.parquet'):
+            count = asyncio.run(crawl_to_parquet(crawler, output, provinces))
+        else:
+            count = asyncio.run(crawl_to_csv(crawler, output, provinces))
+        stats = crawler.stats
+        print(f"Đã cào xong {count} trạm sạc! ({stats['pages']} trang, {stats['requests']} request, "
+              f"{stats['not_modified']} không đổi, {stats['retries']} lần thử lại)")
+        return count
     except Exception as e:
         print(f"Lỗi rồi ông giáo ạ: {e}")
+        return None
+
 
 if __name__ == "__main__":
-    crawl_stations()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Cào danh sách trạm sạc')
+    parser.add_argument('--url', default=api_url)
+    parser.add_argument('--output', default=OUTPUT_CSV, help='.csv hoặc .parquet (GeoParquet)')
+    parser.add_argument('--provinces', help='Danh sách mã tỉnh, cách nhau bởi dấu phẩy')
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY)
+    parser.add_argument('--rate', type=float, default=RATE_LIMIT, help='request / giây')
+    parser.add_argument('--postgis', action='store_true', help='Ghi thẳng vào bảng charge_stations thay vì CSV')
+    args = parser.parse_args()
+    crawl_stations(args.url, args.output, args.provinces.split(',') if args.provinces else None,
+                   args.concurrency, args.rate, args.postgis)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Precompute the /analysis/score inputs on a fixed grid
+Amenity points from planet_osm_point are binned into CELL_SIZE cells (EPSG:3857),
+summed over a SCORE_RADIUS disk around every cell with NumPy, and written with
+a water mask to amenity_grid (one row per non-empty cell, keyed on the cell
+index). A score lookup is then a single primary-key read.
+
+Re-run after every import. Requires numpy.
+
+Usage:
+  python amenity_grid.py [cell_size_m]
+"""
+
+import math
+import sys
+import time
+
+import numpy as np
+import psycopg2
+
+from bulk_load import copy_rows
+from import_osm_data import DB_CONFIG
+
+CELL_SIZE = 100.0  # metres (EPSG:3857 units, like the live ST_DWithin query)
+SCORE_RADIUS = 1000.0  # must match the radius used by /analysis/score
+MAX_CELLS = 50_000_000  # refuse grids that would not fit in memory
+
+# Same categories as the live COUNT(*) FILTER query in backend/src/routes/analysis.ts
+CATEGORIES = {
+    'schools': ('school',),
+    'universities': ('university', 'college'),
+    'kindergartens': ('kindergarten',),
+    'health': ('hospital', 'clinic', 'doctors', 'pharmacy'),
+    'services': ('bank', 'atm', 'post_office', 'police', 'fire_station'),
+    'shopping': ('marketplace', 'supermarket', 'convenience'),
+    'leisure': ('cafe', 'restaurant', 'fast_food', 'bar', 'pub', 'cinema', 'park'),
+    'parking': ('parking',),
+    'fuel': ('fuel',),
+}
+
+WATER_FILTER = """("natural" IN ('water', 'wetland', 'bay') OR waterway IS NOT NULL
+                   OR landuse IN ('reservoir', 'basin'))"""
+
+
+def disk_sum(grid, radius_cells):
+    """
+    Sum grid over every cell whose centre lies within radius_cells of each cell's centre.
+    Uses a row-wise prefix sum, so the cost is one array add per kernel row.
+    """
+    h, w = grid.shape
+    r = int(radius_cells)
+    padded = np.zeros((h + 2 * r, w + 2 * r + 1), dtype=np.int64)
+    padded[r:r + h, r + 1:r + 1 + w] = grid
+    csum = np.cumsum(padded, axis=1)
+    out = np.zeros((h, w), dtype=np.int64)
+    for dy in range(-r, r + 1):
+        half = int(math.floor(math.sqrt(radius_cells ** 2 - dy ** 2)))
+        rows = csum[r + dy:r + dy + h]
+        out += rows[:, r + 1 + half:r + 1 + half + w] - rows[:, r - half:r - half + w]
+    return out
+
+
+def _grid_extent(cur, cell_size, radius):
+    """(i0, j0, width, height) in cell indices covering the amenity points plus radius"""
+    cur.execute("""
+        SELECT ST_XMin(e), ST_YMin(e), ST_XMax(e), ST_YMax(e)
+        FROM (SELECT ST_Extent(way) AS e FROM planet_osm_point WHERE amenity IS NOT NULL) t;
+    """)
+    x0, y0, x1, y1 = cur.fetchone()
+    if x0 is None:
+        return None
+    i0 = math.floor((x0 - radius) / cell_size)
+    j0 = math.floor((y0 - radius) / cell_size)
+    i1 = math.floor((x1 + radius) / cell_size)
+    j1 = math.floor((y1 + radius) / cell_size)
+    return i0, j0, i1 - i0 + 1, j1 - j0 + 1
+
+
+def _category_counts(conn, extent, cell_size):
+    """{category: (height, width) int array of amenity points per cell}"""
+    i0, j0, width, height = extent
+    codes = {}
+    for index, amenities in enumerate(CATEGORIES.values()):
+        for amenity in amenities:
+            codes[amenity] = index
+
+    cur = conn.cursor(name='amenity_points')
+    cur.itersize = 100000
+    cur.execute("""
+        SELECT ST_X(way), ST_Y(way), amenity FROM planet_osm_point
+        WHERE amenity = ANY(%s);
+    """, (list(codes),))
+    xs, ys, cats = [], [], []
+    for x, y, amenity in cur:
+        xs.append(x)
+        ys.append(y)
+        cats.append(codes[amenity])
+    cur.close()
+
+    cols = np.floor(np.asarray(xs, dtype=np.float64) / cell_size).astype(np.int64) - i0
+    rows = np.floor(np.asarray(ys, dtype=np.float64) / cell_size).astype(np.int64) - j0
+    cats = np.asarray(cats, dtype=np.int64)
+    counts = {}
+    for index, name in enumerate(CATEGORIES):
+        mask = cats == index
+        flat = rows[mask] * width + cols[mask]
+        counts[name] = np.bincount(flat, minlength=width * height).reshape(height, width)
+    print(f"Binned {len(cats)} amenity points")
+    return counts
+
+
+def _water_mask(cur, extent, cell_size):
+    """Boolean (height, width) array of cells whose centre lies on water, or None without ST_SquareGrid"""
+    cur.execute("SELECT to_regproc('st_squaregrid') IS NOT NULL;")
+    if not cur.fetchone()[0]:
+        print("⚠ ST_SquareGrid needs PostGIS 3.1+, skipping the water mask (score falls back to a live check)")
+        return None
+    i0, j0, width, height = extent
+    # ST_SquareGrid cells are aligned on the origin, so (i, j) are the same indices used here
+    cur.execute(f"""
+        WITH bounds AS (
+            SELECT ST_MakeEnvelope(%s, %s, %s, %s, 3857) AS geom
+        )
+        SELECT DISTINCT g.i, g.j
+        FROM planet_osm_polygon w, bounds,
+             ST_SquareGrid(%s, ST_ClipByBox2D(w.way, bounds.geom)) g
+        WHERE {WATER_FILTER}
+          AND w.way && bounds.geom
+          AND ST_Intersects(w.way, ST_Centroid(g.geom));
+    """, (i0 * cell_size, j0 * cell_size, (i0 + width) * cell_size, (j0 + height) * cell_size, cell_size))
+    water = np.zeros((height, width), dtype=bool)
+    cells = np.asarray(cur.fetchall(), dtype=np.int64).reshape(-1, 2)
+    inside = ((cells[:, 0] >= i0) & (cells[:, 0] < i0 + width)
+              & (cells[:, 1] >= j0) & (cells[:, 1] < j0 + height))
+    cells = cells[inside]
+    water[cells[:, 1] - j0, cells[:, 0] - i0] = True
+    print(f"Water mask: {int(water.sum())} cells")
+    return water
+
+
+def _grid_rows(sums, water, extent):
+    """(cell_x, cell_y, counts..., water) for every cell with an amenity in reach or on water"""
+    i0, j0, _, _ = extent
+    stacked = np.stack([sums[name] for name in CATEGORIES])
+    keep = stacked.any(axis=0)
+    if water is not None:
+        keep |= water
+    rows, cols = np.nonzero(keep)
+    values = np.minimum(stacked[:, rows, cols], 32767).T  # SMALLINT
+    on_water = water[rows, cols] if water is not None else np.zeros(len(rows), dtype=bool)
+    for r, c, counts, wet in zip(rows.tolist(), cols.tolist(), values.tolist(), on_water.tolist()):
+        yield (c + i0, r + j0, *counts, 't' if wet else 'f')
+
+
+def build_amenity_grid(conn, cell_size=CELL_SIZE, radius=SCORE_RADIUS):
+    """Rebuild amenity_grid / amenity_grid_meta; returns the number of cells written"""
+    start = time.time()
+    cur = conn.cursor()
+    extent = _grid_extent(cur, cell_size, radius)
+    if extent is None:
+        print("No amenity points in planet_osm_point, nothing to do")
+        return 0
+    i0, j0, width, height = extent
+    if width * height > MAX_CELLS:
+        print(f"Error: {width}x{height} cells at {cell_size:g} m is too large; use a bigger cell size")
+        return 0
+    print(f"Grid: {width}x{height} cells of {cell_size:g} m, radius {radius:g} m")
+
+    counts = _category_counts(conn, extent, cell_size)
+    sums = {name: disk_sum(grid, radius / cell_size) for name, grid in counts.items()}
+    water = _water_mask(cur, extent, cell_size)
+    computed = time.time()
+
+    columns = ['cell_x', 'cell_y', *CATEGORIES, 'water']
+    cur.execute("DROP TABLE IF EXISTS amenity_grid_new;")
+    cur.execute(f"""
+        CREATE TABLE amenity_grid_new (
+            cell_x INTEGER NOT NULL,
+            cell_y INTEGER NOT NULL,
+            {', '.join(f'{name} SMALLINT NOT NULL' for name in CATEGORIES)},
+            water BOOLEAN NOT NULL
+        );
+    """)
+    written = copy_rows(cur, 'amenity_grid_new', columns, _grid_rows(sums, water, extent))
+    cur.execute("ALTER TABLE amenity_grid_new ADD CONSTRAINT amenity_grid_new_pkey PRIMARY KEY (cell_x, cell_y);")
+    cur.execute("DROP TABLE IF EXISTS amenity_grid;")
+    cur.execute("ALTER TABLE amenity_grid_new RENAME TO amenity_grid;")
+    cur.execute("ALTER TABLE amenity_grid RENAME CONSTRAINT amenity_grid_new_pkey TO amenity_grid_pkey;")
+
+    cur.execute("DROP TABLE IF EXISTS amenity_grid_meta;")
+    cur.execute("""
+        CREATE TABLE amenity_grid_meta (
+            cell_size DOUBLE PRECISION NOT NULL,
+            radius DOUBLE PRECISION NOT NULL,
+            extent GEOMETRY(Polygon, 3857) NOT NULL,
+            water_mask BOOLEAN NOT NULL,
+            computed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """)
+    cur.execute("""
+        INSERT INTO amenity_grid_meta (cell_size, radius, extent, water_mask)
+        VALUES (%s, %s, ST_MakeEnvelope(%s, %s, %s, %s, 3857), %s);
+    """, (cell_size, radius, i0 * cell_size, j0 * cell_size,
+          (i0 + width) * cell_size, (j0 + height) * cell_size, water is not None))
+    conn.commit()
+    cur.execute("ANALYZE amenity_grid;")
+    conn.commit()
+    cur.close()
+
+    print(f"✓ amenity_grid: {written} cells written in {time.time() - start:.1f}s "
+          f"(computed in {computed - start:.1f}s)")
+    return written
+
+
+if __name__ == '__main__':
+    cell_size = float(sys.argv[1]) if len(sys.argv) > 1 else CELL_SIZE
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        build_amenity_grid(conn, cell_size)
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"Error building amenity grid: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
@@ -0,0 +1,644 @@
+#!/usr/bin/env python3
+"""
+Apply OSM replication diffs (osmChange .osc / .osc.gz) to PostGIS
+Reads change files from a local directory (flat or in the 000/001/234.osc.gz
+replication layout), applies creates/modifies/deletes to buildings and the
+planet_osm_* tables in batches, and records the last applied sequence number
+in a state file so each run only processes new diffs.
+
+Node locations for ways that reference unchanged nodes are looked up in the
+osm2pgsql middle tables (planet_osm_nodes / planet_osm_ways), so the initial
+osm2pgsql import must run with --slim (without --drop or --flat-nodes). Finding
+the buildings whose nodes moved needs the GIN index on planet_osm_ways.nodes
+that osm2pgsql --slim creates; without it every diff scans the ways table (a
+warning says so, with the CREATE INDEX to run).
+
+With --region the diff goes to that region's partitions (buildings_<region>,
+planet_osm_*_<region>, see regions.py) and middle tables (osm_<region>_nodes /
+_ways, from osm2pgsql --prefix osm_<region>), and the region's recorded bounds
+grow to cover what it adds.
+"""
+
+import gzip
+import os
+import re
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+import psycopg2
+from psycopg2.extras import Json, execute_values, register_hstore
+
+from bulk_load import (
+    BUILDING_COLUMNS, apply_upsert, copy_rows, create_incoming_table, encode_geometry, with_content_hash,
+)
+from dirty_tiles import DIRTY_MAX_ZOOM, DIRTY_MIN_ZOOM, dirty_tiles_ddl, mark_tiles_sql
+from import_osm_data import DB_CONFIG
+from instrumentation import import_run, pop_run_options, stage
+from regions import OSM_KINDS, RegionError, check_region, extend_bounds, osm_tables, region_target
+from search_index import update_search_index
+from validate_geometry import record_rejects, reject_row
+
+STATE_FILE = 'state.txt'
+NODE_COORD_SCALE = 10000000  # osm2pgsql middle stores lat/lon as int * 1e7
+BATCH_SIZE = 1000
+
+
+# ---------------------------------------------------------------------------
+# Change files and state
+# ---------------------------------------------------------------------------
+
+def read_state(state_file):
+    """Return the last applied sequence number from an osmosis-style state file (0 if none)"""
+    if not os.path.exists(state_file):
+        return 0
+    with open(state_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            key, _, value = line.strip().partition('=')
+            if key == 'sequenceNumber':
+                return int(value)
+    return 0
+
+
+def write_state(state_file, sequence):
+    now = time.gmtime()
+    tmp = state_file + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(time.strftime('#%a %b %d %H:%M:%S UTC %Y\n', now))
+        f.write(f"sequenceNumber={sequence}\n")
+        # Colons are escaped in osmosis/Java properties files
+        f.write(time.strftime('timestamp=%Y-%m-%dT%H\\:%M\\:%SZ\n', now))
+    os.replace(tmp, state_file)
+
+
+def find_diff_files(directory):
+    """
+    Return sorted (sequence, path) pairs for every .osc/.osc.gz under directory.
+    The sequence is built from the digits of the relative path, so both
+    000/001/234.osc.gz (-> 1234) and 1234.osc work.
+    """
+    diffs = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if not (name.endswith('.osc') or name.endswith('.osc.gz')):
+                continue
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, directory)
+            digits = ''.join(re.findall(r'\d+', rel.split('.osc')[0]))
+            if digits:
+                diffs.append((int(digits), path))
+    return sorted(diffs)
+
+
+def parse_osc(path):
+    """
+    Parse an osmChange file into {'node': {...}, 'way': {...}, 'relation': {...}}.
+    Each entry maps id -> dict(action, tags, and lon/lat, refs or members).
+    Later actions on the same object win, as in the replication stream.
+    """
+    change = {'node': {}, 'way': {}, 'relation': {}}
+    opener = gzip.open if path.endswith('.gz') else open
+    action = None
+
+    with opener(path, 'rb') as f:
+        for event, elem in ET.iterparse(f, events=('start', 'end')):
+            if event == 'start':
+                if elem.tag in ('create', 'modify', 'delete'):
+                    action = elem.tag
+                continue
+            if elem.tag not in change:
+                continue
+
+            obj = {'action': action, 'tags': {t.get('k'): t.get('v') for t in elem.iter('tag')}}
+            if elem.tag == 'node':
+                if elem.get('lon') is not None:
+                    obj['lon'] = float(elem.get('lon'))
+                    obj['lat'] = float(elem.get('lat'))
+            elif elem.tag == 'way':
+                obj['refs'] = [int(nd.get('ref')) for nd in elem.iter('nd')]
+            else:
+                obj['members'] = [(m.get('type'), int(m.get('ref')), m.get('role') or '')
+                                  for m in elem.iter('member')]
+            change[elem.tag][int(elem.get('id'))] = obj
+            elem.clear()
+
+    return change
+
+
+# ---------------------------------------------------------------------------
+# Database lookups
+# ---------------------------------------------------------------------------
+
+def _table_exists(cur, table):
+    cur.execute("SELECT to_regclass(%s);", (table,))
+    return cur.fetchone()[0] is not None
+
+
+def _table_columns(cur, table):
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = %s;
+    """, (table,))
+    return {row[0] for row in cur.fetchall()}
+
+
+def _column_type(cur, table, column):
+    """information_schema data_type of table.column, None when there is no such column"""
+    cur.execute("""
+        SELECT data_type FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = %s AND column_name = %s;
+    """, (table, column))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+class NodeLocations:
+    """Node id -> (lon, lat), from the diff first and planet_osm_nodes second"""
+
+    def __init__(self, cur, change, table='planet_osm_nodes'):
+        self.cur = cur
+        self.table = table
+        self.cache = {nid: (n['lon'], n['lat']) for nid, n in change['node'].items() if 'lon' in n}
+        self.has_middle = _table_exists(cur, table)
+
+    def load(self, ids):
+        missing = [i for i in set(ids) if i not in self.cache]
+        if not missing or not self.has_middle:
+            return
+        for start in range(0, len(missing), BATCH_SIZE):
+            self.cur.execute(f"SELECT id, lon, lat FROM {self.table} WHERE id = ANY(%s);",
+                             (missing[start:start + BATCH_SIZE],))
+            for nid, lon, lat in self.cur.fetchall():
+                self.cache[nid] = (lon / NODE_COORD_SCALE, lat / NODE_COORD_SCALE)
+
+    def coords(self, refs):
+        """Coordinates for a node list, or None if any node is unknown"""
+        try:
+            return [self.cache[r] for r in refs]
+        except KeyError:
+            return None
+
+
+def _way_refs(cur, change, way_ids, table='planet_osm_ways'):
+    """Node lists for ways: from the diff when present, else planet_osm_ways"""
+    refs = {wid: change['way'][wid]['refs'] for wid in way_ids
+            if wid in change['way'] and change['way'][wid]['action'] != 'delete'}
+    missing = [wid for wid in way_ids if wid not in refs]
+    if missing and _table_exists(cur, table):
+        cur.execute(f"SELECT id, nodes FROM {table} WHERE id = ANY(%s);", (missing,))
+        refs.update({wid: nodes for wid, nodes in cur.fetchall()})
+    return refs
+
+
+# ---------------------------------------------------------------------------
+# Applying changes
+# ---------------------------------------------------------------------------
+
+def _middle_tags(value):
+    """planet_osm_ways.tags as a dict: jsonb in the osm2pgsql >= 1.9 middle, a flat key/value text[] before"""
+    if not value:
+        return {}
+    if isinstance(value, dict):
+        return value
+    return dict(zip(value[::2], value[1::2]))
+
+
+def _middle_tags_param(tags, data_type):
+    """The other way round: a tag dict as a parameter for a jsonb or text[] tags column"""
+    if data_type == 'jsonb':
+        return Json(tags)
+    return [kv for item in tags.items() for kv in item]
+
+
+def _is_building_way(way):
+    refs = way.get('refs', [])
+    return 'building' in way['tags'] and len(refs) >= 4 and refs[0] == refs[-1]
+
+
+def _is_building_relation(rel):
+    return rel['tags'].get('type') == 'multipolygon' and 'building' in rel['tags']
+
+
+def _name_type(tags):
+    return (tags.get('name', tags.get('addr:housename', 'Unnamed Building')),
+            tags.get('building', 'unknown'))
+
+
+def _existing_buildings(cur, osm_ids, table='buildings'):
+    """The osm_ids that are rows of table: most deleted or modified ways never were buildings"""
+    if not osm_ids:
+        return []
+    cur.execute(f"SELECT osm_id FROM {table} WHERE osm_id = ANY(%s);", (osm_ids,))
+    existing = {row[0] for row in cur.fetchall()}
+    return [osm_id for osm_id in osm_ids if osm_id in existing]
+
+
+def _building_changes(cur, change, nodes, stats, tables):
+    """
+    Work out building rows to upsert and osm_ids to delete for one diff.
+    tables maps the logical table names to the ones to use (see regions.osm_tables).
+    Returns (rows, deleted_ids, tags_by_osm_id).
+    """
+    rows = []
+    deleted = []
+    tags_by_id = {}
+    rejects = []
+
+    # Ways
+    way_refs = {wid: w['refs'] for wid, w in change['way'].items()
+                if w['action'] != 'delete' and _is_building_way(w)}
+    nodes.load(r for refs in way_refs.values() for r in refs)
+    for wid, way in change['way'].items():
+        osm_id = f"w{wid}"
+        if wid not in way_refs:
+            # Deleted, or no longer a closed building way (kept if it was a building, see below)
+            deleted.append(osm_id)
+            continue
+        coords = nodes.coords(way_refs[wid])
+        if coords is None:
+            stats['unresolved'] += 1
+            continue
+        name, building_type = _name_type(way['tags'])
+        geom = {'type': 'Polygon', 'coordinates': [coords]}
+        geom_hex, problem = encode_geometry(geom)
+        if geom_hex is None:
+            rejects.append(reject_row(osm_id, name, building_type, problem, geom))
+            continue
+        rows.append((osm_id, name, building_type, geom_hex))
+        tags_by_id[osm_id] = way['tags']
+
+    # Buildings whose nodes moved but whose way did not change
+    moved = [nid for nid, n in change['node'].items() if n['action'] == 'modify']
+    if moved and _table_exists(cur, tables['planet_osm_ways']):
+        cur.execute(f"""
+            SELECT w.id, w.nodes, w.tags, b.name, b.type
+            FROM {tables['planet_osm_ways']} w
+            JOIN {tables['buildings']} b ON b.osm_id = 'w' || w.id
+            WHERE w.nodes && %s::bigint[];
+        """, (moved,))
+        affected = [r for r in cur.fetchall() if r[0] not in change['way']]
+        nodes.load(ref for r in affected for ref in r[1])
+        for wid, refs, middle_tags, name, building_type in affected:
+            osm_id = f"w{wid}"
+            coords = nodes.coords(refs)
+            if coords is None:
+                stats['unresolved'] += 1
+                continue
+            tags = _middle_tags(middle_tags)
+            if tags:
+                name, building_type = _name_type(tags)
+            geom = {'type': 'Polygon', 'coordinates': [coords]}
+            geom_hex, problem = encode_geometry(geom)
+            if geom_hex is None:
+                rejects.append(reject_row(osm_id, name, building_type, problem, geom))
+                continue
+            rows.append((osm_id, name, building_type, geom_hex))
+            if tags:  # a middle without tags leaves planet_osm_polygon as it was
+                tags_by_id[osm_id] = tags
+
+    # Multipolygon relations: member ways are merged into rings by ST_BuildArea
+    relations = {rid: r for rid, r in change['relation'].items()
+                 if r['action'] != 'delete' and _is_building_relation(r)}
+    for rid in change['relation']:
+        if rid not in relations:
+            deleted.append(f"r{rid}")
+
+    if relations:
+        member_ways = {ref for r in relations.values() for kind, ref, _ in r['members'] if kind == 'way'}
+        refs_by_way = _way_refs(cur, change, member_ways, tables['planet_osm_ways'])
+        nodes.load(ref for refs in refs_by_way.values() for ref in refs)
+
+        ids, wkts = [], []
+        for rid, rel in relations.items():
+            lines = []
+            for kind, ref, _ in rel['members']:
+                coords = nodes.coords(refs_by_way.get(ref, [])) if kind == 'way' else None
+                if coords and len(coords) >= 2:
+                    lines.append('(' + ', '.join(f"{lon} {lat}" for lon, lat in coords) + ')')
+            if not lines:
+                stats['unresolved'] += 1
+                continue
+            ids.append(rid)
+            wkts.append(f"MULTILINESTRING({', '.join(lines)})")
+
+        if ids:
+            cur.execute("""
+                SELECT id, encode(ST_AsEWKB(ST_Multi(ST_BuildArea(ST_GeomFromText(wkt, 4326)))), 'hex')
+                FROM unnest(%s::bigint[], %s::text[]) AS t(id, wkt);
+            """, (ids, wkts))
+            for rid, geom_hex in cur.fetchall():
+                if geom_hex is None:
+                    stats['unresolved'] += 1
+                    continue
+                name, building_type = _name_type(relations[rid]['tags'])
+                rows.append((f"r{rid}", name, building_type, geom_hex))
+                tags_by_id[f"r{rid}"] = relations[rid]['tags']
+
+    stats['rejected'] += record_rejects(cur, rejects)
+    return rows, _existing_buildings(cur, deleted, tables['buildings']), tags_by_id
+
+
+def _apply_buildings(cur, rows, deleted, stats, table='buildings'):
+    if deleted:
+        cur.execute(dirty_tiles_ddl())
+        cur.execute(mark_tiles_sql(f"SELECT geom FROM {table} WHERE osm_id = ANY(%(ids)s)"), {'ids': deleted})
+        cur.execute(f"DELETE FROM {table} WHERE osm_id = ANY(%s);", (deleted,))
+        stats['buildings_deleted'] += cur.rowcount
+    if rows:
+        incoming = create_incoming_table(cur, table)
+        copy_rows(cur, incoming, BUILDING_COLUMNS, with_content_hash(rows))
+        counts = apply_upsert(cur, incoming, table, delete_missing=False,
+                              dirty_zooms=(DIRTY_MIN_ZOOM, DIRTY_MAX_ZOOM))
+        cur.execute(f"DROP TABLE {incoming};")
+        stats['buildings_inserted'] += counts['inserted']
+        stats['buildings_updated'] += counts['updated']
+        stats['rejected'] += counts['rejected']
+
+
+def _planet_osm_id(osm_id):
+    """buildings key -> osm2pgsql osm_id (relations are stored negated)"""
+    return int(osm_id[1:]) if osm_id[0] == 'w' else -int(osm_id[1:])
+
+
+RESERVED_COLUMNS = {'osm_id', 'way', 'tags', 'z_order', 'way_area'}
+
+
+def _tag_values(tags, columns):
+    return {k: v for k, v in tags.items() if k in columns and k not in RESERVED_COLUMNS}
+
+
+def _insert_tagged(cur, table, rows, columns, geom_sql):
+    """
+    Insert (osm_id, tag_values, all_tags, geom_params) rows into an osm2pgsql render table.
+    Tags map onto same-named columns; an hstore 'tags' column gets the full set.
+    geom_sql is the SQL expression consuming geom_params.
+    """
+    if not rows:
+        return 0
+    tag_cols = sorted({k for _, values, _, _ in rows for k in values})
+    has_hstore = 'tags' in columns
+    if has_hstore:
+        register_hstore(cur)
+    col_sql = ', '.join(['osm_id'] + [f'"{c}"' for c in tag_cols] + (['tags'] if has_hstore else []) + ['way'])
+    values = []
+    for osm_id, tag_values, all_tags, geom_params in rows:
+        row = [osm_id] + [tag_values.get(c) for c in tag_cols]
+        if has_hstore:
+            row.append(all_tags)
+        values.append(tuple(row) + tuple(geom_params))
+    placeholders = ', '.join(['%s'] * (1 + len(tag_cols) + has_hstore))
+    execute_values(cur, f"INSERT INTO {table} ({col_sql}) VALUES %s",
+                   values, template=f"({placeholders}, {geom_sql})", page_size=BATCH_SIZE)
+    return len(values)
+
+
+def _apply_planet_osm(cur, change, building_rows, tags_by_id, stats, tables):
+    """Keep planet_osm_point / _polygon / _line and the slim middle tables in step"""
+    touched_nodes = list(change['node'])
+    point_table = tables['planet_osm_point']
+    polygon_table = tables['planet_osm_polygon']
+
+    if _table_exists(cur, point_table) and touched_nodes:
+        columns = _table_columns(cur, point_table)
+        cur.execute(f"DELETE FROM {point_table} WHERE osm_id = ANY(%s);", (touched_nodes,))
+        point_rows = []
+        for nid, node in change['node'].items():
+            values = _tag_values(node['tags'], columns)
+            if node['action'] != 'delete' and values and 'lon' in node:
+                point_rows.append((nid, values, node['tags'], (node['lon'], node['lat'])))
+        stats['points'] += _insert_tagged(cur, point_table, point_rows, columns,
+                                          "ST_Transform(ST_SetSRID(ST_MakePoint(%s, %s), 4326), 3857)")
+
+    # Deleted ways/relations leave every render table; modified non-building
+    # areas and lines are left as they are (osm2pgsql --append owns their styling rules)
+    gone = ([wid for wid, w in change['way'].items() if w['action'] == 'delete']
+            + [-rid for rid, r in change['relation'].items() if r['action'] == 'delete'])
+    rebuilt = [_planet_osm_id(osm_id) for osm_id, _, _, _ in building_rows if osm_id in tags_by_id]
+    for table, ids in ((tables['planet_osm_line'], gone), (polygon_table, gone + rebuilt)):
+        if ids and _table_exists(cur, table):
+            cur.execute(f"DELETE FROM {table} WHERE osm_id = ANY(%s);", (ids,))
+
+    if _table_exists(cur, polygon_table):
+        columns = _table_columns(cur, polygon_table)
+        polygon_rows = [
+            (_planet_osm_id(osm_id), _tag_values(tags_by_id[osm_id], columns), tags_by_id[osm_id], (geom_hex,))
+            for osm_id, _, _, geom_hex in building_rows if osm_id in tags_by_id
+        ]
+        stats['polygons'] += _insert_tagged(cur, polygon_table, polygon_rows, columns,
+                                            "ST_Transform(%s::geometry, 3857)")
+
+    # Slim middle tables, so later diffs can resolve unchanged nodes and ways
+    nodes_table = tables['planet_osm_nodes']
+    if _table_exists(cur, nodes_table):
+        gone = [nid for nid, n in change['node'].items() if n['action'] == 'delete']
+        if gone:
+            cur.execute(f"DELETE FROM {nodes_table} WHERE id = ANY(%s);", (gone,))
+        located = [(nid, round(n['lat'] * NODE_COORD_SCALE), round(n['lon'] * NODE_COORD_SCALE))
+                   for nid, n in change['node'].items() if n['action'] != 'delete' and 'lon' in n]
+        if located:
+            execute_values(cur, f"""
+                INSERT INTO {nodes_table} (id, lat, lon) VALUES %s
+                ON CONFLICT (id) DO UPDATE SET lat = EXCLUDED.lat, lon = EXCLUDED.lon
+            """, located, page_size=BATCH_SIZE)
+    ways_table = tables['planet_osm_ways']
+    if _table_exists(cur, ways_table):
+        gone = [wid for wid, w in change['way'].items() if w['action'] == 'delete']
+        if gone:
+            cur.execute(f"DELETE FROM {ways_table} WHERE id = ANY(%s);", (gone,))
+        ways = [(wid, w['refs']) for wid, w in change['way'].items() if w['action'] != 'delete']
+        tags_type = _column_type(cur, ways_table, 'tags')
+        if ways and tags_type in ('jsonb', 'ARRAY'):
+            # Tags too, for buildings rebuilt later because one of their nodes moved
+            execute_values(cur, f"""
+                INSERT INTO {ways_table} (id, nodes, tags) VALUES %s
+                ON CONFLICT (id) DO UPDATE SET nodes = EXCLUDED.nodes, tags = EXCLUDED.tags
+            """, [(wid, refs, _middle_tags_param(change['way'][wid]['tags'], tags_type)) for wid, refs in ways],
+                page_size=BATCH_SIZE)
+        elif ways:
+            execute_values(cur, f"""
+                INSERT INTO {ways_table} (id, nodes) VALUES %s
+                ON CONFLICT (id) DO UPDATE SET nodes = EXCLUDED.nodes
+            """, ways, page_size=BATCH_SIZE)
+
+
+def _apply_search_index(cur, change, building_rows, tags_by_id, stats):
+    """Re-index the points and polygons this change touched, if search_index.py has been run"""
+    if not _table_exists(cur, 'search_index'):
+        return
+    polygons = ([wid for wid, w in change['way'].items() if w['action'] == 'delete']
+                + [-rid for rid, r in change['relation'].items() if r['action'] == 'delete']
+                + [_planet_osm_id(osm_id) for osm_id, _, _, _ in building_rows if osm_id in tags_by_id])
+    for source_type, table, ids in (('point', 'planet_osm_point', list(change['node'])),
+                                    ('polygon', 'planet_osm_polygon', polygons)):
+        if ids and _table_exists(cur, table):
+            stats['search_index'] += sum(update_search_index(cur, source_type, ids))
+
+
+def _extend_region_bounds(cur, change, building_rows, tags_by_id, tables, region):
+    """Grow the region's recorded bounds by what this diff wrote, so the API keeps finding it"""
+    written = {
+        'buildings': [osm_id for osm_id, _, _, _ in building_rows],
+        'planet_osm_point': [nid for nid, n in change['node'].items() if n['action'] != 'delete'],
+        'planet_osm_polygon': [_planet_osm_id(osm_id) for osm_id, _, _, _ in building_rows if osm_id in tags_by_id],
+    }
+    for parent, ids in written.items():
+        if ids and _table_exists(cur, tables[parent]):
+            extend_bounds(cur, parent, region, ids, 'geom' if parent == 'buildings' else 'way')
+
+
+def apply_change_file(conn, path, region=None):
+    """
+    Apply one osmChange file in a single transaction; returns per-table stats
+    region='london' applies it to the london partitions (see regions.py).
+    """
+    stats = {
+        'buildings_inserted': 0, 'buildings_updated': 0, 'buildings_deleted': 0,
+        'points': 0, 'polygons': 0, 'search_index': 0, 'unresolved': 0, 'rejected': 0,
+    }
+    with stage('parse', hot=True) as st:
+        change = parse_osc(path)
+        st.add(rows_out=sum(len(change[kind]) for kind in ('node', 'way', 'relation')),
+               bytes_read=os.path.getsize(path))
+    tables = osm_tables(region)
+    cur = conn.cursor()
+    try:
+        with stage('resolve') as st:
+            nodes = NodeLocations(cur, change, tables['planet_osm_nodes'])
+            rows, deleted, tags_by_id = _building_changes(cur, change, nodes, stats, tables)
+            st.add(rows_out=len(rows) + len(deleted))
+        with stage('buildings') as st:
+            _apply_buildings(cur, rows, deleted, stats, tables['buildings'])
+            st.add(rows_in=len(rows) + len(deleted),
+                   rows_out=stats['buildings_inserted'] + stats['buildings_updated'] + stats['buildings_deleted'])
+        with stage('planet_osm') as st:
+            _apply_planet_osm(cur, change, rows, tags_by_id, stats, tables)
+            st.add(rows_out=stats['points'] + stats['polygons'])
+        with stage('search_index') as st:
+            _apply_search_index(cur, change, rows, tags_by_id, stats)
+            st.add(rows_out=stats['search_index'])
+        if region:
+            _extend_region_bounds(cur, change, rows, tags_by_id, tables, region)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return stats
+
+
+def _check_region(conn, region):
+    """
+    Without a region, refuse partitioned tables (rows of no region have no partition to go to);
+    with one, make sure its buildings partition exists
+    """
+    cur = conn.cursor()
+    try:
+        if region:
+            if _table_exists(cur, 'buildings'):
+                region_target(cur, 'buildings', region)
+        else:
+            for parent in ('buildings', *(f"planet_osm_{kind}" for kind in OSM_KINDS)):
+                region_target(cur, parent)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def _has_way_nodes_index(cur, table):
+    """True when table has a GIN index on nodes (osm2pgsql --slim: planet_osm_ways_nodes or its bucket index)"""
+    cur.execute("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            JOIN pg_am am ON am.oid = c.relam
+            WHERE i.indrelid = to_regclass(%s) AND am.amname = 'gin'
+              AND pg_get_indexdef(i.indexrelid) LIKE '%%nodes%%'
+        );
+    """, (table,))
+    return cur.fetchone()[0]
+
+
+def _check_way_nodes_index(conn, region=None):
+    """Warn when moved-node lookups would scan the whole ways middle table"""
+    table = osm_tables(region)['planet_osm_ways']
+    cur = conn.cursor()
+    try:
+        if _table_exists(cur, table) and not _has_way_nodes_index(cur, table):
+            print(f"⚠ {table} has no GIN index on nodes: buildings with moved nodes are found by a full scan.")
+            print(f"  Create it once with: CREATE INDEX {table}_nodes ON {table} USING GIN (nodes);")
+        conn.commit()
+    finally:
+        cur.close()
+
+
+def apply_diffs(directory, state_file=None, region=None):
+    """Apply every diff newer than the state file's sequence number, in order"""
+    state_file = state_file or os.path.join(directory, STATE_FILE)
+    last = read_state(state_file)
+    pending = [(seq, path) for seq, path in find_diff_files(directory) if seq > last]
+
+    if not pending:
+        print(f"Up to date (sequence {last})")
+        return 0
+
+    print(f"Applying {len(pending)} diffs after sequence {last}...")
+    conn = psycopg2.connect(**DB_CONFIG)
+    applied = 0
+    try:
+        _check_region(conn, region)
+        _check_way_nodes_index(conn, region)
+        for seq, path in pending:
+            start = time.time()
+            with stage('change_file') as st:
+                stats = apply_change_file(conn, path, region)
+                st.extra['sequence'] = seq
+            write_state(state_file, seq)
+            applied += 1
+            print(f"  {seq}: buildings +{stats['buildings_inserted']} ~{stats['buildings_updated']} "
+                  f"-{stats['buildings_deleted']}, points {stats['points']}, polygons {stats['polygons']}"
+                  + (f", search index {stats['search_index']}" if stats['search_index'] else '')
+                  + (f", {stats['unresolved']} unresolved" if stats['unresolved'] else '')
+                  + (f", {stats['rejected']} rejected geometries" if stats['rejected'] else '')
+                  + f" ({time.time() - start:.2f}s)")
+    finally:
+        conn.close()
+
+    print(f"✓ Applied {applied} diffs, now at sequence {pending[applied - 1][0]}")
+    return applied
+
+
+def print_usage():
+    print("Usage:")
+    print("  python apply_osc.py <diff-dir> [--state state.txt] [--region NAME] [--report run.json] "
+          "[--metrics apply_osc.prom]")
+    print()
+    print("<diff-dir> holds .osc / .osc.gz files (e.g. a mirrored replication/minute tree)")
+
+
+def _get_option(args, name):
+    """Value following --name in args; None when absent, False when the value is missing"""
+    if name not in args:
+        return None
+    index = args.index(name)
+    if index + 1 >= len(args) or args[index + 1].startswith('--'):
+        return False
+    return args[index + 1]
+
+
+if __name__ == '__main__':
+    run_options = pop_run_options(sys.argv)
+    state = _get_option(sys.argv, '--state')
+    region = _get_option(sys.argv, '--region')
+    if len(sys.argv) < 2 or sys.argv[1].startswith('--') or state is False or region is False:
+        print_usage()
+        sys.exit(1)
+    with import_run('apply_osc', **run_options):
+        try:
+            apply_diffs(sys.argv[1], state, region and check_region(region))
+        except RegionError as exc:
+            print(f"Error: {exc}")
+            sys.exit(1)
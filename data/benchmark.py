@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""
+Import benchmark on a synthetic city
+Generates N buildings (realistic vertex counts, some courtyards and
+multipolygons), M amenity POIs and K charging stations around the
+generate_more_sample_data grid centre, then loads them into a scratch
+database with every import path:
+
+  buildings/insert    import_from_geojson (batched INSERT ... VALUES)
+  buildings/bulk      import_from_geojson --bulk (COPY + staging swap)
+  buildings/parallel  import_from_geojson --workers N
+  pois/copy           COPY into planet_osm_point (osm2pgsql layout)
+  stations/sink       station_sink.sink_stations (crawler -> charge_stations)
+
+Each run happens in a freshly spawned process against empty tables and
+reports wall time, rows/sec and peak RSS (loader process and its workers)
+as JSON, so two reports can be compared for regressions.
+
+Usage:
+  python benchmark.py run [--buildings N] [--pois M] [--stations K] [--workers W]
+                          [--repeat R] [--cases a,b] [--database webgis_bench] [--output report.json]
+  python benchmark.py compare <baseline.json> <report.json> [--threshold 10]
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import time
+
+import psycopg2
+
+from import_osm_data import BUILDING_TYPES, DB_CONFIG, GENERATE_CENTER, GENERATE_SEED
+
+BENCH_DATABASE = 'webgis_bench'
+BUILDINGS_PER_KM2 = 2000  # dense inner-city block
+RECTANGLE_SHARE = 0.55  # OSM buildings are mostly plain 4-corner footprints
+MULTIPOLYGON_SHARE = 0.02
+COURTYARD_SHARE = 0.03
+MAX_VERTICES = 200
+POI_AMENITIES = ['school', 'university', 'kindergarten', 'hospital', 'clinic', 'pharmacy', 'bank', 'atm',
+                 'post_office', 'police', 'supermarket', 'convenience', 'cafe', 'restaurant', 'fast_food',
+                 'bar', 'pub', 'cinema', 'parking', 'fuel']
+POI_HUBS = 12  # POIs cluster around a few high streets
+STATION_TYPES = ['Sạc nhanh', 'Sạc thường', 'Tủ pin']
+STATION_STATUSES = ['Hoạt động', 'Bảo trì', 'Open']
+
+# Scratch schema recreated before every run; charge_stations comes from init_stations.sql
+BENCH_SCHEMA = """
+    CREATE EXTENSION IF NOT EXISTS postgis;
+    DROP TABLE IF EXISTS buildings, buildings_staging, buildings_incoming, planet_osm_point, charge_stations CASCADE;
+    CREATE TABLE buildings (
+        id SERIAL PRIMARY KEY,
+        name VARCHAR(255),
+        type VARCHAR(100),
+        geom GEOMETRY(Geometry, 4326)
+    );
+    CREATE INDEX buildings_geom_idx ON buildings USING GIST (geom);
+    CREATE TABLE planet_osm_point (
+        osm_id BIGINT,
+        name TEXT,
+        amenity TEXT,
+        way GEOMETRY(Point, 3857)
+    );
+"""
+
+CASE_TABLES = {
+    'buildings/insert': 'buildings',
+    'buildings/bulk': 'buildings',
+    'buildings/parallel': 'buildings',
+    'pois/copy': 'planet_osm_point',
+    'stations/sink': 'charge_stations',
+}
+
+
+def _metres_to_degrees(lat):
+    """(degrees per metre of latitude, degrees per metre of longitude) at lat"""
+    return 1 / 111320.0, 1 / (111320.0 * math.cos(math.radians(lat)))
+
+
+def _vertex_count(rng):
+    """Corner count of one footprint: mostly rectangles, a long tail of detailed outlines"""
+    if rng.random() < RECTANGLE_SHARE:
+        return 4
+    return max(5, min(MAX_VERTICES, int(round(rng.lognormvariate(2.2, 0.6)))))
+
+
+def _footprint(rng, lon, lat, size_m, vertices, courtyard=False):
+    """
+    Closed rings [outer, (hole)] of a star-shaped footprint centred on lon/lat.
+    Corners sit on jittered, evenly spaced angles, so the outline never self-intersects
+    and a courtyard of 0.2 * size_m always fits inside.
+    """
+    dlat, dlon = _metres_to_degrees(lat)
+    rotation = rng.uniform(0, math.pi)
+    step = 2 * math.pi / vertices
+    if vertices == 4:
+        radii = [size_m] * 4
+        angles = [rotation + a for a in (0.6, math.pi - 0.6, math.pi + 0.6, 2 * math.pi - 0.6)]
+    else:
+        radii = [size_m * rng.uniform(0.7, 1.0) for _ in range(vertices)]
+        angles = [rotation + (k + rng.uniform(-0.4, 0.4)) * step for k in range(vertices)]
+    outer = [(round(lon + r * math.cos(a) * dlon, 7), round(lat + r * math.sin(a) * dlat, 7))
+             for r, a in zip(radii, angles)]
+    rings = [outer + outer[:1]]
+    if courtyard:
+        hole = [(round(lon + 0.2 * size_m * math.cos(a) * dlon, 7), round(lat + 0.2 * size_m * math.sin(a) * dlat, 7))
+                for a in (rotation, rotation - math.pi / 2, rotation - math.pi, rotation - 1.5 * math.pi)]
+        rings.append(hole + hole[:1])
+    return rings
+
+
+def _city_extent(buildings):
+    """Half-width in metres of the square city holding this many buildings"""
+    area_km2 = max(buildings, 1) / BUILDINGS_PER_KM2
+    return math.sqrt(area_km2) * 1000 / 2
+
+
+def _random_point(rng, half_width):
+    """Metre offset (dx, dy) from the city centre"""
+    return rng.uniform(-half_width, half_width), rng.uniform(-half_width, half_width)
+
+
+def _offset(lat, lon, dx, dy):
+    dlat, dlon = _metres_to_degrees(lat)
+    return lon + dx * dlon, lat + dy * dlat
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def generate_city(workdir, buildings, pois, stations, seed=GENERATE_SEED):
+    """
+    Write buildings.geojsonl, pois.geojsonl and stations.jsonl into workdir.
+    Returns {'files': {...}, 'vertices': {...}} describing the dataset.
+    """
+    os.makedirs(workdir, exist_ok=True)
+    rng = random.Random(seed)
+    base_lat, base_lon = GENERATE_CENTER
+    half_width = _city_extent(buildings)
+    files = {name: os.path.join(workdir, filename) for name, filename in
+             (('buildings', 'buildings.geojsonl'), ('pois', 'pois.geojsonl'), ('stations', 'stations.jsonl'))}
+
+    vertex_counts = []
+    with open(files['buildings'], 'w', encoding='utf-8') as f:
+        for i in range(1, buildings + 1):
+            lon, lat = _offset(base_lat, base_lon, *_random_point(rng, half_width))
+            size_m = rng.uniform(5, 25)
+            if rng.random() < MULTIPOLYGON_SHARE:
+                parts = [_footprint(rng, lon, lat, size_m / 2, _vertex_count(rng)),
+                         _footprint(rng, *_offset(lat, lon, size_m * 1.5, 0), size_m / 2, _vertex_count(rng))]
+                geometry = {'type': 'MultiPolygon', 'coordinates': parts}
+                feature_id = f"relation/{i}"
+                vertex_counts.append(sum(len(ring) - 1 for part in parts for ring in part))
+            else:
+                vertices = _vertex_count(rng)
+                rings = _footprint(rng, lon, lat, size_m, vertices,
+                                   courtyard=vertices > 4 and rng.random() < COURTYARD_SHARE)
+                geometry = {'type': 'Polygon', 'coordinates': rings}
+                feature_id = f"way/{i}"
+                vertex_counts.append(sum(len(ring) - 1 for ring in rings))
+            f.write(json.dumps({
+                'type': 'Feature',
+                'id': feature_id,
+                'properties': {'name': f"Building {i}", 'building': rng.choice(BUILDING_TYPES)},
+                'geometry': geometry,
+            }, separators=(',', ':')) + '\n')
+
+    hubs = [_random_point(rng, half_width) for _ in range(POI_HUBS)]
+    with open(files['pois'], 'w', encoding='utf-8') as f:
+        for i in range(1, pois + 1):
+            if rng.random() < 0.7:
+                hx, hy = rng.choice(hubs)
+                dx, dy = rng.gauss(hx, half_width / 10), rng.gauss(hy, half_width / 10)
+            else:
+                dx, dy = _random_point(rng, half_width)
+            amenity = rng.choice(POI_AMENITIES)
+            f.write(json.dumps({
+                'type': 'Feature',
+                'id': f"node/{i}",
+                'properties': {'name': f"{amenity.replace('_', ' ').title()} {i}", 'amenity': amenity},
+                'geometry': {'type': 'Point', 'coordinates': [round(c, 7) for c in _offset(base_lat, base_lon, dx, dy)]},
+            }, separators=(',', ':')) + '\n')
+
+    with open(files['stations'], 'w', encoding='utf-8') as f:
+        for i in range(1, stations + 1):
+            lon, lat = _offset(base_lat, base_lon, *_random_point(rng, half_width))
+            f.write(json.dumps({
+                'external_id': f"bench{i}",
+                'name': f"Station {i}",
+                'lat': round(lat, 7),
+                'lng': round(lon, 7),
+                'address': f"{rng.randint(1, 300)} Synthetic Street",
+                'city': 'London',
+                'category': rng.choice(STATION_TYPES),
+                'status': rng.choice(STATION_STATUSES),
+            }, ensure_ascii=False) + '\n')
+
+    vertex_counts.sort()
+    vertices = {
+        'mean': round(sum(vertex_counts) / len(vertex_counts), 2) if vertex_counts else 0,
+        'p50': _percentile(vertex_counts, 0.5),
+        'p95': _percentile(vertex_counts, 0.95),
+        'max': vertex_counts[-1] if vertex_counts else 0,
+    }
+    return {'files': files, 'vertices': vertices,
+            'size_mb': {name: round(os.path.getsize(path) / 1024 / 1024, 2) for name, path in files.items()}}
+
+
+def load_pois(conn, path):
+    """COPY generated POIs into planet_osm_point the way osm2pgsql lays them out"""
+    from bulk_load import copy_rows
+    from geojson_stream import iter_features
+
+    def rows():
+        for feature in iter_features(path):
+            lon, lat = feature['geometry']['coordinates']
+            x = lon * 20037508.342789244 / 180
+            y = math.log(math.tan((90 + lat) * math.pi / 360)) * 6378137
+            props = feature['properties']
+            yield (int(feature['id'].split('/')[1]), props['name'], props['amenity'], f"SRID=3857;POINT({x} {y})")
+
+    cur = conn.cursor()
+    count = copy_rows(cur, 'planet_osm_point', ('osm_id', 'name', 'amenity', 'way'), rows())
+    cur.execute("CREATE INDEX planet_osm_point_way_idx ON planet_osm_point USING GIST (way);")
+    conn.commit()
+    cur.close()
+    return count
+
+
+def load_stations(conn, path):
+    from station_sink import sink_stations
+
+    async def records():
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+    return asyncio.run(sink_stations(conn, records()))
+
+
+def _run_case(case, files, workers, db_config, results):
+    """Spawned per run: load one dataset with one import path and report its own resource usage"""
+    # Loader chatter goes to stderr so stdout stays a clean JSON report
+    os.dup2(2, 1)
+    import import_osm_data
+
+    import_osm_data.DB_CONFIG.update(db_config)
+    start = time.perf_counter()
+    if case.startswith('buildings/'):
+        import_osm_data.import_from_geojson(files['buildings'], bulk=case == 'buildings/bulk',
+                                            workers=workers if case == 'buildings/parallel' else 1)
+    else:
+        conn = psycopg2.connect(**db_config)
+        try:
+            if case == 'pois/copy':
+                load_pois(conn, files['pois'])
+            else:
+                load_stations(conn, files['stations'])
+        finally:
+            conn.close()
+    wall = time.perf_counter() - start
+
+    # ru_maxrss is in KiB on Linux; RUSAGE_CHILDREN covers the parallel loader's pool
+    results.put({
+        'wall_s': wall,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'peak_rss_workers_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    })
+
+
+def _ensure_database(db_config):
+    """Create the scratch database if it does not exist yet"""
+    admin = psycopg2.connect(**{**db_config, 'database': 'postgres'})
+    admin.autocommit = True
+    cur = admin.cursor()
+    cur.execute("SELECT 1 FROM pg_database WHERE datname = %s;", (db_config['database'],))
+    if not cur.fetchone():
+        cur.execute(f'CREATE DATABASE "{db_config["database"]}";')
+    cur.close()
+    admin.close()
+
+
+def _reset_schema(db_config):
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'init_stations.sql'), encoding='utf-8') as f:
+        stations_ddl = f.read()
+    conn = psycopg2.connect(**db_config)
+    cur = conn.cursor()
+    cur.execute(BENCH_SCHEMA)
+    cur.execute(stations_ddl)
+    conn.commit()
+    cur.execute("SELECT postgis_lib_version(), current_setting('server_version');")
+    versions = cur.fetchone()
+    cur.close()
+    conn.close()
+    return versions
+
+
+def _count_rows(db_config, table):
+    conn = psycopg2.connect(**db_config)
+    cur = conn.cursor()
+    cur.execute(f"SELECT COUNT(*) FROM {table};")
+    count = cur.fetchone()[0]
+    cur.close()
+    conn.close()
+    return count
+
+
+def run_benchmark(buildings, pois, stations, workers, repeat=1, cases=None,
+                  database=BENCH_DATABASE, workdir='bench_data', seed=GENERATE_SEED):
+    """Generate the city, run every case repeat times and return the JSON-ready report"""
+    if database == DB_CONFIG['database']:
+        raise ValueError(f"refusing to benchmark against the live database '{database}'")
+    db_config = {**DB_CONFIG, 'database': database}
+    cases = cases or list(CASE_TABLES)
+
+    start = time.time()
+    dataset = generate_city(workdir, buildings, pois, stations, seed)
+    print(f"Generated {buildings} buildings, {pois} POIs, {stations} stations in {time.time() - start:.1f}s "
+          f"(vertices p50 {dataset['vertices']['p50']}, p95 {dataset['vertices']['p95']})", file=sys.stderr)
+
+    _ensure_database(db_config)
+    context = multiprocessing.get_context('spawn')
+    results = []
+    postgis = server = None
+    for case in cases:
+        for run in range(1, repeat + 1):
+            postgis, server = _reset_schema(db_config)
+            queue = context.Queue()
+            process = context.Process(target=_run_case, args=(case, dataset['files'], workers, db_config, queue))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                results.append({'case': case, 'run': run, 'error': f"exit code {process.exitcode}"})
+                continue
+            measured = queue.get()
+            rows = _count_rows(db_config, CASE_TABLES[case])
+            results.append({
+                'case': case,
+                'run': run,
+                'rows': rows,
+                'wall_s': round(measured['wall_s'], 3),
+                'rows_per_sec': round(rows / max(measured['wall_s'], 1e-9), 1),
+                'peak_rss_mb': round(measured['peak_rss_mb'], 1),
+                'peak_rss_workers_mb': round(measured['peak_rss_workers_mb'], 1),
+            })
+            print(f"{case} #{run}: {rows} rows in {measured['wall_s']:.2f}s "
+                  f"({results[-1]['rows_per_sec']:,.0f} rows/sec, {results[-1]['peak_rss_mb']:.0f} MB)",
+                  file=sys.stderr)
+
+    return {
+        'generated_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'host': {'python': platform.python_version(), 'platform': platform.platform(),
+                 'cpus': os.cpu_count(), 'postgres': server, 'postgis': postgis},
+        'params': {'buildings': buildings, 'pois': pois, 'stations': stations,
+                   'workers': workers, 'repeat': repeat, 'seed': seed},
+        'dataset': {'vertices': dataset['vertices'], 'size_mb': dataset['size_mb']},
+        'results': results,
+    }
+
+
+def _best_rates(report):
+    """{case: best rows/sec over the repeats}"""
+    best = {}
+    for result in report['results']:
+        if 'rows_per_sec' in result:
+            best[result['case']] = max(best.get(result['case'], 0), result['rows_per_sec'])
+    return best
+
+
+def compare_reports(baseline, current, threshold=10.0):
+    """Print rows/sec per case against baseline; returns the cases slower by more than threshold %"""
+    old, new = _best_rates(baseline), _best_rates(current)
+    regressions = []
+    for case in sorted(set(old) | set(new)):
+        if case not in old or case not in new:
+            print(f"{case:20} {'-' if case not in old else f'{old[case]:,.0f}':>12} -> "
+                  f"{'-' if case not in new else f'{new[case]:,.0f}':>12}")
+            continue
+        change = (new[case] - old[case]) / max(old[case], 1e-9) * 100
+        flag = ''
+        if change < -threshold:
+            regressions.append(case)
+            flag = '  REGRESSION'
+        print(f"{case:20} {old[case]:>12,.0f} -> {new[case]:>12,.0f} rows/sec ({change:+.1f}%){flag}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the importers on a synthetic city")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help="Generate a city and load it with every import path")
+    run.add_argument('--buildings', type=int, default=100000)
+    run.add_argument('--pois', type=int, default=20000)
+    run.add_argument('--stations', type=int, default=2000)
+    run.add_argument('--workers', type=int, default=os.cpu_count() or 4, help="Processes for buildings/parallel")
+    run.add_argument('--repeat', type=int, default=1)
+    run.add_argument('--cases', help=f"Comma-separated subset of: {', '.join(CASE_TABLES)}")
+    run.add_argument('--database', default=BENCH_DATABASE, help="Scratch database (created if missing, wiped per run)")
+    run.add_argument('--workdir', default='bench_data', help="Where the generated files are written")
+    run.add_argument('--seed', type=int, default=GENERATE_SEED)
+    run.add_argument('--output', help="Write the JSON report here instead of stdout")
+    compare = commands.add_parser('compare', help="Compare two reports")
+    compare.add_argument('baseline')
+    compare.add_argument('report')
+    compare.add_argument('--threshold', type=float, default=10.0, help="Allowed rows/sec drop in %%")
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        with open(args.report, encoding='utf-8') as f:
+            current = json.load(f)
+        sys.exit(1 if compare_reports(baseline, current, args.threshold) else 0)
+
+    cases = args.cases.split(',') if args.cases else None
+    unknown = [c for c in cases or [] if c not in CASE_TABLES]
+    if unknown:
+        parser.error(f"unknown case(s): {', '.join(unknown)}")
+    try:
+        report = run_benchmark(args.buildings, args.pois, args.stations, args.workers, args.repeat,
+                               cases, args.database, args.workdir, args.seed)
+    except (ValueError, psycopg2.Error) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        print(f"Report written to {args.output}", file=sys.stderr)
+    else:
+        print(text)
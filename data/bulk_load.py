@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+"""
+Bulk loading helpers for the building importers
+Streams rows into PostGIS with COPY ... FROM STDIN (EWKB hex geometries)
+into a staging table, then swaps the staging table in place of the target
+(or, with a region, in place of the target's region partition; see regions.py).
+"""
+
+import hashlib
+import io
+import struct
+import time
+
+from dirty_tiles import DIRTY_MAX_ZOOM, DIRTY_MIN_ZOOM, upsert_dirty_sql
+from hilbert import cluster_statements, hilbert_order_by, is_hilbert_clustered, record_order_sql
+from instrumentation import stage
+from regions import (
+    RegionError, attach_partition, check_region, is_partitioned, record_region, region_columns_sql, region_target,
+    staging_name,
+)
+from validate_geometry import (
+    GeometryProblem, check_ring, print_validation_summary, reject_row, validate_table, validation_statements,
+)
+
+COPY_BATCH_SIZE = 50000  # rows per COPY round trip
+
+# Producers yield (osm_id, name, type, ewkb_hex); content_hash is added on the way in
+BUILDING_COLUMNS = ('osm_id', 'name', 'type', 'geom', 'content_hash')
+
+WKB_POLYGON = 3
+WKB_MULTIPOLYGON = 6
+EWKB_SRID_FLAG = 0x20000000
+
+
+def _pack_rings(rings):
+    """
+    Pack polygon rings as little-endian WKB ring data.
+    Unclosed rings are closed and broken holes dropped; a broken outer ring raises GeometryProblem.
+    """
+    flats = []
+    for index, ring in enumerate(rings):
+        try:
+            flats.append(check_ring([c for point in ring for c in point[:2]]))
+        except GeometryProblem:
+            if index == 0:
+                raise
+    parts = [struct.pack('<I', len(flats))]
+    for flat in flats:
+        parts.append(struct.pack('<I', len(flat) // 2))
+        parts.append(struct.pack(f'<{len(flat)}d', *flat))
+    return b''.join(parts)
+
+
+def encode_geometry(geometry, srid=4326):
+    """
+    Encode a GeoJSON Polygon/MultiPolygon geometry as hex EWKB, holes and parts included.
+    Returns (ewkb_hex, None), (None, reason) when the rings cannot be encoded,
+    or (None, None) for unsupported or empty geometries.
+    """
+    if not geometry:
+        return None, None
+    geom_type = geometry.get('type')
+    coords = geometry.get('coordinates')
+    if not coords:
+        return None, None
+
+    try:
+        if geom_type == 'Polygon':
+            body = _pack_rings(coords)
+            header = struct.pack('<BII', 1, WKB_POLYGON | EWKB_SRID_FLAG, srid)
+        elif geom_type == 'MultiPolygon':
+            polygons = []
+            problem = None
+            for polygon in coords:
+                try:
+                    polygons.append(_pack_rings(polygon))
+                except GeometryProblem as exc:
+                    problem = problem or exc  # a broken part is dropped, the others kept
+            if not polygons:
+                raise problem
+            parts = [struct.pack('<I', len(polygons))]
+            for packed in polygons:
+                parts.append(struct.pack('<BI', 1, WKB_POLYGON))
+                parts.append(packed)
+            body = b''.join(parts)
+            header = struct.pack('<BII', 1, WKB_MULTIPOLYGON | EWKB_SRID_FLAG, srid)
+        else:
+            return None, None
+    except GeometryProblem as exc:
+        return None, str(exc)
+
+    return (header + body).hex(), None
+
+
+def ewkb_hex(geometry, srid=4326):
+    """
+    Encode a GeoJSON Polygon/MultiPolygon geometry as hex EWKB.
+    Returns None for unsupported, empty or unencodable geometries.
+    """
+    return encode_geometry(geometry, srid)[0]
+
+
+def wkb_to_ewkb_hex(wkb_hex, srid=4326):
+    """Add an SRID to little-endian hex WKB (as produced by osmium's WKBFactory)"""
+    if not wkb_hex.startswith('01'):
+        raise ValueError("Only little-endian WKB is supported")
+    geom_type = int.from_bytes(bytes.fromhex(wkb_hex[2:10]), 'little') | EWKB_SRID_FLAG
+    return ('01' + struct.pack('<II', geom_type, srid).hex() + wkb_hex[10:])
+
+
+def feature_name_type(props):
+    """Pick building name/type from GeoJSON properties (OSM or ogr2ogr naming)"""
+    name = props.get('name', props.get('NAME', 'Unnamed Building'))
+    building_type = props.get('building', props.get('type', 'unknown'))
+    return name, building_type
+
+
+def feature_osm_id(feature):
+    """
+    Return a stable OSM key ('w123' for ways, 'r456' for relations) for a GeoJSON feature.
+    Understands ogr2ogr (osm_way_id/osm_id), osmium export ('w123') and Overpass ('way/123') ids.
+    """
+    props = feature.get('properties') or {}
+    if props.get('osm_way_id'):
+        return f"w{props['osm_way_id']}"
+    if props.get('osm_id'):
+        return f"r{props['osm_id']}"
+
+    raw = feature.get('id') or props.get('@id') or props.get('id')
+    if isinstance(raw, str):
+        kind, _, num = raw.partition('/')
+        if num.isdigit() and kind in ('way', 'relation'):
+            return f"{kind[0]}{num}"
+        if raw[:1] in ('w', 'r') and raw[1:].isdigit():
+            return raw
+    return None
+
+
+def geojson_rows(features, rejects=None):
+    """
+    Yield (osm_id, name, type, ewkb_hex) rows for Polygon/MultiPolygon features.
+    Features whose rings cannot be encoded are appended to rejects (see record_rejects).
+    """
+    for feature in features:
+        geometry = feature.get('geometry')
+        geom_hex, problem = encode_geometry(geometry)
+        if geom_hex is None:
+            if problem and rejects is not None:
+                name, building_type = feature_name_type(feature.get('properties') or {})
+                rejects.append(reject_row(feature_osm_id(feature), name, building_type, problem, geometry))
+            continue
+        name, building_type = feature_name_type(feature.get('properties') or {})
+        yield (feature_osm_id(feature), name, building_type, geom_hex)
+
+
+def with_content_hash(rows):
+    """
+    Append an md5 of (name, type, geometry) to each row.
+    Features without an OSM id are keyed by that hash, so unchanged ones still match.
+    """
+    for osm_id, name, building_type, geom_hex in rows:
+        digest = hashlib.md5('\x1f'.join((
+            '' if name is None else str(name),
+            '' if building_type is None else str(building_type),
+            geom_hex,
+        )).encode('utf-8')).hexdigest()
+        yield (osm_id or f"h{digest}", name, building_type, geom_hex, digest)
+
+
+def copy_escape(value):
+    """Escape a value for the COPY text format"""
+    if value is None:
+        return '\\N'
+    return (str(value)
+            .replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r'))
+
+
+def copy_rows(cur, table, columns, rows, batch_size=COPY_BATCH_SIZE):
+    """
+    Stream an iterable of row tuples into table with COPY FROM STDIN.
+    Rows are buffered batch_size at a time so memory stays bounded.
+    Returns the number of rows copied.
+    """
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+    total = 0
+    buf = io.StringIO()
+    pending = 0
+
+    for row in rows:
+        buf.write('\t'.join(copy_escape(v) for v in row))
+        buf.write('\n')
+        pending += 1
+        if pending >= batch_size:
+            buf.seek(0)
+            cur.copy_expert(sql, buf)
+            total += pending
+            buf = io.StringIO()
+            pending = 0
+
+    if pending:
+        buf.seek(0)
+        cur.copy_expert(sql, buf)
+        total += pending
+
+    return total
+
+
+BUILDING_EXTRA_COLUMNS = ('osm_id', 'content_hash', 'geom_3857', 'centroid')
+
+
+def building_columns_ddl(target='buildings'):
+    """
+    SQL adding the osm_id / content_hash columns used for incremental imports,
+    and the pre-projected geom_3857 / centroid columns PostGIS keeps in step with geom.
+    The ALTER TABLE (ACCESS EXCLUSIVE, recursing into every region partition) only
+    runs when a column or index is missing, so run it in its own transaction
+    before a load, never inside one.
+    """
+    statements = [
+        f"""ALTER TABLE {target}
+            ADD COLUMN IF NOT EXISTS osm_id VARCHAR(32),
+            ADD COLUMN IF NOT EXISTS content_hash CHAR(32),
+            ADD COLUMN IF NOT EXISTS geom_3857 GEOMETRY(Geometry, 3857)
+                GENERATED ALWAYS AS (ST_Transform(geom, 3857)) STORED,
+            ADD COLUMN IF NOT EXISTS centroid GEOMETRY(Point, 4326)
+                GENERATED ALWAYS AS (ST_Centroid(geom)) STORED""",
+        f"CREATE INDEX IF NOT EXISTS {target}_osm_id_idx ON {target} (osm_id)",
+        f"CREATE INDEX IF NOT EXISTS {target}_geom_3857_idx ON {target} USING GIST (geom_3857)",
+        f"CREATE INDEX IF NOT EXISTS {target}_centroid_idx ON {target} USING GIST (centroid)",
+    ]
+    executes = '\n                '.join(f"EXECUTE $ddl${statement}$ddl$;" for statement in statements)
+    return f"""
+        DO $$
+        BEGIN
+            IF (SELECT COUNT(*) FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = '{target}'
+                  AND column_name IN ({', '.join(f"'{c}'" for c in BUILDING_EXTRA_COLUMNS)}))
+                   < {len(BUILDING_EXTRA_COLUMNS)}
+               OR to_regclass('{target}_osm_id_idx') IS NULL
+               OR to_regclass('{target}_geom_3857_idx') IS NULL
+               OR to_regclass('{target}_centroid_idx') IS NULL THEN
+                {executes}
+            END IF;
+        END $$;
+    """
+
+
+def ensure_building_columns(cur, target='buildings'):
+    """Add the building_columns_ddl columns when missing, committed on its own: call it before starting a load"""
+    cur.execute(building_columns_ddl(target))
+    cur.connection.commit()
+
+
+def create_staging_table(cur, target='buildings', staging=None):
+    """Create an empty staging copy of target (columns, defaults and generated columns; no indexes)"""
+    staging = staging or f"{target}_staging"
+    cur.execute(f"DROP TABLE IF EXISTS {staging};")
+    cur.execute(f"""
+        CREATE TABLE {staging} (LIKE {target} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING GENERATED);
+    """)
+    return staging
+
+
+def staging_indexes_sql(staging, primary_key='id'):
+    """SQL building the staging table's primary key and indexes, named after it"""
+    return f"""
+        ALTER TABLE {staging} ADD CONSTRAINT {staging}_pkey PRIMARY KEY ({primary_key});
+        CREATE INDEX {staging}_geom_idx ON {staging} USING GIST (geom);
+        CREATE INDEX {staging}_osm_id_idx ON {staging} (osm_id);
+        CREATE INDEX {staging}_geom_3857_idx ON {staging} USING GIST (geom_3857);
+        CREATE INDEX {staging}_centroid_idx ON {staging} USING GIST (centroid);
+    """
+
+
+def swap_in_staging(cur, staging, target='buildings', hilbert=False):
+    """
+    Index the staging table, then replace target with it.
+    The id sequence is handed over to the staging table so it survives the drop,
+    and index/constraint names are renamed to match the original table.
+    hilbert=True: staging has a {staging}_hilbert_idx clustering index (see hilbert.py).
+    """
+    cur.execute(staging_indexes_sql(staging))
+
+    cur.execute("SELECT pg_get_serial_sequence(%s, 'id');", (target,))
+    row = cur.fetchone()
+    sequence = row[0] if row else None
+    if sequence:
+        cur.execute(f"ALTER SEQUENCE {sequence} OWNED BY {staging}.id;")
+
+    cur.execute(f"DROP TABLE {target};")
+    cur.execute(f"ALTER TABLE {staging} RENAME TO {target};")
+    cur.execute(f"ALTER TABLE {target} RENAME CONSTRAINT {staging}_pkey TO {target}_pkey;")
+    cur.execute(f"ALTER INDEX {staging}_geom_idx RENAME TO {target}_geom_idx;")
+    cur.execute(f"ALTER INDEX {staging}_osm_id_idx RENAME TO {target}_osm_id_idx;")
+    cur.execute(f"ALTER INDEX {staging}_geom_3857_idx RENAME TO {target}_geom_3857_idx;")
+    cur.execute(f"ALTER INDEX {staging}_centroid_idx RENAME TO {target}_centroid_idx;")
+    if hilbert:
+        cur.execute(f"ALTER INDEX {staging}_hilbert_idx RENAME TO {target}_hilbert_idx;")
+    cur.execute(f"ANALYZE {target};")
+
+
+def bulk_load_buildings(conn, rows, target='buildings', hilbert=False, region=None):
+    """
+    Load (osm_id, name, type, ewkb_hex) rows into target through a staging table.
+    Invalid geometries are repaired or quarantined before the staging table is indexed.
+    hilbert=True rewrites the staging table in Hilbert order first (see hilbert.py).
+    region='london' replaces only target's london partition (see regions.py);
+    a partitioned target cannot be replaced as a whole.
+    The load happens in one transaction, so readers see either the old or the new table.
+    Returns the number of rows loaded.
+    """
+    start = time.time()
+    cur = conn.cursor()
+
+    ensure_building_columns(cur, target)
+    if region:
+        staging = create_staging_table(cur, target, staging_name(target, check_region(region)))
+        cur.execute(region_columns_sql(staging, region))
+    elif is_partitioned(cur, target):
+        raise RegionError(f"{target} is partitioned by region: pass --region")
+    else:
+        staging = create_staging_table(cur, target)
+    # Parsing / encoding happens lazily in rows, so this is the Python hot loop
+    with stage('copy', hot=True) as st:
+        count = copy_rows(cur, staging, BUILDING_COLUMNS, with_content_hash(rows))
+        st.add(rows_in=count, rows_out=count)
+    loaded_at = time.time()
+    with stage('validate') as st:
+        validation = validate_table(cur, staging, target)
+        st.add(rows_in=count, rows_out=count - validation['rejected'])
+    if hilbert:
+        # Before the GIST indexes exist, so CLUSTER only rebuilds the hilbert_key btree
+        with stage('hilbert_sort'):
+            for _, sql in cluster_statements(staging):
+                cur.execute(sql)
+    with stage('index_swap'):
+        if region:
+            cur.execute(staging_indexes_sql(staging, 'id, region'))
+            attach_partition(cur, target, region, staging)
+        else:
+            swap_in_staging(cur, staging, target, hilbert)
+        conn.commit()
+    cur.close()
+
+    elapsed = max(time.time() - start, 1e-9)
+    copy_elapsed = max(loaded_at - start, 1e-9)
+    print(f"COPY: {count} rows in {copy_elapsed:.1f}s ({count / copy_elapsed:,.0f} rows/sec)")
+    print(f"Total incl. index + swap: {elapsed:.1f}s ({count / elapsed:,.0f} rows/sec)")
+    print_validation_summary(validation)
+    return count - validation['rejected']
+
+
+def create_incoming_table(cur, target='buildings'):
+    """Temp table holding the new snapshot for an upsert; dropped at commit"""
+    incoming = f"{target}_incoming"
+    cur.execute(f"DROP TABLE IF EXISTS {incoming};")
+    cur.execute(f"""
+        CREATE TEMP TABLE {incoming} ON COMMIT DROP AS
+        SELECT {', '.join(BUILDING_COLUMNS)} FROM {target} WITH NO DATA;
+    """)
+    return incoming
+
+
+def upsert_statements(incoming, target='buildings', delete_missing=True, dirty_zooms=None, validate=True,
+                      hilbert=False):
+    """
+    Set-based diff of incoming against target, keyed on osm_id:
+    delete vanished rows, update rows whose content_hash changed, insert new ones.
+    dirty_zooms=(min, max) first marks the affected tiles in dirty_tiles.
+    validate=True repairs / quarantines invalid incoming geometries first.
+    hilbert=True appends new rows in Hilbert order and records it on target (see hilbert.py).
+    Returned as (label, sql) pairs so psql-driven importers can reuse them.
+    """
+    columns = ', '.join(BUILDING_COLUMNS)
+    statements = [
+        ('dedupe', f"""
+            DELETE FROM {incoming} a USING {incoming} b
+            WHERE a.osm_id = b.osm_id AND a.ctid < b.ctid;
+        """),
+        *(validation_statements(incoming, target) if validate else []),
+        ('index', f"CREATE INDEX ON {incoming} (osm_id); ANALYZE {incoming};"),
+        ('dirty', upsert_dirty_sql(incoming, target, dirty_zooms, delete_missing) if dirty_zooms else None),
+        ('deleted', f"""
+            DELETE FROM {target} t
+            WHERE t.osm_id IS NULL
+               OR NOT EXISTS (SELECT 1 FROM {incoming} i WHERE i.osm_id = t.osm_id);
+        """),
+        ('updated', f"""
+            UPDATE {target} t
+            SET name = i.name, type = i.type, geom = i.geom, content_hash = i.content_hash
+            FROM {incoming} i
+            WHERE t.osm_id = i.osm_id
+              AND t.content_hash IS DISTINCT FROM i.content_hash;
+        """),
+        ('hilbert', record_order_sql(target) if hilbert else None),
+        ('inserted', f"""
+            INSERT INTO {target} ({columns})
+            SELECT {columns} FROM {incoming} i
+            WHERE NOT EXISTS (SELECT 1 FROM {target} t WHERE t.osm_id = i.osm_id)
+            {hilbert_order_by() if hilbert else ''};
+        """),
+    ]
+    return [(label, sql) for label, sql in statements
+            if sql and (delete_missing or label != 'deleted')]
+
+
+def apply_upsert(cur, incoming, target='buildings', delete_missing=True, dirty_zooms=None, validate=True,
+                 hilbert=False):
+    """
+    Run upsert_statements and return the inserted/updated/deleted (and repaired/rejected) row counts.
+    delete_missing=False treats incoming as a partial change set (e.g. a replication diff).
+    """
+    counts = {'deleted': 0}
+    for label, sql in upsert_statements(incoming, target, delete_missing, dirty_zooms, validate, hilbert):
+        with stage(label) as st:
+            cur.execute(sql)
+            if label in ('repaired', 'rejected', 'dirty', 'deleted', 'updated', 'inserted'):
+                counts[label] = cur.rowcount
+                st.add(rows_out=cur.rowcount)
+    return counts
+
+
+def upsert_buildings(conn, rows, target='buildings', dirty_zooms=(DIRTY_MIN_ZOOM, DIRTY_MAX_ZOOM), hilbert=False,
+                     region=None):
+    """
+    Incrementally sync target with (osm_id, name, type, ewkb_hex) rows.
+    Only the diff is written, so unchanged buildings keep their ids and tuples,
+    and the tiles it touches are marked in dirty_tiles (dirty_zooms=None to skip).
+    New rows are appended in Hilbert order with hilbert=True or when target is
+    already clustered that way.
+    region='london' diffs against target's london partition only (see regions.py).
+    Returns the inserted/updated/deleted/unchanged counts.
+    """
+    start = time.time()
+    cur = conn.cursor()
+
+    ensure_building_columns(cur, target)
+    table = region_target(cur, target, region)
+    incoming = create_incoming_table(cur, table)
+    with stage('copy', hot=True) as st:
+        total = copy_rows(cur, incoming, BUILDING_COLUMNS, with_content_hash(rows))
+        st.add(rows_in=total, rows_out=total)
+    hilbert = hilbert or is_hilbert_clustered(cur, table)
+    with stage('diff'):
+        counts = apply_upsert(cur, incoming, table, dirty_zooms=dirty_zooms, hilbert=hilbert)
+        if region:
+            record_region(cur, target, region)
+        conn.commit()
+    cur.close()
+
+    counts['unchanged'] = max(0, total - counts.get('rejected', 0) - counts['inserted'] - counts['updated'])
+    print_upsert_summary(counts, time.time() - start)
+    return counts
+
+
+def print_upsert_summary(counts, elapsed):
+    print(f"Upsert: {counts['inserted']} inserted, {counts['updated']} updated, "
+          f"{counts['deleted']} deleted, {counts['unchanged']} unchanged in {elapsed:.1f}s")
+    if 'dirty' in counts:
+        print(f"Marked {counts['dirty']} tiles dirty")
+    print_validation_summary(counts)
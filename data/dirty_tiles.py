@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Dirty-tile tracking for incremental imports
+Importers mark every z/x/y tile touched by the bounding box of an inserted,
+updated or deleted building in the dirty_tiles table (deduplicated by its
+primary key). The list can be exported to a file or consumed by
+seed_tiles.py dirty, so only those tiles are re-rendered or purged.
+
+Usage:
+  python dirty_tiles.py                 # show how many tiles are dirty per zoom
+  python dirty_tiles.py tiles.txt       # write z/x/y lines to tiles.txt and clear the table
+"""
+
+import sys
+
+DIRTY_TILES_TABLE = 'dirty_tiles'
+DIRTY_MIN_ZOOM = 12  # same range as the pre-seeded tile cache
+DIRTY_MAX_ZOOM = 16
+MAX_LATITUDE = 85.0511  # Web Mercator limit
+
+
+def dirty_tiles_ddl():
+    return f"""
+    CREATE TABLE IF NOT EXISTS {DIRTY_TILES_TABLE} (
+        z SMALLINT NOT NULL,
+        x INTEGER NOT NULL,
+        y INTEGER NOT NULL,
+        marked_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (z, x, y)
+    );
+    """
+
+
+def mark_tiles_sql(geometries, min_zoom=DIRTY_MIN_ZOOM, max_zoom=DIRTY_MAX_ZOOM):
+    """
+    INSERT marking every tile in [min_zoom, max_zoom] that intersects the bbox of
+    each EPSG:4326 geometry returned by the geometries query (one geom column).
+    Tiles already marked get a fresh marked_at so a running refresh does not clear them.
+    """
+    n = '(2 ^ zoom.z)'
+    tile_x = f"LEAST(GREATEST(floor(({{lon}} + 180) / 360 * {n})::int, 0), {n}::int - 1)"
+    tile_y = (f"LEAST(GREATEST(floor((1 - asinh(tan(radians({{lat}}))) / pi()) / 2 * {n})::int, 0), "
+              f"{n}::int - 1)")
+    return f"""
+    INSERT INTO {DIRTY_TILES_TABLE} (z, x, y)
+    SELECT DISTINCT b.z, x, y
+    FROM (
+        SELECT zoom.z,
+               {tile_x.format(lon='ST_XMin(g.geom)')} AS x0,
+               {tile_x.format(lon='ST_XMax(g.geom)')} AS x1,
+               {tile_y.format(lat=f'LEAST(ST_YMax(g.geom), {MAX_LATITUDE})')} AS y0,
+               {tile_y.format(lat=f'GREATEST(ST_YMin(g.geom), -{MAX_LATITUDE})')} AS y1
+        FROM ({geometries}) g(geom), generate_series({int(min_zoom)}, {int(max_zoom)}) zoom(z)
+        WHERE g.geom IS NOT NULL
+    ) b, generate_series(b.x0, b.x1) x, generate_series(b.y0, b.y1) y
+    ON CONFLICT (z, x, y) DO UPDATE SET marked_at = now();
+    """
+
+
+def upsert_dirty_sql(incoming, target='buildings', zooms=(DIRTY_MIN_ZOOM, DIRTY_MAX_ZOOM),
+                     delete_missing=True):
+    """
+    Mark the tiles an upsert of incoming into target is about to change:
+    old geometries of vanished and changed rows, new geometries of changed and new rows.
+    Must run before the delete/update/insert statements.
+    """
+    changed = [f"""
+        SELECT unnest(ARRAY[t.geom, i.geom]) FROM {target} t
+        JOIN {incoming} i ON i.osm_id = t.osm_id
+        WHERE t.content_hash IS DISTINCT FROM i.content_hash""", f"""
+        SELECT i.geom FROM {incoming} i
+        WHERE NOT EXISTS (SELECT 1 FROM {target} t WHERE t.osm_id = i.osm_id)"""]
+    if delete_missing:
+        changed.append(f"""
+        SELECT t.geom FROM {target} t
+        WHERE t.osm_id IS NULL
+           OR NOT EXISTS (SELECT 1 FROM {incoming} i WHERE i.osm_id = t.osm_id)""")
+    return dirty_tiles_ddl() + mark_tiles_sql(' UNION ALL '.join(changed), *zooms)
+
+
+def fetch_dirty_tiles(cur):
+    """Return (sorted [(z, x, y)], latest marked_at) for the tiles currently marked dirty"""
+    cur.execute(dirty_tiles_ddl())
+    cur.execute(f"SELECT z, x, y, marked_at FROM {DIRTY_TILES_TABLE} ORDER BY z, x, y;")
+    rows = cur.fetchall()
+    marked_before = max((row[3] for row in rows), default=None)
+    return [row[:3] for row in rows], marked_before
+
+
+def clear_dirty_tiles(cur, marked_before):
+    """Forget tiles marked up to marked_before (tiles re-marked since then are kept)"""
+    if marked_before is None:
+        return 0
+    cur.execute(f"DELETE FROM {DIRTY_TILES_TABLE} WHERE marked_at <= %s;", (marked_before,))
+    return cur.rowcount
+
+
+def write_tile_list(tiles, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        for z, x, y in tiles:
+            f.write(f"{z}/{x}/{y}\n")
+
+
+def export_dirty_tiles(conn, path):
+    """Write the dirty tiles to path as z/x/y lines and clear them; returns the number written"""
+    cur = conn.cursor()
+    tiles, marked_before = fetch_dirty_tiles(cur)
+    write_tile_list(tiles, path)
+    clear_dirty_tiles(cur, marked_before)
+    conn.commit()
+    cur.close()
+    print(f"✓ {len(tiles)} dirty tiles written to {path}")
+    return len(tiles)
+
+
+if __name__ == '__main__':
+    import psycopg2
+
+    from import_osm_data import DB_CONFIG
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    if len(sys.argv) > 1:
+        export_dirty_tiles(conn, sys.argv[1])
+    else:
+        cur = conn.cursor()
+        tiles, _ = fetch_dirty_tiles(cur)
+        conn.commit()
+        per_zoom = {}
+        for z, _, _ in tiles:
+            per_zoom[z] = per_zoom.get(z, 0) + 1
+        print(f"{len(tiles)} dirty tiles")
+        for z in sorted(per_zoom):
+            print(f"  z{z}: {per_zoom[z]}")
+    conn.close()
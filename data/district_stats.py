@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Precompute per-district charging station statistics for /api/district-safety
+Loads hanoi_districts and charge_stations once, assigns every station to the
+districts it falls in with a single STRtree bulk query, counts distinct
+coordinates per category with NumPy and writes district_station_stats.
+The endpoint reads that table while it is newer than the last station sync.
+
+Requires shapely >= 2.0 and numpy.
+
+Usage:
+  python district_stats.py
+"""
+
+import sys
+import time
+
+import numpy as np
+import psycopg2
+import shapely
+from psycopg2.extras import execute_values
+
+from import_osm_data import DB_CONFIG
+
+# Same status values as the live query in backend/src/routes/districtSafety.ts
+OPEN_STATUSES = ('Open', 'Hoạt động', 'Đang hoạt động', '1')
+MAINTENANCE_STATUSES = ('Maintenance', 'Bảo trì')
+BATTERY_MARKER = 'pin'
+
+STAT_COLUMNS = ('total_stations', 'battery_stations', 'charging_stations',
+                'open_stations', 'maintenance_stations')
+
+
+def _load_districts(cur):
+    """(ids, polygons) with the polygons in EPSG:3857 like charge_stations.geom"""
+    cur.execute("""
+        SELECT id, ST_AsBinary(ST_Transform(geom, 3857))
+        FROM hanoi_districts WHERE geom IS NOT NULL ORDER BY id;
+    """)
+    rows = cur.fetchall()
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    polygons = shapely.from_wkb([bytes(row[1]) for row in rows])
+    return ids, polygons
+
+
+def _load_stations(cur):
+    """(xy, name, category, status) for every station with a geometry"""
+    cur.execute("""
+        SELECT ST_X(ST_Transform(geom, 3857)), ST_Y(ST_Transform(geom, 3857)), name, category, status
+        FROM charge_stations WHERE geom IS NOT NULL;
+    """)
+    rows = cur.fetchall()
+    xy = np.array([(row[0], row[1]) for row in rows], dtype=np.float64).reshape(-1, 2)
+    return xy, [row[2] for row in rows], [row[3] for row in rows], [row[4] for row in rows]
+
+
+def _contains_marker(values):
+    """LOWER(v) LIKE '%pin%' with SQL NULL semantics: True / False / None"""
+    return [None if v is None else BATTERY_MARKER in v.lower() for v in values]
+
+
+def station_flags(names, categories, statuses):
+    """Boolean arrays selecting the stations counted in each STAT_COLUMNS entry"""
+    in_name = _contains_marker(names)
+    in_category = _contains_marker(categories)
+    # OR / AND NOT with NULLs: a NULL operand only matters when the other side does not decide
+    battery = np.array([c is True or n is True for c, n in zip(in_category, in_name)], dtype=bool)
+    charging = np.array([c is False and n is False for c, n in zip(in_category, in_name)], dtype=bool)
+    status = np.array([s or '' for s in statuses], dtype=object)
+    return {
+        'total_stations': np.ones(len(statuses), dtype=bool),
+        'battery_stations': battery,
+        'charging_stations': charging,
+        'open_stations': np.isin(status, OPEN_STATUSES),
+        'maintenance_stations': np.isin(status, MAINTENANCE_STATUSES),
+    }
+
+
+def district_counts(polygons, xy, flags):
+    """
+    {column: per-district counts} where each count is the number of distinct
+    station coordinates inside the district among the flagged stations.
+    """
+    tree = shapely.STRtree(polygons)
+    # One bulk query for all stations: [station index, district index] pairs
+    station_idx, district_idx = tree.query(shapely.points(xy), predicate='intersects')
+    counts = {}
+    for column, mask in flags.items():
+        keep = mask[station_idx]
+        keys = np.column_stack([district_idx[keep].astype(np.float64), xy[station_idx[keep]]])
+        unique = np.unique(keys, axis=0)  # identical coordinates in one district count once
+        counts[column] = np.bincount(unique[:, 0].astype(np.int64), minlength=len(polygons))
+    return counts
+
+
+def refresh_district_stats(conn):
+    """Rebuild district_station_stats; returns the number of districts written"""
+    start = time.time()
+    cur = conn.cursor()
+    for table in ('hanoi_districts', 'charge_stations'):
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (table,))
+        if not cur.fetchone()[0]:
+            print(f"{table} not found, skipping district stats")
+            cur.close()
+            return 0
+
+    # Snapshot of the station table the stats are computed from
+    cur.execute("SELECT MAX(last_updated), COUNT(*) FROM charge_stations;")
+    source_updated_at, source_count = cur.fetchone()
+
+    ids, polygons = _load_districts(cur)
+    xy, names, categories, statuses = _load_stations(cur)
+    counts = district_counts(polygons, xy, station_flags(names, categories, statuses))
+    computed = time.time()
+
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS district_station_stats (
+            district_id INTEGER PRIMARY KEY,
+            {', '.join(f'{column} INTEGER NOT NULL' for column in STAT_COLUMNS)}
+        );
+        CREATE TABLE IF NOT EXISTS district_station_stats_meta (
+            source_updated_at TIMESTAMP,
+            source_count BIGINT NOT NULL,
+            refreshed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        DELETE FROM district_station_stats;
+        DELETE FROM district_station_stats_meta;
+    """)
+    rows = [(int(district_id), *(int(counts[column][i]) for column in STAT_COLUMNS))
+            for i, district_id in enumerate(ids)]
+    execute_values(cur, f"""
+        INSERT INTO district_station_stats (district_id, {', '.join(STAT_COLUMNS)}) VALUES %s
+    """, rows)
+    cur.execute("""
+        INSERT INTO district_station_stats_meta (source_updated_at, source_count) VALUES (%s, %s);
+    """, (source_updated_at, source_count))
+    conn.commit()
+    cur.close()
+
+    print(f"✓ district_station_stats: {len(rows)} districts, {len(xy)} stations "
+          f"(join {computed - start:.2f}s, total {time.time() - start:.2f}s)")
+    return len(rows)
+
+
+if __name__ == '__main__':
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        refresh_district_stats(conn)
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"Error refreshing district stats: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
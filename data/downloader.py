@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Resumable, optionally parallel HTTP downloader for OSM extracts
+- resumes from <output>.part with HTTP Range after a dropped connection
+- can fetch N byte ranges concurrently (one .part.<i> segment per range)
+- verifies against the Geofabrik <url>.md5 file
+- skips the download when the server's ETag/Last-Modified are unchanged
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'
+BUFFER_SIZE = 1024 * 1024  # 1 MB reads/writes
+MAX_RETRIES = 5
+RETRY_WAIT = 3  # seconds, multiplied by the attempt number
+TIMEOUT = 60
+
+
+class DownloadError(Exception):
+    pass
+
+
+class RangeNotSupported(DownloadError):
+    """The server answered a byte range request with the whole file"""
+
+
+def _request(url, method='GET', headers=None):
+    req = urllib.request.Request(url, method=method)
+    req.add_header('User-Agent', USER_AGENT)
+    for key, value in (headers or {}).items():
+        req.add_header(key, value)
+    return urllib.request.urlopen(req, timeout=TIMEOUT)
+
+
+def _meta_path(output):
+    return output + '.meta.json'
+
+
+def _load_meta(output):
+    try:
+        with open(_meta_path(output), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_meta(output, meta):
+    with open(_meta_path(output), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+
+
+def probe(url):
+    """HEAD the URL; returns dict(size, etag, last_modified, ranges)"""
+    with _request(url, method='HEAD') as resp:
+        headers = resp.headers
+        return {
+            'size': int(headers.get('Content-Length') or 0),
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'ranges': headers.get('Accept-Ranges', '').lower() == 'bytes',
+        }
+
+
+def is_unchanged(output, remote):
+    """True when output exists and matches the ETag/Last-Modified recorded last time"""
+    if not os.path.exists(output):
+        return False
+    meta = _load_meta(output)
+    if not meta:
+        return False
+    if remote.get('etag') and meta.get('etag'):
+        return remote['etag'] == meta['etag']
+    if remote.get('last_modified') and meta.get('last_modified'):
+        return remote['last_modified'] == meta['last_modified']
+    return False
+
+
+class _Progress:
+    """Thread-safe byte counter printing a single progress line"""
+
+    def __init__(self, total, done=0):
+        self.total = total
+        self.done = done
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.start_done = done
+        self.last_print = 0
+
+    def add(self, n):
+        with self.lock:
+            self.done += n
+            now = time.time()
+            if now - self.last_print < 0.5 and self.done < self.total:
+                return
+            self.last_print = now
+            mb = self.done / 1024 / 1024
+            speed = (self.done - self.start_done) / 1024 / 1024 / max(now - self.start, 1e-9)
+            if self.total:
+                percent = min(int(self.done * 100 / self.total), 100)
+                print(f"\rProgress: {percent}% ({mb:.1f} / {self.total / 1024 / 1024:.1f} MB, {speed:.1f} MB/s)",
+                      end='', flush=True)
+            else:
+                print(f"\rDownloaded: {mb:.1f} MB ({speed:.1f} MB/s)", end='', flush=True)
+
+
+def _fetch_range(url, path, start, end, progress, validator=None):
+    """
+    Download bytes [start, end] (end=None: to EOF) into path, resuming from its current size.
+    validator (ETag/Last-Modified) is sent as If-Range so a changed file restarts from zero.
+    """
+    for attempt in range(1, MAX_RETRIES + 1):
+        have = os.path.getsize(path) if os.path.exists(path) else 0
+        if end is not None and start + have > end:
+            return
+        headers = {}
+        if start + have > 0 or end is not None:
+            headers['Range'] = f"bytes={start + have}-{'' if end is None else end}"
+            if validator:
+                headers['If-Range'] = validator
+        try:
+            with _request(url, headers=headers) as resp:
+                if headers.get('Range') and resp.status != 206:
+                    if start > 0 or end is not None:
+                        # A segment would get the whole file: nothing to salvage here
+                        raise RangeNotSupported("Server ignored the Range request")
+                    # Full body instead of a partial one: start this file over
+                    progress.add(-have)
+                    have = 0
+                mode = 'ab' if have else 'wb'
+                with open(path, mode) as f:
+                    while True:
+                        chunk = resp.read(BUFFER_SIZE)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        progress.add(len(chunk))
+            return
+        except (urllib.error.URLError, OSError) as exc:
+            if isinstance(exc, urllib.error.HTTPError) and exc.code == 416:
+                return  # range already complete
+            if attempt == MAX_RETRIES:
+                raise DownloadError(f"{exc} (after {attempt} attempts)")
+            wait = RETRY_WAIT * attempt
+            print(f"\n⚠ {exc}; resuming in {wait}s (attempt {attempt + 1}/{MAX_RETRIES})...")
+            time.sleep(wait)
+
+
+def _segments(size, parts):
+    step = -(-size // parts)
+    return [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+
+
+def fetch_md5(url):
+    """Return the hex digest from <url>.md5 (Geofabrik format '<md5>  <name>'), or None"""
+    try:
+        with _request(url + '.md5') as resp:
+            return resp.read().decode('ascii', 'replace').split()[0].lower()
+    except (urllib.error.URLError, OSError, IndexError):
+        return None
+
+
+def file_md5(path):
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(BUFFER_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _fetch_segments(url, part, size, connections, validator):
+    """Fetch size bytes as connections concurrent ranges (part.<i>), then join them into part"""
+    segments = _segments(size, connections)
+    paths = [f"{part}.{i}" for i in range(len(segments))]
+    done = sum(os.path.getsize(p) for p in paths if os.path.exists(p))
+    progress = _Progress(size, done)
+    if done:
+        print(f"Resuming from {done / 1024 / 1024:.1f} MB")
+    errors = []
+
+    def worker(seg_path, seg):
+        try:
+            _fetch_range(url, seg_path, seg[0], seg[1], progress, validator)
+        except DownloadError as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=worker, args=(p, seg)) for p, seg in zip(paths, segments)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    print()
+    for exc in errors:
+        if isinstance(exc, RangeNotSupported):
+            # Segments cannot be resumed from this server either
+            for p in paths:
+                if os.path.exists(p):
+                    os.remove(p)
+            raise exc
+    if errors:
+        raise errors[0]
+
+    with open(part, 'wb') as out:
+        for p in paths:
+            with open(p, 'rb') as f:
+                for chunk in iter(lambda: f.read(BUFFER_SIZE), b''):
+                    out.write(chunk)
+    for p in paths:
+        os.remove(p)
+
+
+def download(url, output, connections=1, verify=True, force=False):
+    """
+    Download url to output.
+    Returns 'unchanged' when the remote file has not changed since the last download,
+    'downloaded' on success; raises DownloadError on failure (partial data is kept for resuming).
+    """
+    remote = probe(url)
+    if not force and is_unchanged(output, remote):
+        print(f"{output} is up to date (ETag/Last-Modified unchanged), skipping download")
+        return 'unchanged'
+
+    meta = _load_meta(output)
+    validator = remote.get('etag') or remote.get('last_modified')
+    part = output + '.part'
+    size = remote['size']
+
+    # Partial data from a different version of the file cannot be resumed
+    if meta.get('partial_of') and meta['partial_of'] != validator:
+        for name in os.listdir(os.path.dirname(os.path.abspath(output))):
+            if name.startswith(os.path.basename(part)):
+                os.remove(os.path.join(os.path.dirname(os.path.abspath(output)), name))
+    _save_meta(output, dict(meta, partial_of=validator))
+
+    print(f"Downloading {url}")
+    print(f"Output: {output}" + (f" ({size / 1024 / 1024:.1f} MB)" if size else ''))
+
+    parallel = connections > 1 and remote['ranges'] and size
+    if parallel:
+        try:
+            _fetch_segments(url, part, size, connections, validator)
+        except RangeNotSupported as exc:
+            print(f"⚠ {exc} despite Accept-Ranges, falling back to a single connection")
+            parallel = False
+    if not parallel:
+        done = os.path.getsize(part) if os.path.exists(part) else 0
+        if done and not remote['ranges']:
+            done = 0
+            os.remove(part)
+        if done:
+            print(f"Resuming from {done / 1024 / 1024:.1f} MB")
+        progress = _Progress(size, done)
+        _fetch_range(url, part, 0, None, progress, validator)
+        print()
+
+    if size and os.path.getsize(part) != size:
+        raise DownloadError(f"Size mismatch: got {os.path.getsize(part)} bytes, expected {size}")
+
+    if verify:
+        expected = fetch_md5(url)
+        if expected:
+            actual = file_md5(part)
+            if actual != expected:
+                os.remove(part)
+                raise DownloadError(f"MD5 mismatch: got {actual}, expected {expected}")
+            print(f"✓ MD5 verified ({actual})")
+        else:
+            print("⚠ No .md5 file published next to the download, skipping verification")
+
+    os.replace(part, output)
+    _save_meta(output, {'url': url, 'etag': remote.get('etag'),
+                        'last_modified': remote.get('last_modified'), 'size': size})
+    print(f"✓ Download complete: {os.path.getsize(output) / 1024 / 1024:.1f} MB")
+    return 'downloaded'
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("Usage: python downloader.py <url> <output> [--connections N] [--no-verify] [--force]")
+        sys.exit(1)
+
+    connections = 1
+    if '--connections' in sys.argv:
+        connections = int(sys.argv[sys.argv.index('--connections') + 1])
+    try:
+        download(sys.argv[1], sys.argv[2], connections,
+                 verify='--no-verify' not in sys.argv, force='--force' in sys.argv)
+    except (DownloadError, urllib.error.URLError) as exc:
+        print(f"\n✗ Download failed: {exc}")
+        sys.exit(1)
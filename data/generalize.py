@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Build generalized (multi-resolution) copies of the full-detail geometry tables
+- buildings_z10 / buildings_z13: buildings simplified to ~1 pixel at that zoom,
+  with buildings smaller than ~1 square pixel dropped
+- hanoi_districts_simplified: district boundaries simplified as a coverage, so
+  neighbouring districts keep a shared edge (no gaps/overlaps)
+Each copy is rebuilt next to the live table, GIST-indexed and swapped in.
+When buildings is stored in Hilbert order (--hilbert, see hilbert.py) its
+copies are written in the same order.
+
+Usage:
+  python generalize.py [buildings|districts|all]
+"""
+
+import sys
+import time
+
+import psycopg2
+
+from bulk_load import ensure_building_columns
+from hilbert import HILBERT_FUNCTION_DDL, hilbert_order_by, is_hilbert_clustered, record_order_sql
+from import_osm_data import DB_CONFIG
+
+EARTH_CIRCUMFERENCE = 40075016.686  # metres, EPSG:3857
+TILE_SIZE = 256
+MIN_AREA_PIXELS = 1.0  # drop features smaller than this many square pixels
+
+# generalized table -> zoom level it is simplified for
+BUILDING_LEVELS = {
+    'buildings_z10': 10,
+    'buildings_z13': 13,
+}
+DISTRICT_ZOOM = 12
+
+
+def pixel_size(zoom):
+    """Web Mercator metres per pixel at zoom (at the equator, i.e. in EPSG:3857 units)"""
+    return EARTH_CIRCUMFERENCE / (TILE_SIZE * 2 ** zoom)
+
+
+def _has_function(cur, name):
+    cur.execute("SELECT to_regproc(%s) IS NOT NULL;", (name,))
+    return cur.fetchone()[0]
+
+
+def _geometry_stats(cur, table):
+    """(rows, vertices, bytes) of table.geom"""
+    cur.execute(f"SELECT COUNT(*), COALESCE(SUM(ST_NPoints(geom)), 0), "
+                f"COALESCE(SUM(ST_MemSize(geom)), 0) FROM {table};")
+    return cur.fetchone()
+
+
+def _replace_table(cur, name, select_sql, hilbert=False):
+    """
+    Create name from select_sql under a temporary name, index it and swap it in
+    hilbert=True writes the rows in Hilbert order and records it as the clustering index.
+    """
+    new = f"{name}_new"
+    cur.execute(f"DROP TABLE IF EXISTS {new};")
+    if hilbert:
+        cur.execute(HILBERT_FUNCTION_DDL)
+        cur.execute(f"CREATE TABLE {new} AS SELECT * FROM ({select_sql}) s {hilbert_order_by()};")
+        cur.execute(record_order_sql(new))
+    else:
+        cur.execute(f"CREATE TABLE {new} AS {select_sql};")
+    cur.execute(f"ALTER TABLE {new} ADD CONSTRAINT {new}_pkey PRIMARY KEY (id);")
+    cur.execute(f"CREATE INDEX {new}_geom_idx ON {new} USING GIST (geom);")
+    cur.execute(f"DROP TABLE IF EXISTS {name};")
+    cur.execute(f"ALTER TABLE {new} RENAME TO {name};")
+    cur.execute(f"ALTER TABLE {name} RENAME CONSTRAINT {new}_pkey TO {name}_pkey;")
+    cur.execute(f"ALTER INDEX {new}_geom_idx RENAME TO {name}_geom_idx;")
+    if hilbert:
+        cur.execute(f"ALTER INDEX {new}_hilbert_idx RENAME TO {name}_hilbert_idx;")
+    cur.execute(f"ANALYZE {name};")
+
+
+def _print_reduction(name, source, before, after, elapsed):
+    rows, points, size = after
+    print(f"✓ {name}: {rows}/{before[0]} features, {points:,}/{before[1]:,} vertices "
+          f"({points * 100 / max(before[1], 1):.1f}%), {size / 1024 / 1024:.1f}/"
+          f"{before[2] / 1024 / 1024:.1f} MB of {source} in {elapsed:.1f}s")
+
+
+def generalize_buildings(conn, levels=BUILDING_LEVELS):
+    """Rebuild one simplified copy of buildings per entry in levels"""
+    cur = conn.cursor()
+    ensure_building_columns(cur)
+    hilbert = is_hilbert_clustered(cur, 'buildings')
+    before = _geometry_stats(cur, 'buildings')
+    for name, zoom in levels.items():
+        start = time.time()
+        tolerance = pixel_size(zoom)
+        min_area = MIN_AREA_PIXELS * tolerance ** 2
+        # Simplify in EPSG:3857 so tolerance and area are in on-screen units; store as 4326 like buildings
+        _replace_table(cur, name, f"""
+            SELECT id, osm_id, name, type,
+                   ST_Multi(ST_Transform(ST_SimplifyPreserveTopology(g, {tolerance}), 4326)) AS geom
+            FROM (
+                SELECT id, osm_id, name, type, geom_3857 AS g
+                FROM buildings WHERE geom IS NOT NULL
+            ) b
+            WHERE ST_Area(g) >= {min_area}
+        """, hilbert)
+        conn.commit()
+        _print_reduction(name, 'buildings', before, _geometry_stats(cur, name), time.time() - start)
+    cur.close()
+
+
+def generalize_districts(conn, zoom=DISTRICT_ZOOM):
+    """Rebuild hanoi_districts_simplified; returns False when hanoi_districts does not exist"""
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass('hanoi_districts') IS NOT NULL;")
+    if not cur.fetchone()[0]:
+        print("hanoi_districts not found (run backend/import_hanoi.js first), skipping")
+        cur.close()
+        return False
+
+    start = time.time()
+    tolerance = pixel_size(zoom)
+    if _has_function(cur, 'st_coveragesimplify'):
+        # PostGIS >= 3.4: simplify shared edges once so the districts still tile the plane
+        simplified = f"ST_CoverageSimplify(ST_Transform(geom, 3857), {tolerance}) OVER ()"
+    else:
+        print("⚠ ST_CoverageSimplify needs PostGIS 3.4+, simplifying each district on its own")
+        simplified = f"ST_SimplifyPreserveTopology(ST_Transform(geom, 3857), {tolerance})"
+    before = _geometry_stats(cur, 'hanoi_districts')
+    _replace_table(cur, 'hanoi_districts_simplified', f"""
+        SELECT id, ten_xa, loai, dan_so, dtich_km2,
+               ST_Multi(ST_Transform(g, 4326)) AS geom
+        FROM (SELECT id, ten_xa, loai, dan_so, dtich_km2, {simplified} AS g FROM hanoi_districts) d
+        WHERE g IS NOT NULL
+    """)
+    conn.commit()
+    _print_reduction('hanoi_districts_simplified', 'hanoi_districts', before,
+                     _geometry_stats(cur, 'hanoi_districts_simplified'), time.time() - start)
+    cur.close()
+    return True
+
+
+def generalize(what='all'):
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        if what in ('buildings', 'all'):
+            generalize_buildings(conn)
+        if what in ('districts', 'all'):
+            generalize_districts(conn)
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"Error building generalized tables: {e}")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    what = sys.argv[1] if len(sys.argv) > 1 else 'all'
+    if what not in ('buildings', 'districts', 'all'):
+        print("Usage: python generalize.py [buildings|districts|all]")
+        sys.exit(1)
+    generalize(what)
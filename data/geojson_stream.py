@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Incremental GeoJSON feature reader
+Yields one feature at a time from a FeatureCollection's features[] array,
+or from newline-delimited GeoJSON (GeoJSONSeq), without loading the whole file.
+"""
+
+import json
+import os
+from itertools import islice
+
+READ_CHUNK_SIZE = 1024 * 1024  # 1 MB
+SEQ_EXTENSIONS = ('.geojsonl', '.geojsons', '.geojsonseq', '.jsonl', '.ndjson')
+RECORD_SEPARATOR = '\x1e'  # RFC 8142 prefix
+
+_decoder = json.JSONDecoder()
+
+
+class _Buffer:
+    """Sliding text window over a file, refilled on demand"""
+
+    def __init__(self, f, chunk_size=READ_CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Drop consumed text and append the next chunk; returns False at EOF"""
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.text = self.text[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it ('' at EOF)"""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Invalid GeoJSON: expected '{char}' at offset {self.pos}")
+        self.pos += 1
+
+    def decode(self):
+        """Decode the next JSON value, reading more input until it is complete"""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                # Probably truncated by the chunk boundary; retry with more text
+                if self.fill():
+                    continue
+                raise
+            # A number at the end of the window may continue in the next chunk
+            if end == len(self.text) and not self.eof and isinstance(value, (int, float)):
+                if self.fill():
+                    continue
+            self.pos = end
+            return value
+
+
+def _iter_feature_collection(f):
+    """Walk the top-level object, streaming features[] and skipping other members"""
+    buf = _Buffer(f)
+    buf.expect('{')
+    members = {}
+    found_features = False
+
+    if buf.peek() == '}':
+        buf.pos += 1
+    else:
+        while True:
+            key = buf.decode()
+            buf.expect(':')
+            if key == 'features':
+                found_features = True
+                buf.expect('[')
+                if buf.peek() == ']':
+                    buf.pos += 1
+                else:
+                    while True:
+                        yield buf.decode()
+                        sep = buf.peek()
+                        buf.pos += 1
+                        if sep == ']':
+                            break
+                        if sep != ',':
+                            raise ValueError("Invalid GeoJSON: malformed features array")
+            else:
+                members[key] = buf.decode()
+
+            sep = buf.peek()
+            buf.pos += 1
+            if sep == '}':
+                break
+            if sep != ',':
+                raise ValueError("Invalid GeoJSON: malformed top-level object")
+
+    if found_features:
+        return
+    if members.get('type') == 'Feature':
+        yield members
+    elif members.get('type') != 'FeatureCollection':
+        raise ValueError("Invalid GeoJSON format")
+
+
+def _iter_feature_seq(f):
+    """Yield features from GeoJSONSeq / newline-delimited GeoJSON"""
+    for line in f:
+        line = line.strip().lstrip(RECORD_SEPARATOR).strip()
+        if not line:
+            continue
+        feature = json.loads(line)
+        if feature.get('type') == 'FeatureCollection':
+            yield from feature.get('features', [])
+        else:
+            yield feature
+
+
+def is_geojson_seq(path):
+    """Guess whether path holds GeoJSONSeq rather than a single GeoJSON object"""
+    if path.lower().endswith(SEQ_EXTENSIONS):
+        return True
+    with open(path, 'r', encoding='utf-8') as f:
+        head = f.read(64 * 1024)
+    stripped = head.lstrip()
+    if stripped.startswith(RECORD_SEPARATOR):
+        return True
+    first_line, newline, _ = stripped.partition('\n')
+    if not newline:
+        return False
+    try:
+        return json.loads(first_line).get('type') == 'Feature'
+    except (ValueError, AttributeError):
+        return False
+
+
+def iter_features(path, seq=None):
+    """
+    Yield GeoJSON features from path one at a time.
+    seq=None autodetects GeoJSONSeq; raises ValueError on malformed input.
+    """
+    if seq is None:
+        seq = is_geojson_seq(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        if seq:
+            yield from _iter_feature_seq(f)
+        else:
+            yield from _iter_feature_collection(f)
+
+
+def split_byte_ranges(path, parts):
+    """Split a file into up to parts (start, end) byte ranges of roughly equal size"""
+    size = os.path.getsize(path)
+    step = max(1, -(-size // max(1, parts)))
+    return [(start, min(start + step, size)) for start in range(0, size, step)]
+
+
+def iter_features_in_range(path, start, end):
+    """
+    Yield GeoJSONSeq features whose line starts inside [start, end).
+    Ranges from split_byte_ranges can be read independently (e.g. by worker processes)
+    and together cover every line exactly once.
+    """
+    with open(path, 'rb') as f:
+        if start > 0:
+            # Skip the tail of a line that began in the previous range
+            f.seek(start - 1)
+            f.readline()
+        pos = f.tell()
+        while pos < end:
+            line = f.readline()
+            if not line:
+                break
+            pos += len(line)
+            text = line.decode('utf-8').strip().lstrip(RECORD_SEPARATOR).strip()
+            if text:
+                yield json.loads(text)
+
+
+def batched(iterable, size):
+    """Yield lists of up to size items"""
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) < 2:
+        print("Usage: python geojson_stream.py <file.geojson|file.geojsonl>")
+        sys.exit(1)
+
+    count = 0
+    for _ in iter_features(sys.argv[1]):
+        count += 1
+    size_mb = os.path.getsize(sys.argv[1]) / 1024 / 1024
+    print(f"{count} features in {sys.argv[1]} ({size_mb:.1f} MB)")
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+GeoParquet snapshots of buildings, charge_stations and crawler output
+Typed Arrow columns, WKB geometry (EPSG:4326 / OGC:CRS84) plus a GeoParquet 1.1
+bbox covering column. Rows are written in geohash order, so each row group
+covers a compact area and its bbox min/max statistics let readers skip row
+groups outside a query window. Reads are memory-mapped.
+
+Requires pyarrow.
+
+Usage:
+  python geoparquet.py export <buildings|charge_stations> <file.parquet>
+  python geoparquet.py import <buildings|charge_stations> <file.parquet> [--upsert]
+  python geoparquet.py info <file.parquet> [--bbox minlon,minlat,maxlon,maxlat]
+"""
+
+import asyncio
+import json
+import struct
+import sys
+import time
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+ROW_GROUP_SIZE = 50000
+COMPRESSION = 'zstd'
+GEOMETRY_COLUMN = 'geometry'
+BBOX_COLUMN = 'bbox'
+
+BBOX_TYPE = pa.struct([('xmin', pa.float64()), ('ymin', pa.float64()),
+                       ('xmax', pa.float64()), ('ymax', pa.float64())])
+
+# table -> typed attribute columns (geometry and bbox are appended)
+SNAPSHOT_COLUMNS = {
+    'buildings': [
+        ('id', pa.int64()),
+        ('osm_id', pa.string()),
+        ('name', pa.string()),
+        ('type', pa.string()),
+    ],
+    'charge_stations': [
+        ('id', pa.int64()),
+        ('external_id', pa.string()),
+        ('name', pa.string()),
+        ('address', pa.string()),
+        ('city', pa.string()),
+        ('category', pa.string()),
+        ('status', pa.string()),
+        ('lat', pa.float64()),
+        ('lon', pa.float64()),
+        ('last_updated', pa.timestamp('us')),
+    ],
+}
+GEOMETRY_TYPES = {
+    'buildings': ['Polygon', 'MultiPolygon'],
+    'charge_stations': ['Point'],
+}
+
+# charge_Station.py output (same fields as the CSV)
+CRAWLER_COLUMNS = [
+    ('name', pa.string()),
+    ('lat', pa.float64()),
+    ('lng', pa.float64()),
+    ('address', pa.string()),
+    ('type', pa.string()),
+    ('status', pa.string()),
+]
+
+
+def snapshot_schema(columns, geometry_types):
+    """Arrow schema with GeoParquet 'geo' metadata for columns + geometry + bbox"""
+    geo = {
+        'version': '1.1.0',
+        'primary_column': GEOMETRY_COLUMN,
+        'columns': {
+            GEOMETRY_COLUMN: {
+                'encoding': 'WKB',
+                'geometry_types': geometry_types,
+                'covering': {'bbox': {key: [BBOX_COLUMN, key] for key in ('xmin', 'ymin', 'xmax', 'ymax')}},
+            },
+        },
+    }
+    fields = [pa.field(name, type_) for name, type_ in columns]
+    fields += [pa.field(GEOMETRY_COLUMN, pa.binary()), pa.field(BBOX_COLUMN, BBOX_TYPE)]
+    return pa.schema(fields, metadata={b'geo': json.dumps(geo).encode('utf-8')})
+
+
+def point_wkb(lon, lat):
+    return struct.pack('<BIdd', 1, 1, lon, lat)
+
+
+class SnapshotWriter:
+    """Buffer row tuples (columns..., wkb, (xmin, ymin, xmax, ymax)) into fixed-size row groups"""
+
+    def __init__(self, path, columns, geometry_types, row_group_size=ROW_GROUP_SIZE):
+        self.schema = snapshot_schema(columns, geometry_types)
+        self.names = [name for name, _ in columns] + [GEOMETRY_COLUMN, BBOX_COLUMN]
+        self.row_group_size = row_group_size
+        self.writer = pq.ParquetWriter(path, self.schema, compression=COMPRESSION, write_statistics=True)
+        self.rows = []
+        self.count = 0
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        columns = list(zip(*self.rows))
+        arrays = {name: list(values) for name, values in zip(self.names, columns)}
+        arrays[BBOX_COLUMN] = [None if b is None else dict(zip(('xmin', 'ymin', 'xmax', 'ymax'), b))
+                               for b in arrays[BBOX_COLUMN]]
+        self.writer.write_table(pa.Table.from_pydict(arrays, schema=self.schema),
+                                row_group_size=self.row_group_size)
+        self.count += len(self.rows)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _existing_columns(cur, table):
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = %s;
+    """, (table,))
+    return {row[0] for row in cur.fetchall()}
+
+
+def export_snapshot(conn, table, path):
+    """Write table to a GeoParquet file in geohash order; returns the number of rows"""
+    start = time.time()
+    cur = conn.cursor()
+    present = _existing_columns(cur, table)
+    columns = [(name, type_) for name, type_ in SNAPSHOT_COLUMNS[table] if name in present]
+    cur.close()
+
+    # Named cursor: rows are streamed from the server one row group at a time
+    cur = conn.cursor(name=f"{table}_snapshot")
+    cur.itersize = ROW_GROUP_SIZE
+    cur.execute(f"""
+        SELECT {', '.join(f'"{name}"' for name, _ in columns)},
+               ST_AsBinary(g, 'NDR'), ST_XMin(g), ST_YMin(g), ST_XMax(g), ST_YMax(g)
+        FROM (SELECT *, ST_Transform(geom, 4326) AS g FROM {table} WHERE geom IS NOT NULL) t
+        ORDER BY ST_GeoHash(ST_Centroid(g), 12);
+    """)
+    n = len(columns)
+    with SnapshotWriter(path, columns, GEOMETRY_TYPES[table]) as writer:
+        for row in cur:
+            writer.write((*row[:n], bytes(row[n]), row[n + 1:n + 5]))
+    cur.close()
+    conn.commit()
+
+    elapsed = max(time.time() - start, 1e-9)
+    print(f"✓ {table}: {writer.count} rows -> {path} in {elapsed:.1f}s ({writer.count / elapsed:,.0f} rows/sec)")
+    return writer.count
+
+
+def bbox_filter(bbox):
+    """Arrow expression selecting rows whose bbox covering intersects (minlon, minlat, maxlon, maxlat)"""
+    min_x, min_y, max_x, max_y = bbox
+    return ((pc.field(BBOX_COLUMN, 'xmax') >= min_x) & (pc.field(BBOX_COLUMN, 'xmin') <= max_x)
+            & (pc.field(BBOX_COLUMN, 'ymax') >= min_y) & (pc.field(BBOX_COLUMN, 'ymin') <= max_y))
+
+
+def read_snapshot(path, columns=None, bbox=None):
+    """
+    Memory-mapped read of a snapshot as an Arrow table.
+    With bbox, row groups whose bbox statistics fall outside it are never read.
+    """
+    return pq.read_table(path, columns=columns, filters=bbox_filter(bbox) if bbox else None,
+                         memory_map=True)
+
+
+def matching_row_groups(path, bbox):
+    """(row groups overlapping bbox according to their statistics, total row groups)"""
+    fragment = next(iter(ds.dataset(path, format='parquet').get_fragments()))
+    return len(fragment.split_by_row_group(bbox_filter(bbox))), fragment.metadata.num_row_groups
+
+
+def iter_snapshot_rows(path, columns, batch_size=ROW_GROUP_SIZE):
+    """Yield dicts of columns, one row group batch at a time (memory-mapped)"""
+    parquet = pq.ParquetFile(path, memory_map=True)
+    for batch in parquet.iter_batches(batch_size=batch_size, columns=columns):
+        yield from batch.to_pylist()
+
+
+def import_snapshot(conn, table, path, upsert=False):
+    """Load a snapshot back into buildings (bulk swap or upsert) or charge_stations (sink)"""
+    from bulk_load import bulk_load_buildings, upsert_buildings, wkb_to_ewkb_hex
+
+    if table == 'buildings':
+        present = set(pq.read_schema(path).names)
+        def rows():
+            for r in iter_snapshot_rows(path, [c for c in ('osm_id', 'name', 'type', GEOMETRY_COLUMN)
+                                               if c in present]):
+                yield (r.get('osm_id'), r.get('name'), r.get('type'),
+                       wkb_to_ewkb_hex(r[GEOMETRY_COLUMN].hex(), 4326))
+        return upsert_buildings(conn, rows()) if upsert else bulk_load_buildings(conn, rows())
+
+    from station_sink import sink_stations
+
+    async def records():
+        for r in iter_snapshot_rows(path, None):
+            r.pop(GEOMETRY_COLUMN, None)
+            r.pop(BBOX_COLUMN, None)
+            yield r
+    return asyncio.run(sink_stations(conn, records()))
+
+
+def print_info(path, bbox=None):
+    parquet = pq.ParquetFile(path, memory_map=True)
+    meta = parquet.metadata
+    geo = json.loads((parquet.schema_arrow.metadata or {}).get(b'geo', b'{}'))
+    print(f"{path}: {meta.num_rows} rows in {meta.num_row_groups} row groups, "
+          f"GeoParquet {geo.get('version', '-')}")
+    print(parquet.schema_arrow.remove_metadata())
+    if bbox:
+        start = time.time()
+        matched, total = matching_row_groups(path, bbox)
+        rows = read_snapshot(path, columns=[GEOMETRY_COLUMN], bbox=bbox).num_rows
+        print(f"bbox {bbox}: {rows} rows, {matched}/{total} row groups read "
+              f"in {(time.time() - start) * 1000:.0f} ms")
+
+
+if __name__ == '__main__':
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    if len(args) >= 3 and args[0] in ('export', 'import') and args[1] in SNAPSHOT_COLUMNS:
+        import psycopg2
+        from import_osm_data import DB_CONFIG
+
+        conn = psycopg2.connect(**DB_CONFIG)
+        try:
+            if args[0] == 'export':
+                export_snapshot(conn, args[1], args[2])
+            else:
+                import_snapshot(conn, args[1], args[2], upsert='--upsert' in sys.argv)
+        finally:
+            conn.close()
+    elif len(args) >= 2 and args[0] == 'info':
+        bbox = None
+        if '--bbox' in sys.argv:
+            bbox = tuple(float(v) for v in sys.argv[sys.argv.index('--bbox') + 1].split(','))
+        print_info(args[1], bbox)
+    else:
+        print("Usage:")
+        print("  python geoparquet.py export <buildings|charge_stations> <file.parquet>")
+        print("  python geoparquet.py import <buildings|charge_stations> <file.parquet> [--upsert]")
+        print("  python geoparquet.py info <file.parquet> [--bbox minlon,minlat,maxlon,maxlat]")
+        sys.exit(1)
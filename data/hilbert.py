@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Hilbert-curve ordering of the spatial tables
+The importers write rows in file order (OSM id order from ogr2ogr, grid order
+from generate), so the rows of one viewport end up spread over the whole heap
+and a bbox query or tile read touches a page per row. With --hilbert the rows
+are sorted by the Hilbert index of their centroid before they are written, so
+neighbouring features share pages.
+
+The order is recorded as the table's clustering index (a btree on
+hilbert_key(geom), see ALTER TABLE ... CLUSTER ON): upserts keep appending new
+rows in Hilbert order, generalize.py sorts the derived tables the same way,
+and a plain CLUSTER (or this script) restores the order after many diffs.
+
+hilbert_key() here computes the same key as the SQL function, for rows that
+are sorted before they reach PostGIS.
+
+Usage:
+  python hilbert.py [table ...]   # default: buildings and its generalized copies
+"""
+
+import math
+import sys
+import time
+
+HILBERT_ORDER = 24  # 2^24 cells per axis: ~2.4 m wide at the equator in both lon/lat and EPSG:3857
+MERCATOR_EXTENT = 20037508.342789244
+
+# Geometry column of tables that do not call it geom (osm2pgsql)
+GEOMETRY_COLUMNS = {
+    'planet_osm_point': 'way',
+    'planet_osm_line': 'way',
+    'planet_osm_polygon': 'way',
+    'planet_osm_roads': 'way',
+}
+DEFAULT_TABLES = ['buildings', 'buildings_z10', 'buildings_z13']
+
+HILBERT_FUNCTION_DDL = f"""
+    CREATE OR REPLACE FUNCTION hilbert_key(geom geometry) RETURNS bigint AS $$
+    DECLARE
+        c geometry := ST_Centroid(geom);
+        -- EPSG:3857 metres, anything else is taken as lon/lat degrees
+        half_w double precision := CASE WHEN ST_SRID(geom) = 3857 THEN {MERCATOR_EXTENT} ELSE 180 END;
+        half_h double precision := CASE WHEN ST_SRID(geom) = 3857 THEN {MERCATOR_EXTENT} ELSE 90 END;
+        n bigint := 1::bigint << {HILBERT_ORDER};
+        x bigint;
+        y bigint;
+        rx bigint;
+        ry bigint;
+        t bigint;
+        s bigint;
+        d bigint := 0;
+    BEGIN
+        IF ST_IsEmpty(c) THEN
+            RETURN NULL;
+        END IF;
+        x := LEAST(n - 1, GREATEST(0, floor((ST_X(c) + half_w) / (2 * half_w) * n)))::bigint;
+        y := LEAST(n - 1, GREATEST(0, floor((ST_Y(c) + half_h) / (2 * half_h) * n)))::bigint;
+        s := n >> 1;
+        WHILE s > 0 LOOP
+            rx := CASE WHEN (x & s) <> 0 THEN 1 ELSE 0 END;
+            ry := CASE WHEN (y & s) <> 0 THEN 1 ELSE 0 END;
+            d := d + s * s * ((3 * rx) # ry);
+            IF ry = 0 THEN
+                IF rx = 1 THEN
+                    x := n - 1 - x;
+                    y := n - 1 - y;
+                END IF;
+                t := x;
+                x := y;
+                y := t;
+            END IF;
+            s := s >> 1;
+        END LOOP;
+        RETURN d;
+    END;
+    $$ LANGUAGE plpgsql IMMUTABLE STRICT PARALLEL SAFE;
+"""
+
+
+def hilbert_key(x, y, srid=4326, order=HILBERT_ORDER):
+    """Hilbert index of the cell holding (x, y); same curve as the SQL hilbert_key()"""
+    half_w, half_h = (MERCATOR_EXTENT, MERCATOR_EXTENT) if srid == 3857 else (180, 90)
+    n = 1 << order
+    x = min(n - 1, max(0, math.floor((x + half_w) / (2 * half_w) * n)))
+    y = min(n - 1, max(0, math.floor((y + half_h) / (2 * half_h) * n)))
+    d = 0
+    s = n >> 1
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        d += s * s * ((3 * rx) ^ ry)
+        if ry == 0:
+            if rx == 1:
+                x, y = n - 1 - x, n - 1 - y
+            x, y = y, x
+        s >>= 1
+    return d
+
+
+def hilbert_order_by(geom_column='geom'):
+    return f"ORDER BY hilbert_key({geom_column})"
+
+
+def record_order_sql(table, geom_column='geom'):
+    """
+    SQL creating table's hilbert_key btree and recording it as the clustering index.
+    Does not move any rows: use it when they were written in order (or with cluster_statements).
+    """
+    return f"""
+        {HILBERT_FUNCTION_DDL}
+        CREATE INDEX IF NOT EXISTS {table}_hilbert_idx ON {table} (hilbert_key({geom_column}));
+        ALTER TABLE {table} CLUSTER ON {table}_hilbert_idx;
+    """
+
+
+def cluster_statements(table, geom_column='geom'):
+    """Rewrite table in Hilbert order (ACCESS EXCLUSIVE while it runs), as (label, sql) pairs"""
+    return [
+        ('index', record_order_sql(table, geom_column)),
+        ('cluster', f"CLUSTER {table} USING {table}_hilbert_idx;"),
+        ('analyze', f"ANALYZE {table};"),
+    ]
+
+
+def is_hilbert_clustered(cur, table):
+    """True when table's recorded clustering index is its hilbert_key index"""
+    cur.execute("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE i.indrelid = to_regclass(%s) AND i.indisclustered AND c.relname = %s
+        );
+    """, (table, f"{table}_hilbert_idx"))
+    return cur.fetchone()[0]
+
+
+def cluster_table(conn, table):
+    """CLUSTER table in Hilbert order; returns False when it does not exist"""
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (table,))
+    if not cur.fetchone()[0]:
+        print(f"{table} not found, skipping")
+        cur.close()
+        return False
+    start = time.time()
+    for _, sql in cluster_statements(table, GEOMETRY_COLUMNS.get(table, 'geom')):
+        cur.execute(sql)
+    conn.commit()
+    cur.execute("SELECT pg_relation_size(%s);", (table,))
+    size = cur.fetchone()[0]
+    cur.close()
+    print(f"✓ {table}: clustered in Hilbert order ({size / 1024 / 1024:.1f} MB) in {time.time() - start:.1f}s")
+    return True
+
+
+if __name__ == '__main__':
+    import psycopg2
+
+    from import_osm_data import DB_CONFIG
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        for table in sys.argv[1:] or DEFAULT_TABLES:
+            cluster_table(conn, table)
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"Error clustering {table}: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
@@ -9,6 +9,8 @@ import sys
 import time
 import random
 
+from instrumentation import import_run, pop_run_options, stage
+
 # Database connection
 DB_CONFIG = {
     'host': 'localhost',
@@ -23,11 +25,22 @@ OVERPASS_TIMEOUT = 180
 OVERPASS_MAX_RETRIES = 3
 OVERPASS_RETRY_BASE_WAIT = 10  # seconds
 
+GEOJSON_BATCH_SIZE = 5000  # features per INSERT batch
+GENERATE_SEED = 2026  # deterministic grid for generate --upsert
+GENERATE_CENTER = (51.505, -0.12)  # (lat, lon) of the generated grid, also used by benchmark.py
+BUILDING_TYPES = ['residential', 'commercial', 'civic', 'industrial', 'office']
+
+# osmium node location index; use e.g. 'dense_file_array,nodes.cache' for country-size extracts
+PBF_NODE_CACHE = 'flex_mem'
+
 
-def import_from_overpass():
+def import_from_overpass(upsert=False, hilbert=False, region=None):
     """
     Import data from OSM Overpass API
     Example: Get all buildings in London area
+    With upsert=True only new/changed/vanished buildings are written.
+    With hilbert=True buildings are stored in Hilbert order (see hilbert.py).
+    With region='london' only the london partition of buildings is replaced (see regions.py).
     """
     try:
         import overpy
@@ -58,7 +71,9 @@ def import_from_overpass():
         attempt += 1
         try:
             print(f"Fetching data from Overpass API (attempt {attempt}/{OVERPASS_MAX_RETRIES})...")
-            result = api.query(query)
+            with stage('overpass_query') as st:
+                result = api.query(query)
+                st.add(rows_out=len(result.ways))
             break
         except overpy.exception.OverpassGatewayTimeout:
             wait = OVERPASS_RETRY_BASE_WAIT * attempt + random.uniform(0, 2)
@@ -76,44 +91,130 @@ def import_from_overpass():
         print("Exceeded maximum retries. Aborting import.")
         return
     
+    from regions import record_region, region_target
+    from validate_geometry import print_validation_summary, record_rejects, validate_table
+    
     conn = psycopg2.connect(**DB_CONFIG)
+    rejects = []
+    
+    if upsert:
+        from bulk_load import upsert_buildings
+        
+        upsert_buildings(conn, _overpass_rows(result, rejects), hilbert=hilbert, region=region)
+        cur = conn.cursor()
+        record_rejects(cur, rejects)
+        conn.commit()
+        cur.close()
+        conn.close()
+        print_validation_summary({}, len(rejects))
+        return
+    
     cur = conn.cursor()
+    table = region_target(cur, 'buildings', region)
     
     # Clear existing buildings
-    cur.execute("DELETE FROM buildings;")
+    cur.execute(f"DELETE FROM {table};")
     
     building_count = 0
-    for way in result.ways:
-        if 'building' in way.tags:
-            # Convert OSM way to PostGIS polygon
-            coords = [(node.lon, node.lat) for node in way.nodes]
-            if len(coords) >= 3:
-                # Close the polygon
-                if coords[0] != coords[-1]:
-                    coords.append(coords[0])
-                
-                wkt = f"POLYGON(({', '.join([f'{lon} {lat}' for lon, lat in coords])}))"
-                
-                cur.execute("""
-                    INSERT INTO buildings (name, type, geom)
-                    VALUES (%s, %s, ST_GeomFromText(%s, 4326))
-                """, (way.tags.get('name', 'Unnamed Building'), 
-                      way.tags.get('building', 'unknown'),
-                      wkt))
-                building_count += 1
+    with stage('insert', hot=True) as st:
+        for _, name, building_type, geom_hex in _overpass_rows(result, rejects):
+            cur.execute(f"""
+                INSERT INTO {table} (name, type, geom)
+                VALUES (%s, %s, %s::geometry)
+            """, (name, building_type, geom_hex))
+            building_count += 1
+        st.add(rows_in=building_count + len(rejects), rows_out=building_count)
     
+    record_rejects(cur, rejects)
+    with stage('validate') as st:
+        validation = validate_table(cur, table)
+        st.add(rows_in=building_count, rows_out=building_count - validation['rejected'])
+    if hilbert:
+        _cluster_buildings(cur, table)
+    if region:
+        record_region(cur, 'buildings', region)
     conn.commit()
     cur.close()
     conn.close()
     
+    print_validation_summary(validation, len(rejects))
+    print(f"Imported {building_count - validation['rejected']} buildings from OSM")
+
+def import_from_overpass_tiled(bbox, upsert=False, concurrency=None, cache_dir=None, hilbert=False, region=None):
+    """
+    Import buildings for an arbitrary bbox (south, west, north, east) from Overpass
+    The bbox is fetched as a quadtree of cached, concurrent sub-queries
+    (see overpass_tiles.py) and streamed into PostGIS with COPY.
+    """
+    from bulk_load import bulk_load_buildings, geojson_rows, upsert_buildings
+    from overpass_tiles import CACHE_DIR, CONCURRENCY, OverpassError, fetch_buildings
+    from validate_geometry import record_rejects
+    
+    # Cells are fetched while the rows are COPYed, so fetch time shows up in the copy stage
+    stats = {}
+    features = fetch_buildings(bbox, concurrency or CONCURRENCY, stats=stats, cache_dir=cache_dir or CACHE_DIR)
+    rejects = []
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        with stage('overpass_load') as st:
+            if upsert:
+                counts = upsert_buildings(conn, geojson_rows(features, rejects), hilbert=hilbert, region=region)
+                building_count = counts['inserted'] + counts['updated'] + counts['unchanged']
+            else:
+                building_count = bulk_load_buildings(conn, geojson_rows(features, rejects), hilbert=hilbert,
+                                                     region=region)
+            st.add(rows_in=stats.get('buildings', 0), rows_out=building_count)
+            st.extra['overpass'] = stats
+        if rejects:
+            cur = conn.cursor()
+            record_rejects(cur, rejects)
+            conn.commit()
+            cur.close()
+            print(f"Rejected {len(rejects)} buildings with unusable rings (see geometry_quarantine)")
+    except OverpassError as exc:
+        # Nothing was committed; cells fetched so far are cached for the next run
+        conn.rollback()
+        print(f"Error fetching from Overpass: {exc}")
+        return
+    finally:
+        conn.close()
+    
     print(f"Imported {building_count} buildings from OSM")
 
-def generate_more_sample_data():
+def _overpass_rows(result, rejects=None):
+    """
+    Yield (osm_id, name, type, ewkb_hex) rows for building ways in an overpy result
+    Ways whose ring cannot be encoded are appended to rejects (see record_rejects).
+    """
+    from bulk_load import encode_geometry
+    from validate_geometry import reject_row
+    
+    for way in result.ways:
+        if 'building' not in way.tags:
+            continue
+        osm_id = f"w{way.id}"
+        name = way.tags.get('name', 'Unnamed Building')
+        building_type = way.tags.get('building', 'unknown')
+        geom = {'type': 'Polygon', 'coordinates': [[(float(node.lon), float(node.lat)) for node in way.nodes]]}
+        geom_hex, problem = encode_geometry(geom)
+        if geom_hex is None:
+            if rejects is not None:
+                rejects.append(reject_row(osm_id, name, building_type, problem, geom))
+            continue
+        yield (osm_id, name, building_type, geom_hex)
+
+def generate_more_sample_data(upsert=False, hilbert=False, region=None):
     """
     Generate more sample data by duplicating and offsetting existing buildings
     This creates realistic-looking data without needing Overpass API
+    With upsert=True the grid is diffed into buildings (keys 'g1'..'g400')
+    instead of deleting and reinserting every row.
+    With hilbert=True the grid is written in Hilbert order instead of row by row.
+    With region='london' the grid replaces the london partition only (see regions.py).
     """
     import random
+    from hilbert import hilbert_key
+    from regions import record_region, region_target
     
     conn = psycopg2.connect(**DB_CONFIG)
     cur = conn.cursor()
@@ -128,16 +229,22 @@ def generate_more_sample_data():
     
     print(f"Found {len(existing)} existing buildings. Generating more...")
     
-    # Clear existing buildings first
-    cur.execute("DELETE FROM buildings;")
+    if upsert:
+        # Fixed seed so re-runs produce the same grid and the diff stays empty
+        from bulk_load import ewkb_hex
+        
+        rng = random.Random(GENERATE_SEED)
+    else:
+        rng = random
+        table = region_target(cur, 'buildings', region)
+        # Clear existing buildings first
+        cur.execute(f"DELETE FROM {table};")
     
-    building_count = 0
+    # (hilbert key of the centre, row); the random draws stay in grid order so the seeded grid does not change
+    rows = []
     
     # Generate buildings in a grid pattern around London
-    base_lat = 51.505
-    base_lon = -0.12
-    
-    building_types = ['residential', 'commercial', 'civic', 'industrial', 'office']
+    base_lat, base_lon = GENERATE_CENTER
     
     for i in range(20):  # 20 rows
         for j in range(20):  # 20 columns
@@ -149,124 +256,334 @@ def generate_more_sample_data():
             center_lon = base_lon + lon_offset
             
             # Random building size
-            size_lat = random.uniform(0.0003, 0.0008)
-            size_lon = random.uniform(0.0004, 0.001)
-            
-            # Create rectangle polygon
-            wkt = f"POLYGON(({center_lon} {center_lat}, {center_lon + size_lon} {center_lat}, {center_lon + size_lon} {center_lat + size_lat}, {center_lon} {center_lat + size_lat}, {center_lon} {center_lat}))"
+            size_lat = rng.uniform(0.0003, 0.0008)
+            size_lon = rng.uniform(0.0004, 0.001)
             
-            building_type = random.choice(building_types)
+            building_type = rng.choice(BUILDING_TYPES)
             name = f"Building {i*20 + j + 1}"
             
-            cur.execute("""
-                INSERT INTO buildings (name, type, geom)
+            key = hilbert_key(center_lon + size_lon / 2, center_lat + size_lat / 2)
+            if upsert:
+                ring = [(center_lon, center_lat), (center_lon + size_lon, center_lat),
+                        (center_lon + size_lon, center_lat + size_lat), (center_lon, center_lat + size_lat),
+                        (center_lon, center_lat)]
+                rows.append((key, (f"g{i*20 + j + 1}", name, building_type,
+                                   ewkb_hex({'type': 'Polygon', 'coordinates': [ring]}))))
+            else:
+                # Create rectangle polygon
+                wkt = f"POLYGON(({center_lon} {center_lat}, {center_lon + size_lon} {center_lat}, {center_lon + size_lon} {center_lat + size_lat}, {center_lon} {center_lat + size_lat}, {center_lon} {center_lat}))"
+                rows.append((key, (name, building_type, wkt)))
+    
+    if hilbert:
+        rows.sort(key=lambda keyed: keyed[0])
+    rows = [row for _, row in rows]
+    building_count = len(rows)
+    
+    if not upsert:
+        for row in rows:
+            cur.execute(f"""
+                INSERT INTO {table} (name, type, geom)
                 VALUES (%s, %s, ST_GeomFromText(%s, 4326))
-            """, (name, building_type, wkt))
+            """, row)
+        if hilbert:
+            from hilbert import record_order_sql
             
-            building_count += 1
+            cur.execute(record_order_sql(table))
+        if region:
+            record_region(cur, 'buildings', region)
     
-    conn.commit()
     cur.close()
+    if upsert:
+        from bulk_load import upsert_buildings
+        
+        upsert_buildings(conn, rows, hilbert=hilbert, region=region)
+    else:
+        conn.commit()
     conn.close()
     
     print(f"Generated {building_count} buildings in grid pattern around London")
 
-def import_from_geojson(geojson_file):
+def import_from_geojson(geojson_file, bulk=False, workers=1, upsert=False, hilbert=False, region=None):
     """
-    Import buildings from a GeoJSON file
+    Import buildings from a GeoJSON file (FeatureCollection, Feature or GeoJSONSeq)
+    Features are streamed one at a time and loaded in fixed-size batches,
+    so memory stays flat regardless of the file size.
+    With bulk=True, features are streamed with COPY into a staging table
+    which then replaces buildings (Polygon and MultiPolygon, holes kept).
+    workers > 1 implies bulk and spreads parsing/encoding/COPY over a process pool.
+    With upsert=True the file is diffed into buildings by OSM id + content hash.
+    With hilbert=True buildings are stored in Hilbert order (see hilbert.py).
+    With region='london' only the london partition of buildings is loaded (see regions.py).
     """
-    import json
+    import os
+    from psycopg2.extras import execute_values
+    from geojson_stream import iter_features, batched
+    from bulk_load import geojson_rows
+    from regions import record_region, region_target
+    from validate_geometry import print_validation_summary, record_rejects, validate_table
     
-    try:
-        with open(geojson_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-    except FileNotFoundError:
+    if not os.path.exists(geojson_file):
         print(f"Error: File {geojson_file} not found")
         return
-    except json.JSONDecodeError:
-        print(f"Error: Invalid JSON in {geojson_file}")
+    
+    if workers > 1:
+        from parallel_load import parallel_load_geojson
+        
+        try:
+            with stage('geojson_load') as st:
+                building_count = parallel_load_geojson(geojson_file, DB_CONFIG, workers, upsert=upsert,
+                                                       hilbert=hilbert, region=region)
+                st.add(rows_out=building_count, bytes_read=os.path.getsize(geojson_file))
+        except ValueError as exc:
+            print(f"Error: Invalid GeoJSON in {geojson_file}: {exc}")
+            return
+        print(f"Imported {building_count} buildings from {geojson_file}")
         return
     
+    features = iter_features(geojson_file)
     conn = psycopg2.connect(**DB_CONFIG)
-    cur = conn.cursor()
+    # Features whose rings cannot be encoded; invalid-but-parseable ones are fixed in SQL
+    rejects = []
     
-    # Clear existing buildings
-    cur.execute("DELETE FROM buildings;")
-    
-    building_count = 0
-    
-    if data.get('type') == 'FeatureCollection':
-        features = data.get('features', [])
-    elif data.get('type') == 'Feature':
-        features = [data]
-    else:
-        print("Error: Invalid GeoJSON format")
-        return
-    
-    for feature in features:
-        if feature.get('geometry', {}).get('type') == 'Polygon':
-            geom = feature.get('geometry')
-            props = feature.get('properties', {})
+    try:
+        with stage('geojson_load') as st:
+            if upsert:
+                from bulk_load import upsert_buildings
             
-            # Convert GeoJSON coordinates to WKT
-            coords = geom['coordinates'][0]  # Outer ring
-            wkt_coords = ', '.join([f"{lon} {lat}" for lon, lat in coords])
-            wkt = f"POLYGON(({wkt_coords}))"
+                counts = upsert_buildings(conn, geojson_rows(features, rejects), hilbert=hilbert, region=region)
+                building_count = counts['inserted'] + counts['updated'] + counts['unchanged']
+            elif bulk:
+                from bulk_load import bulk_load_buildings
             
-            name = props.get('name', props.get('NAME', 'Unnamed Building'))
-            building_type = props.get('building', props.get('type', 'unknown'))
+                building_count = bulk_load_buildings(conn, geojson_rows(features, rejects), hilbert=hilbert,
+                                                     region=region)
+            else:
+                cur = conn.cursor()
+                table = region_target(cur, 'buildings', region)
             
-            cur.execute("""
-                INSERT INTO buildings (name, type, geom)
-                VALUES (%s, %s, ST_GeomFromText(%s, 4326))
-            """, (name, building_type, wkt))
+                # Clear existing buildings
+                cur.execute(f"DELETE FROM {table};")
             
-            building_count += 1
+                building_count = 0
+            
+                # EWKB keeps holes and MultiPolygon parts
+                with stage('insert', hot=True) as insert_stage:
+                    for batch in batched(geojson_rows(features, rejects), GEOJSON_BATCH_SIZE):
+                        rows = [(name, building_type, geom_hex) for _, name, building_type, geom_hex in batch]
+                        execute_values(cur, f"""
+                            INSERT INTO {table} (name, type, geom) VALUES %s
+                        """, rows, template="(%s, %s, %s::geometry)", page_size=len(rows))
+                        building_count += len(rows)
+                    insert_stage.add(rows_in=building_count + len(rejects), rows_out=building_count)
+            
+                with stage('validate') as validate_stage:
+                    validation = validate_table(cur, table)
+                    validate_stage.add(rows_in=building_count, rows_out=building_count - validation['rejected'])
+                building_count -= validation['rejected']
+                if hilbert:
+                    _cluster_buildings(cur, table)
+                if region:
+                    record_region(cur, 'buildings', region)
+                conn.commit()
+                cur.close()
+                print_validation_summary(validation)
+            
+            st.add(rows_out=building_count, bytes_read=os.path.getsize(geojson_file))
+        
+        if rejects:
+            cur = conn.cursor()
+            record_rejects(cur, rejects)
+            conn.commit()
+            cur.close()
+            print(f"Rejected {len(rejects)} features with unusable rings (see geometry_quarantine)")
+    except ValueError as exc:
+        # json.JSONDecodeError is a ValueError too
+        conn.rollback()
+        conn.close()
+        print(f"Error: Invalid GeoJSON in {geojson_file}: {exc}")
+        return
     
-    conn.commit()
-    cur.close()
     conn.close()
     
     print(f"Imported {building_count} buildings from {geojson_file}")
 
-def import_from_pbf(pbf_file):
+def _pbf_building_rows(pbf_file, node_cache='flex_mem', stats=None):
+    """
+    Yield (osm_id, name, type, ewkb_hex) rows for building areas in an OSM PBF file.
+    Closed ways and multipolygon relations are assembled by osmium's area
+    handler, using a node-location index (node_cache) to resolve coordinates.
+    """
+    import osmium
+    from bulk_load import wkb_to_ewkb_hex
+    
+    wkb_factory = osmium.geom.WKBFactory()
+    processor = (osmium.FileProcessor(pbf_file)
+                 .with_locations(node_cache)
+                 .with_areas(osmium.filter.KeyFilter('building')))
+    
+    for obj in processor:
+        if not obj.is_area() or 'building' not in obj.tags:
+            continue
+        try:
+            wkb = wkb_factory.create_multipolygon(obj)
+        except RuntimeError:
+            # Broken rings / missing nodes: osmium could not build the geometry
+            if stats is not None:
+                stats['skipped'] = stats.get('skipped', 0) + 1
+            continue
+        
+        tags = obj.tags
+        osm_id = f"{'w' if obj.from_way() else 'r'}{obj.orig_id()}"
+        name = tags.get('name', tags.get('addr:housename', 'Unnamed Building'))
+        yield (osm_id, name, tags.get('building', 'unknown'), wkb_to_ewkb_hex(wkb))
+
+def import_from_pbf(pbf_file, node_cache=PBF_NODE_CACHE, upsert=False, hilbert=False, region=None):
     """
-    Import from OSM PBF file using osmium
-    Requires: osmium-tool installed
+    Import buildings from an OSM PBF file in-process with pyosmium
+    Polygons and multipolygons are built in memory and streamed into
+    PostGIS with COPY, so no Docker, ogr2ogr or GeoJSON temp file is needed.
+    With upsert=True only the diff against the current buildings is written.
+    With hilbert=True buildings are stored in Hilbert order (see hilbert.py).
+    With region='london' only the london partition of buildings is replaced (see regions.py).
+    Requires: pip install "osmium>=3.7"
     """
-    import subprocess
-    import json
+    import os
+    
+    try:
+        import osmium
+        osmium.FileProcessor
+    except (ImportError, AttributeError):
+        print("Error: Install pyosmium first: pip install \"osmium>=3.7\"")
+        return
     
-    print(f"Processing PBF file: {pbf_file}")
-    print("Note: This requires osmium-tool and osmconvert")
-    print("Install: sudo apt-get install osmium-tool osmctools")
+    if not os.path.exists(pbf_file):
+        print(f"Error: File {pbf_file} not found")
+        return
+    
+    from bulk_load import bulk_load_buildings, upsert_buildings
+    
+    size_mb = os.path.getsize(pbf_file) / 1024 / 1024
+    print(f"Processing PBF file: {pbf_file} ({size_mb:.1f} MB)")
+    print(f"Node location index: {node_cache}")
+    
+    stats = {}
+    conn = psycopg2.connect(**DB_CONFIG)
+    rows = _pbf_building_rows(pbf_file, node_cache, stats)
+    with stage('pbf_load') as st:
+        if upsert:
+            counts = upsert_buildings(conn, rows, hilbert=hilbert, region=region)
+            building_count = counts['inserted'] + counts['updated'] + counts['unchanged']
+        else:
+            building_count = bulk_load_buildings(conn, rows, hilbert=hilbert, region=region)
+        st.add(rows_out=building_count, bytes_read=os.path.getsize(pbf_file))
+        st.extra['skipped'] = stats.get('skipped', 0)
+    conn.close()
     
-    # Example command to extract buildings
-    # osmium tags-filter input.pbf building -o buildings.osm.pbf
-    # Then convert to GeoJSON and import
+    if stats.get('skipped'):
+        print(f"Skipped {stats['skipped']} buildings with invalid geometry")
+    print(f"Imported {building_count} buildings from {pbf_file}")
+    return building_count
+
+def _cluster_buildings(cur, table='buildings'):
+    """Rewrite buildings (or one region's partition) in Hilbert order inside the caller's transaction (no commit)"""
+    from hilbert import cluster_statements
+    
+    with stage('hilbert_sort'):
+        for _, sql in cluster_statements(table):
+            cur.execute(sql)
+
+def _get_option(name, default=None):
+    """Return the value following --name on the command line"""
+    if name in sys.argv:
+        index = sys.argv.index(name)
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+    return default
+
+def print_usage():
+    print("Usage:")
+    print("  python import_osm_data.py overpass           # Import from Overpass API (may timeout)")
+    print("  python import_osm_data.py overpass --bbox S,W,N,E  # Any area, as cached parallel sub-queries")
+    print("  python import_osm_data.py generate           # Generate more sample data (recommended)")
+    print("  python import_osm_data.py geojson <file.json> # Import from GeoJSON / GeoJSONSeq file")
+    print("  python import_osm_data.py pbf <file.pbf>      # Import from PBF file (pyosmium, no Docker)")
+    print("Options:")
+    print("  --bulk    (geojson) Load with COPY into a staging table, then swap it in")
+    print("  --concurrency N  (overpass --bbox) Parallel Overpass requests, default 2")
+    print("  --cache-dir <dir>  (overpass --bbox) Response cache, default .overpass_cache")
+    print("  --node-cache <index>  (pbf) osmium location index, default flex_mem")
+    print("  --workers N  (geojson) Parse and load with N processes (GeoJSONSeq splits best)")
+    print("  --upsert  Only insert/update/delete the diff, keyed on OSM id + content hash")
+    print("  --hilbert  Store buildings in Hilbert order of their centroid (see hilbert.py)")
+    print("  --region NAME  Load into the NAME partition of buildings only, other regions untouched (see regions.py)")
+    print("  --dirty-tiles <file>  (with --upsert) Write the z/x/y tiles the import changed to file")
+    print("  --generalize  Rebuild the simplified buildings_z10 / buildings_z13 tables afterwards")
+    print("  --report <file>  Write a JSON report of the per-stage timings / rows / memory")
+    print("  --metrics <file>  Write the same as Prometheus textfile metrics")
+    print("  --profile cprofile|tracemalloc  Profile the Python hot loop (top functions / allocations in the report)")
+
+def write_dirty_tiles(path):
+    """Export the tiles marked dirty by upsert imports to path (z/x/y per line)"""
+    from dirty_tiles import export_dirty_tiles
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        with stage('dirty_tiles'):
+            export_dirty_tiles(conn, path)
+    finally:
+        conn.close()
 
 if __name__ == '__main__':
+    run_options = pop_run_options(sys.argv)
+    upsert = '--upsert' in sys.argv
+    hilbert = '--hilbert' in sys.argv
+    region = _get_option('--region')
+    if region:
+        from regions import RegionError, check_region
+        
+        try:
+            check_region(region)
+        except RegionError as exc:
+            print(f"Error: {exc}")
+            sys.exit(1)
+    dirty_file = _get_option('--dirty-tiles')
+    if dirty_file and not upsert:
+        # Only upsert imports mark dirty_tiles; a full reload invalidates every tile
+        print("Error: --dirty-tiles needs --upsert (a full reload invalidates every tile)")
+        sys.exit(1)
     if len(sys.argv) > 1:
-        if sys.argv[1] == 'overpass':
-            import_from_overpass()
-        elif sys.argv[1] == 'generate':
-            generate_more_sample_data()
-        elif sys.argv[1] == 'geojson' and len(sys.argv) > 2:
-            import_from_geojson(sys.argv[2])
-        elif sys.argv[1] == 'pbf' and len(sys.argv) > 2:
-            import_from_pbf(sys.argv[2])
-        else:
-            print("Usage:")
-            print("  python import_osm_data.py overpass           # Import from Overpass API (may timeout)")
-            print("  python import_osm_data.py generate           # Generate more sample data (recommended)")
-            print("  python import_osm_data.py geojson <file.json> # Import from GeoJSON file")
-            print("  python import_osm_data.py pbf <file.pbf>      # Import from PBF file")
-    else:
-        print("Usage:")
-        print("  python import_osm_data.py overpass           # Import from Overpass API (may timeout)")
-        print("  python import_osm_data.py generate           # Generate more sample data (recommended)")
-        print("  python import_osm_data.py geojson <file.json> # Import from GeoJSON file")
-        print("  python import_osm_data.py pbf <file.pbf>      # Import from PBF file")
+        with import_run(f"import_osm_data {sys.argv[1]}", **run_options):
+            if sys.argv[1] == 'overpass' and _get_option('--bbox'):
+                from overpass_tiles import parse_bbox
+            
+                try:
+                    bbox = parse_bbox(_get_option('--bbox'))
+                except ValueError as exc:
+                    print(f"Error: {exc}")
+                    sys.exit(1)
+                import_from_overpass_tiled(bbox, upsert=upsert,
+                                           concurrency=int(_get_option('--concurrency', 0)) or None,
+                                           cache_dir=_get_option('--cache-dir'), hilbert=hilbert, region=region)
+            elif sys.argv[1] == 'overpass':
+                import_from_overpass(upsert=upsert, hilbert=hilbert, region=region)
+            elif sys.argv[1] == 'generate':
+                generate_more_sample_data(upsert=upsert, hilbert=hilbert, region=region)
+            elif sys.argv[1] == 'geojson' and len(sys.argv) > 2:
+                import_from_geojson(sys.argv[2], bulk='--bulk' in sys.argv,
+                                    workers=int(_get_option('--workers', 1)),
+                                    upsert=upsert, hilbert=hilbert, region=region)
+            elif sys.argv[1] == 'pbf' and len(sys.argv) > 2:
+                import_from_pbf(sys.argv[2], _get_option('--node-cache', PBF_NODE_CACHE),
+                                upsert=upsert, hilbert=hilbert, region=region)
+            else:
+                print_usage()
 
+            if dirty_file:
+                write_dirty_tiles(dirty_file)
 
-                                                                                                                                                                                                                                                                                                                                                                                                                                                                                   
\ No newline at end of file
+            if '--generalize' in sys.argv:
+                from generalize import generalize
+                with stage('generalize'):
+                    generalize('buildings')
+    else:
+        print_usage()
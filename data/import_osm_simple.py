@@ -6,9 +6,13 @@ Works on Windows without needing Bash/WSL
 
 import subprocess
 import os
+import re
 import sys
-import urllib.request
-import urllib.error
+
+from instrumentation import import_run, pop_run_options, stage
+
+SEED_MIN_ZOOM = 12
+SEED_MAX_ZOOM = 16
 
 def run_docker_command(cmd, description):
     """Run a docker command and show progress"""
@@ -21,81 +25,35 @@ def run_docker_command(cmd, description):
     print("✓ Done")
     return True
 
-def download_pbf(url, output_file):
-    """Download PBF file with progress and redirect handling"""
-    if os.path.exists(output_file):
-        file_size = os.path.getsize(output_file) / 1024 / 1024
-        if file_size > 10:  # File > 10MB, probably valid
-            response = input(f"{output_file} already exists ({file_size:.1f} MB). Use it? (y/n): ")
-            if response.lower() == 'y':
-                return True
-        os.remove(output_file)
+def download_pbf(url, output_file, connections=4):
+    """Download PBF file (resumable, parallel ranges, MD5-verified, skipped if unchanged)"""
+    from downloader import download, DownloadError
     
     print(f"\nDownloading {output_file}...")
     print("This may take a while (100-200 MB)...")
-    print("URL: " + url)
     
     try:
-        # Create request with proper headers
-        req = urllib.request.Request(url)
-        req.add_header('User-Agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)')
-        
-        # Open URL and handle redirects
-        with urllib.request.urlopen(req) as response:
-            # Get file size from headers
-            total_size = int(response.headers.get('Content-Length', 0))
-            total_mb = total_size / 1024 / 1024 if total_size > 0 else 0
-            
-            if total_size == 0:
-                # Try to get size from Content-Disposition or estimate
-                print("⚠ Could not determine file size from headers")
-            
-            print(f"File size: {total_mb:.1f} MB" if total_mb > 0 else "Downloading...")
-            
-            downloaded = 0
-            last_percent = -1
-            
-            with open(output_file, 'wb') as f:
-                while True:
-                    chunk = response.read(8192)  # 8KB chunks
-                    if not chunk:
-                        break
-                    f.write(chunk)
-                    downloaded += len(chunk)
-                    
-                    if total_size > 0:
-                        percent = min(int(downloaded * 100 / total_size), 100)
-                        if percent != last_percent:
-                            mb = downloaded / 1024 / 1024
-                            print(f"\rProgress: {percent}% ({mb:.1f} / {total_mb:.1f} MB)", end='', flush=True)
-                            last_percent = percent
-                    else:
-                        mb = downloaded / 1024 / 1024
-                        print(f"\rDownloaded: {mb:.1f} MB", end='', flush=True)
-        
-        file_size = os.path.getsize(output_file) / 1024 / 1024
-        print(f"\n✓ Download complete: {file_size:.1f} MB")
-        
-        if file_size < 10:
-            print("⚠ Warning: File seems too small. Download may have failed.")
-            if os.path.exists(output_file):
-                os.remove(output_file)
-            return False
-        
-        return True
-    except urllib.error.HTTPError as e:
-        print(f"\n✗ HTTP Error: {e.code} - {e.reason}")
-        if os.path.exists(output_file):
-            os.remove(output_file)
-        return False
-    except Exception as e:
+        with stage('download') as st:
+            download(url, output_file, connections)
+            st.add(bytes_read=os.path.getsize(output_file))
+    except (DownloadError, OSError) as e:
         print(f"\n✗ Download failed: {e}")
-        if os.path.exists(output_file):
-            os.remove(output_file)
+        print("Partial data was kept; run again to resume.")
         return False
+    
+    file_size = os.path.getsize(output_file) / 1024 / 1024
+    if file_size < 10:
+        print("⚠ Warning: File seems too small. Download may have failed.")
+        return False
+    
+    return True
 
-def import_osm_buildings(pbf_file):
-    """Import buildings from OSM PBF file"""
+def import_osm_buildings(pbf_file, upsert=False, hilbert=False, region=None):
+    """
+    Import buildings from OSM PBF file (upsert=True applies only the diff)
+    hilbert=True stores them in Hilbert order of their centroid (see hilbert.py)
+    region='london' builds the london partition of buildings offline and attaches it (see regions.py)
+    """
     
     if not os.path.exists(pbf_file):
         print(f"Error: File not found: {pbf_file}")
@@ -113,7 +71,9 @@ def import_osm_buildings(pbf_file):
     if pbf_file_abs != pbf_path_abs:
         import shutil
         print(f"Copying {pbf_file} to {pbf_path}...")
-        shutil.copy2(pbf_file_abs, pbf_path_abs)
+        with stage('copy_pbf') as st:
+            shutil.copy2(pbf_file_abs, pbf_path_abs)
+            st.add(bytes_read=os.path.getsize(pbf_path_abs))
         pbf_file = pbf_path_abs
     else:
         pbf_file = pbf_file_abs
@@ -153,38 +113,29 @@ def import_osm_buildings(pbf_file):
         'osgeo/gdal:latest'
     ]
     
-    print("Finding available GDAL Docker image...")
-    for img in gdal_images:
-        print(f"  Trying: {img}...")
-        result = subprocess.run(['docker', 'pull', img], capture_output=True, text=True, timeout=120)
-        if result.returncode == 0:
-            print(f"  ✓ Found working image: {img}")
-            gdal_image = img
-            break
-        else:
-            print(f"  ✗ {img} not available")
-    
-    if not gdal_image:
-        print("\n⚠ Could not find GDAL image. Pulling default...")
-        gdal_image = 'osgeo/gdal:alpine-small-latest'
-        print(f"Pulling {gdal_image}...")
-        subprocess.run(['docker', 'pull', gdal_image], timeout=300)
+    with stage('probe_gdal_image') as st:
+        print("Finding available GDAL Docker image...")
+        for img in gdal_images:
+            print(f"  Trying: {img}...")
+            result = subprocess.run(['docker', 'pull', img], capture_output=True, text=True, timeout=120)
+            if result.returncode == 0:
+                print(f"  ✓ Found working image: {img}")
+                gdal_image = img
+                break
+            else:
+                print(f"  ✗ {img} not available")
+        
+        if not gdal_image:
+            print("\n⚠ Could not find GDAL image. Pulling default...")
+            gdal_image = 'osgeo/gdal:alpine-small-latest'
+            print(f"Pulling {gdal_image}...")
+            subprocess.run(['docker', 'pull', gdal_image], timeout=300)
+        
+        st.extra['gdal_image'] = gdal_image
     
     # Extract buildings to GeoJSON directly from PBF
-    if not run_docker_command([
-        'docker', 'run', '--rm',
-        '-v', f'{data_dir}:/data'
-    ] + network_arg + [
-        gdal_image,
-        'ogr2ogr', '-f', 'GeoJSON',
-        '/data/buildings.geojson',
-        f'/data/{pbf_name}',
-        '-sql', "SELECT * FROM multipolygons WHERE building IS NOT NULL",
-        '-skipfailures',
-        '-progress'
-    ], "Extracting buildings from PBF"):
-        print("\n⚠ Direct extraction failed. Trying alternative SQL...")
-        # Try without SQL filter
+    with stage('ogr2ogr_extract') as st:
+        st.add(bytes_read=os.path.getsize(pbf_file))
         if not run_docker_command([
             'docker', 'run', '--rm',
             '-v', f'{data_dir}:/data'
@@ -193,12 +144,28 @@ def import_osm_buildings(pbf_file):
             'ogr2ogr', '-f', 'GeoJSON',
             '/data/buildings.geojson',
             f'/data/{pbf_name}',
-            'multipolygons',
-            '-where', "building IS NOT NULL",
-            '-skipfailures'
-        ], "Extracting buildings (alternative method)"):
-            print("✗ Failed to extract buildings. The PBF file might be corrupted or in an unsupported format.")
-            return False
+            '-sql', "SELECT * FROM multipolygons WHERE building IS NOT NULL",
+            '-skipfailures',
+            '-progress'
+        ], "Extracting buildings from PBF"):
+            print("\n⚠ Direct extraction failed. Trying alternative SQL...")
+            # Try without SQL filter
+            if not run_docker_command([
+                'docker', 'run', '--rm',
+                '-v', f'{data_dir}:/data'
+            ] + network_arg + [
+                gdal_image,
+                'ogr2ogr', '-f', 'GeoJSON',
+                '/data/buildings.geojson',
+                f'/data/{pbf_name}',
+                'multipolygons',
+                '-where', "building IS NOT NULL",
+                '-skipfailures'
+            ], "Extracting buildings (alternative method)"):
+                print("✗ Failed to extract buildings. The PBF file might be corrupted or in an unsupported format.")
+                st.fail("ogr2ogr extraction failed")
+                return False
+        st.extra['output_bytes'] = os.path.getsize(os.path.join(data_dir, 'buildings.geojson'))
     
     # Step 2: Import to PostGIS (network already checked above)
     print("\nStep 2: Importing to PostGIS...")
@@ -207,76 +174,153 @@ def import_osm_buildings(pbf_file):
     if not gdal_image:
         gdal_image = 'osgeo/gdal:alpine-small-latest'
     
-    if not run_docker_command([
-        'docker', 'run', '--rm',
-        '-v', f'{data_dir}:/data'
-    ] + network_arg + [
-        gdal_image,
-        'ogr2ogr', '-f', 'PostgreSQL',
-        'PG:host=postgres dbname=webgis user=postgres password=postgres port=5432',
-        '/data/buildings.geojson',
-        '-nln', 'buildings_temp',
-        '-lco', 'GEOMETRY_NAME=geom',
-        '-lco', 'FID=id',
-        '-nlt', 'MULTIPOLYGON',
-        '-t_srs', 'EPSG:4326',
-        '-overwrite'
-    ], "Step 2: Importing to PostGIS"):
-        return False
+    with stage('ogr2ogr_load') as st:
+        st.add(bytes_read=os.path.getsize(os.path.join(data_dir, 'buildings.geojson')))
+        if not run_docker_command([
+            'docker', 'run', '--rm',
+            '-v', f'{data_dir}:/data'
+        ] + network_arg + [
+            gdal_image,
+            'ogr2ogr', '-f', 'PostgreSQL',
+            'PG:host=postgres dbname=webgis user=postgres password=postgres port=5432',
+            '/data/buildings.geojson',
+            '-nln', 'buildings_temp',
+            '-lco', 'GEOMETRY_NAME=geom',
+            '-lco', 'FID=id',
+            '-nlt', 'MULTIPOLYGON',
+            '-t_srs', 'EPSG:4326',
+            '-overwrite'
+        ], "Step 2: Importing to PostGIS"):
+            st.fail("ogr2ogr load failed")
+            return False
     
     # Step 4: Process data in PostGIS
     print("\nStep 4: Processing data in PostGIS...")
     
-    sql = """
-    -- Clear old buildings
-    DELETE FROM buildings;
+    from bulk_load import building_columns_ddl, staging_indexes_sql, upsert_statements
+    from hilbert import HILBERT_FUNCTION_DDL, hilbert_order_by, record_order_sql
+    from regions import (
+        REGIONS_DDL, attach_sql, check_region, partition_name, region_columns_sql, require_unpartitioned_sql,
+        staging_name,
+    )
+    from validate_geometry import validation_statements
     
-    -- Import from temp table
-    INSERT INTO buildings (name, type, geom)
-    SELECT 
-        COALESCE(
-            properties->>'name',
-            properties->>'addr:housename',
-            'Unnamed Building'
-        ) as name,
-        COALESCE(
-            properties->>'building',
-            'unknown'
-        ) as type,
-        geom
+    # Table the import ends up in: buildings, or its region partition
+    table = partition_name('buildings', check_region(region)) if region else 'buildings'
+    
+    # Column DDL first, committed on its own: it is a no-op once the columns exist, and
+    # inside the load transaction its ALTER TABLE would lock buildings (every region) until COMMIT
+    sql = building_columns_ddl() + """
+    BEGIN;
+    -- Normalize the ogr2ogr output: OSM key, name/type and a content hash per building
+    CREATE TEMP TABLE buildings_incoming AS
+    SELECT
+        COALESCE('w' || osm_way_id, 'r' || osm_id) as osm_id,
+        name,
+        type,
+        geom,
+        md5(concat_ws(chr(31), name, type, encode(ST_AsEWKB(geom), 'hex'))) as content_hash
     FROM (
-        SELECT 
-            jsonb_build_object(
-                'name', name,
-                'building', building,
-                'addr:housename', addr_housename
-            ) as properties,
+        SELECT
+            osm_id,
+            osm_way_id,
+            COALESCE(name, addr_housename, 'Unnamed Building') as name,
+            COALESCE(building, 'unknown') as type,
             geom
         FROM buildings_temp
     ) t;
+    """
     
-    -- Drop temp table
-    DROP TABLE IF EXISTS buildings_temp;
+    if region:
+        sql += REGIONS_DDL
+    else:
+        # Without a region, the reload / diff below would hit every region of a partitioned buildings
+        sql += require_unpartitioned_sql('buildings')
     
+    if upsert:
+        if region:
+            sql += f"SELECT region_ensure('buildings', '{region}');\n"
+        # Only touch new, changed and vanished buildings, marking their tiles in dirty_tiles
+        sql += "\n".join(stmt for _, stmt in upsert_statements('buildings_incoming', table,
+                                                             dirty_zooms=(SEED_MIN_ZOOM, SEED_MAX_ZOOM),
+                                                             hilbert=hilbert))
+        if region:
+            sql += f"\nSELECT region_record('buildings', '{region}');\n"
+    elif region:
+        # Build the partition offline, then swap it in: other regions are not touched
+        staging = staging_name('buildings', region)
+        sql += "\n".join(stmt for _, stmt in validation_statements('buildings_incoming'))
+        sql += f"""
+    DROP TABLE IF EXISTS {staging};
+    CREATE TABLE {staging} (LIKE buildings INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING GENERATED);
+    """ + region_columns_sql(staging, region)
+        if hilbert:
+            sql += HILBERT_FUNCTION_DDL
+        sql += f"""
+    INSERT INTO {staging} (osm_id, name, type, geom, content_hash)
+    SELECT osm_id, name, type, geom, content_hash FROM buildings_incoming
+    {hilbert_order_by() if hilbert else ''};
+    """
+        if hilbert:
+            sql += record_order_sql(staging)
+        sql += staging_indexes_sql(staging, 'id, region') + attach_sql('buildings', region, staging)
+    else:
+        # Repair / quarantine invalid geometries (upsert_statements already does this)
+        sql += "\n".join(stmt for _, stmt in validation_statements('buildings_incoming'))
+        sql += """
+    -- Clear old buildings
+    DELETE FROM buildings;
+    """
+        if hilbert:
+            # ogr2ogr writes in OSM id order: insert by Hilbert key so neighbours share pages
+            sql += HILBERT_FUNCTION_DDL
+        sql += f"""
+    -- Import from temp table
+    INSERT INTO buildings (osm_id, name, type, geom, content_hash)
+    SELECT osm_id, name, type, geom, content_hash FROM buildings_incoming
+    {hilbert_order_by() if hilbert else ''};
+    """
+        if hilbert:
+            sql += record_order_sql('buildings')
+    
+    sql += """
+    -- Drop temp tables
+    DROP TABLE IF EXISTS buildings_temp;
+    DROP TABLE IF EXISTS buildings_incoming;
+    COMMIT;
+    """
+    if not region:
+        # A region partition was attached with its own indexes
+        sql += """
     -- Create index
     CREATE INDEX IF NOT EXISTS buildings_geom_idx ON buildings USING GIST (geom);
-    
+    """
+    sql += """
     -- Show count
-    SELECT COUNT(*) as total_buildings FROM buildings;
+    SELECT COUNT(*) as total_buildings FROM """ + table + """;
     """
     
-    result = subprocess.run([
-        'docker', 'exec', '-i', 'webgis-postgres',
-        'psql', '-U', 'postgres', '-d', 'webgis'
-    ], input=sql, text=True, capture_output=True)
-    
-    if result.returncode == 0:
-        print("✓ Data processed")
-        print(result.stdout)
-    else:
-        print("✗ Error processing data:")
-        print(result.stderr)
-        return False
+    with stage('postgis_process') as st:
+        result = subprocess.run([
+            'docker', 'exec', '-i', 'webgis-postgres',
+            # ON_ERROR_STOP: without it a failed statement only turns COMMIT into ROLLBACK and psql still exits 0
+            'psql', '-v', 'ON_ERROR_STOP=1', '-U', 'postgres', '-d', 'webgis'
+        ], input=sql, text=True, capture_output=True)
+        
+        if result.returncode == 0:
+            print("✓ Data processed")
+            print(result.stdout)
+            total = re.search(r'total_buildings\s*\n-+\s*\n\s*(\d+)', result.stdout)
+            if total:
+                st.add(rows_out=int(total.group(1)))
+        else:
+            print("✗ Error processing data:")
+            print(result.stderr)
+            if 'is partitioned by region' in result.stderr:
+                # Raised by the require_unpartitioned_sql guard; nothing was changed
+                print("✗ buildings is partitioned by region: rerun with --region <name> (python regions.py list)")
+            st.fail(result.stderr.strip()[-500:])
+            return False
     
     return True
 
@@ -284,8 +328,46 @@ def main():
     print("=== OSM Buildings Import Tool ===")
     print()
     
-    if len(sys.argv) > 1:
-        pbf_file = sys.argv[1]
+    # --native: read the PBF in-process with pyosmium instead of Docker/ogr2ogr
+    # --upsert: diff against the current buildings instead of reloading everything
+    # --seed: pre-render vector tiles for the imported extent into tiles.mbtiles
+    #         (with --upsert and an existing tiles.mbtiles only the dirty tiles are re-rendered)
+    # --dirty-tiles <file>: with --upsert, write the z/x/y tiles the import changed to file
+    #                       (rejected without --upsert: a full reload marks no tiles)
+    # --generalize: rebuild the simplified buildings_z10 / buildings_z13 tables after the import
+    # --hilbert: store buildings in Hilbert order of their centroid (see hilbert.py)
+    # --region <name>: load into the buildings_<name> partition only, built offline (see regions.py)
+    # --report <file> / --metrics <file> / --profile cprofile|tracemalloc: see instrumentation.py
+    native = '--native' in sys.argv
+    upsert = '--upsert' in sys.argv
+    seed = '--seed' in sys.argv
+    dirty_file = None
+    args = sys.argv[1:]
+    if '--dirty-tiles' in args:
+        i = args.index('--dirty-tiles')
+        dirty_file = args[i + 1] if i + 1 < len(args) else None
+        del args[i:i + 2]
+        if not upsert:
+            # Only upsert imports mark dirty_tiles; a full reload invalidates every tile
+            print("Error: --dirty-tiles needs --upsert (a full reload invalidates every tile, re-seed with --seed)")
+            sys.exit(1)
+    hilbert = '--hilbert' in sys.argv
+    region = None
+    if '--region' in args:
+        i = args.index('--region')
+        region = args[i + 1] if i + 1 < len(args) else None
+        del args[i:i + 2]
+        from regions import RegionError, check_region
+        
+        try:
+            check_region(region)
+        except RegionError as e:
+            print(f"Error: {e}")
+            return
+    args = [a for a in args if a not in ('--native', '--upsert', '--seed', '--generalize', '--hilbert')]
+    
+    if args:
+        pbf_file = args[0]
     else:
         # Ask user
         print("Options:")
@@ -304,7 +386,39 @@ def main():
             print("Invalid choice")
             return
     
-    if import_osm_buildings(pbf_file):
+    if native:
+        from import_osm_data import import_from_pbf
+        imported = import_from_pbf(pbf_file, upsert=upsert, hilbert=hilbert, region=region) is not None
+    else:
+        imported = import_osm_buildings(pbf_file, upsert, hilbert, region)
+    
+    if imported and dirty_file:
+        from import_osm_data import write_dirty_tiles
+        write_dirty_tiles(dirty_file)
+    
+    if imported and '--generalize' in sys.argv:
+        from generalize import generalize
+        
+        print("\nStep 5: Building generalized tables...")
+        with stage('generalize'):
+            generalize('buildings')
+    
+    if imported and seed:
+        from seed_tiles import seed_tiles, refresh_dirty_tiles, buildings_extent, DEFAULT_OUTPUT
+        
+        mbtiles = os.path.join(os.path.dirname(os.path.abspath(__file__)), DEFAULT_OUTPUT)
+        if upsert and not dirty_file and os.path.exists(mbtiles):
+            print("\nStep 6: Re-rendering dirty vector tiles...")
+            with stage('seed_tiles'):
+                refresh_dirty_tiles(mbtiles)
+        else:
+            bbox = buildings_extent()
+            if bbox:
+                print("\nStep 6: Pre-seeding vector tiles...")
+                with stage('seed_tiles'):
+                    seed_tiles(bbox, SEED_MIN_ZOOM, SEED_MAX_ZOOM, mbtiles)
+    
+    if imported:
         print("\n" + "="*50)
         print("✓ Import successful!")
         print("\nNext steps:")
@@ -314,7 +428,9 @@ def main():
         print("4. Zoom into London to see thousands of real buildings!")
     else:
         print("\n✗ Import failed. Check errors above.")
+        sys.exit(1)
 
 if __name__ == '__main__':
-    main()
+    with import_run('import_osm_simple', **pop_run_options(sys.argv)):
+        main()
 
@@ -1,8 +1,12 @@
 # Script to import OSM data using osm2pgsql via Docker
 # Usage: .\import_with_osm2pgsql.ps1 -PbfFile belarus-251111.osm.pbf
+#        .\import_with_osm2pgsql.ps1 -PbfFile vietnam-latest.osm.pbf -Region hanoi
+# With -Region the extract is imported into osm_<region>_* tables and attached as the
+# region's planet_osm_*_<region> partitions, leaving other regions untouched (see regions.py)
 
 param (
-    [string]$PbfFile = "belarus-251111.osm.pbf"
+    [string]$PbfFile = "belarus-251111.osm.pbf",
+    [string]$Region = ""
 )
 
 $ErrorActionPreference = "Stop"
@@ -32,6 +36,13 @@ Write-Host "Database: webgis (on container 'webgis-postgres')"
 # --slim: allows updates (optional but good)
 # Using iboates/osm2pgsql as it is a well-maintained minimal image (osm2pgsql/osm2pgsql is not available)
 
+# --prefix: -c then only drops and recreates this region's own tables
+$PrefixArgs = @()
+if ($Region) {
+    $PrefixArgs = @("--prefix", "osm_$Region")
+    Write-Host "Region: $Region (tables osm_${Region}_*)"
+}
+
 Write-Host "Running osm2pgsql container..." -ForegroundColor Yellow
 
 docker run --rm `
@@ -41,11 +52,37 @@ docker run --rm `
     iboates/osm2pgsql:latest `
     -c -d webgis -U postgres -H webgis-postgres `
     --slim `
+    @PrefixArgs `
     "/data/$PbfFile"
 
 if ($LASTEXITCODE -eq 0) {
     Write-Host "=== Import Successful! ===" -ForegroundColor Green
-    Write-Host "Tables created: planet_osm_point, planet_osm_line, planet_osm_polygon, planet_osm_roads"
+    if ($Region) {
+        Write-Host "Tables created: osm_${Region}_point, osm_${Region}_line, osm_${Region}_polygon, osm_${Region}_roads"
+    } else {
+        Write-Host "Tables created: planet_osm_point, planet_osm_line, planet_osm_polygon, planet_osm_roads"
+    }
+
+    # /analysis/score and /data/search read precomputed tables; rebuild them for the new data
+    if (Get-Command python -ErrorAction SilentlyContinue) {
+        if ($Region) {
+            Write-Host "Attaching $Region partitions..." -ForegroundColor Yellow
+            python "$PSScriptRoot\regions.py" attach-osm $Region
+        }
+        Write-Host "Adding pre-projected geometry columns..." -ForegroundColor Yellow
+        python "$PSScriptRoot\projections.py"
+        Write-Host "Rebuilding amenity score grid..." -ForegroundColor Yellow
+        python "$PSScriptRoot\amenity_grid.py"
+        Write-Host "Refreshing search index..." -ForegroundColor Yellow
+        python "$PSScriptRoot\search_index.py"
+    } else {
+        if ($Region) {
+            Write-Host "Run 'python regions.py attach-osm $Region' to attach the region's partitions" -ForegroundColor Yellow
+        }
+        Write-Host "Run 'python projections.py' to add the pre-projected geometry columns" -ForegroundColor Yellow
+        Write-Host "Run 'python amenity_grid.py' to refresh the /analysis/score grid" -ForegroundColor Yellow
+        Write-Host "Run 'python search_index.py' to refresh the /data/search index" -ForegroundColor Yellow
+    }
 } else {
     Write-Host "=== Import Failed ===" -ForegroundColor Red
 }
@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""
+Per-stage instrumentation for the data/ importers
+An importer wraps its run in import_run() and each step in stage(); every
+stage records wall time, CPU time (this process and reaped children, e.g.
+psql / ogr2ogr / pool workers), rows in/out, input bytes, bytes read by the
+process and its peak RSS. At the end of the run a summary table is printed
+and, when asked for, written as a JSON report and as Prometheus textfile
+metrics (node_exporter --collector.textfile.directory).
+
+Stages marked hot=True are the Python hot loops (encoding + COPY, diff
+parsing, ...); with profile='cprofile' or 'tracemalloc' they are profiled and
+the top functions / allocation sites are added to their report entry.
+
+Library code calls stage() unconditionally: without an active run it only
+measures, nothing is stored or printed.
+
+A stage's peak RSS is the highest VmRSS seen by a sampler thread that runs
+while any stage is open (every RSS_SAMPLE_INTERVAL seconds, plus a reading on
+entry and exit). The process-wide high-water mark (VmHWM, ru_maxrss) is never
+reset, so callers such as benchmark.py still see the real peak of the process.
+
+Every option can also come from the environment, so wrapper scripts and
+cron jobs can switch it on without touching the command line:
+  IMPORT_REPORT=run.json  IMPORT_METRICS=/var/lib/node_exporter/webgis_import.prom
+  IMPORT_PROFILE=cprofile|tracemalloc
+"""
+
+import cProfile
+import io
+import json
+import os
+import platform
+import pstats
+import re
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PROFILERS = ('cprofile', 'tracemalloc')
+RSS_SAMPLE_INTERVAL = 0.05  # seconds between VmRSS readings while a stage is open
+PROFILE_TOP = 25  # functions / allocation sites kept per hot stage
+METRIC_PREFIX = 'webgis_import'
+
+# Command-line spelling of the import_run() options (see pop_run_options)
+RUN_OPTIONS = {'--report': 'report', '--metrics': 'metrics', '--profile': 'profile'}
+
+_runs = []  # stack of active ImportRun objects (nested runs report into the outermost)
+
+
+def _proc_status(field):
+    """kB value of a /proc/self/status field (Linux), or None"""
+    try:
+        with open('/proc/self/status', 'r', encoding='ascii') as f:
+            match = re.search(rf'^{field}:\s+(\d+)', f.read(), re.MULTILINE)
+        return int(match.group(1)) if match else None
+    except OSError:
+        return None
+
+
+def _rss_bytes():
+    """Current RSS (Linux), or None"""
+    rss = _proc_status('VmRSS')
+    return rss * 1024 if rss is not None else None
+
+
+def _process_peak_rss_bytes():
+    """Lifetime peak RSS of the process"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # bytes on macOS, kB elsewhere
+
+
+class _RssSampler:
+    """Daemon thread raising peak_rss of the registered stages to the current VmRSS while any is open"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = set()
+        self.thread = None
+
+    def sample(self):
+        rss = _rss_bytes()
+        if rss is None:
+            return
+        with self.lock:
+            for current in self.stages:
+                current.peak_rss = max(current.peak_rss or 0, rss)
+
+    def register(self, current):
+        """Start tracking current; False where VmRSS cannot be read"""
+        rss = _rss_bytes()
+        if rss is None:
+            return False
+        current.peak_rss = rss
+        with self.lock:
+            self.stages.add(current)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+                self.thread.start()
+        return True
+
+    def unregister(self, current):
+        self.sample()
+        with self.lock:
+            self.stages.discard(current)
+
+    def _run(self):
+        while True:
+            time.sleep(RSS_SAMPLE_INTERVAL)
+            with self.lock:
+                if not self.stages:
+                    self.thread = None
+                    return
+            self.sample()
+
+
+_rss_sampler = _RssSampler()
+
+
+def _io_read_bytes():
+    """Bytes this process has read through read()-like syscalls (files, sockets, pipes; Linux)"""
+    try:
+        with open('/proc/self/io', 'r', encoding='ascii') as f:
+            match = re.search(r'^rchar:\s+(\d+)', f.read(), re.MULTILINE)
+        return int(match.group(1)) if match else None
+    except OSError:
+        return None
+
+
+def _children_cpu():
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Stage:
+    """Counters for one stage; the with-block body calls add() as rows / bytes go through"""
+
+    def __init__(self, name, hot=False):
+        self.name = name
+        self.hot = hot
+        self.rows_in = 0
+        self.rows_out = 0
+        self.bytes_read = 0
+        self.extra = {}
+        self.peak_rss = None  # raised by _rss_sampler while the stage is open
+        self.error = None
+
+    def fail(self, error):
+        """Mark the stage failed when the body reports failure by return value instead of raising"""
+        self.error = error
+
+    def add(self, rows_in=0, rows_out=0, bytes_read=0):
+        self.rows_in += rows_in
+        self.rows_out += rows_out
+        self.bytes_read += bytes_read
+
+
+class ImportRun:
+    def __init__(self, name, report=None, metrics=None, profile=None):
+        if profile and profile not in PROFILERS:
+            raise ValueError(f"Unknown profiler {profile!r} (choose from {', '.join(PROFILERS)})")
+        self.name = name
+        self.report = report
+        self.metrics = metrics
+        self.profile = profile
+        self.stages = []
+        self.open = []  # stages currently running, outermost first
+        self.started_at = datetime.now(timezone.utc)
+        self.start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.children_cpu_start = _children_cpu()
+        self.profiling = False
+
+    def summary(self, status, error=None):
+        wall = time.perf_counter() - self.start
+        return {
+            'run': self.name,
+            'status': status,
+            'error': error,
+            'started_at': self.started_at.isoformat(),
+            'finished_at': datetime.now(timezone.utc).isoformat(),
+            'wall_s': round(wall, 3),
+            'cpu_s': round(time.process_time() - self.cpu_start, 3),
+            'children_cpu_s': round(_children_cpu() - self.children_cpu_start, 3),
+            'peak_rss_bytes': max([s['peak_rss_bytes'] or 0 for s in self.stages] +
+                                  [_process_peak_rss_bytes() or 0]) or None,
+            'argv': sys.argv,
+            'host': socket.gethostname(),
+            'python': platform.python_version(),
+            'profile': self.profile,
+            'stages': self.stages,
+        }
+
+
+@contextmanager
+def stage(name, hot=False):
+    """
+    Measure one stage of the active run (see module docstring); yields a Stage for counters.
+    Nested stages are recorded with a 'parent' path and counted inside their parent's time.
+    """
+    run = _runs[0] if _runs else None
+    current = Stage(name, hot)
+    if run:
+        run.open.append(current)
+
+    # Outside a run the entry is dropped, so don't wake the sampler thread for it
+    sampled = run is not None and _rss_sampler.register(current)
+    io_start = _io_read_bytes()
+    children_start = _children_cpu()
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+
+    profiler = tracing = None
+    if run and hot and run.profile and not run.profiling:
+        run.profiling = True  # only the outermost hot stage is profiled
+        if run.profile == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            tracing = True
+            tracemalloc.start()
+
+    status, error = 'ok', None
+    try:
+        yield current
+    except BaseException as exc:
+        status, error = 'failed', f"{type(exc).__name__}: {exc}"
+        raise
+    finally:
+        if current.error and status == 'ok':
+            status, error = 'failed', current.error
+        wall = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+        io_end = _io_read_bytes()
+        if sampled:
+            _rss_sampler.unregister(current)
+        # Without /proc the best available figure is the process lifetime peak
+        peak = current.peak_rss if sampled else _process_peak_rss_bytes()
+
+        entry = {
+            'stage': name,
+            'parent': '/'.join(s.name for s in run.open[:-1]) if run and len(run.open) > 1 else None,
+            'status': status,
+            'error': error,
+            'start_s': round(start - run.start, 3) if run else None,
+            'wall_s': round(wall, 3),
+            'cpu_s': round(cpu, 3),
+            'children_cpu_s': round(_children_cpu() - children_start, 3),
+            'rows_in': current.rows_in,
+            'rows_out': current.rows_out,
+            'rows_per_s': round(current.rows_out / wall, 1) if wall > 0 and current.rows_out else None,
+            'bytes_read': current.bytes_read,
+            'io_read_bytes': io_end - io_start if io_start is not None and io_end is not None else None,
+            'peak_rss_bytes': peak,
+            **current.extra,
+        }
+        if profiler is not None:
+            profiler.disable()
+            entry['profile'] = _cprofile_top(profiler)
+            run.profiling = False
+        elif tracing:
+            entry['allocations'] = _tracemalloc_top()
+            tracemalloc.stop()
+            run.profiling = False
+        if run:
+            run.open.pop()
+            run.stages.append(entry)
+
+
+def _cprofile_top(profiler):
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    rows = []
+    for (filename, line, func), (calls, _, own, cumulative, _) in stats.stats.items():
+        rows.append({'function': f"{os.path.basename(filename)}:{line}({func})", 'calls': calls,
+                     'own_s': round(own, 4), 'cumulative_s': round(cumulative, 4)})
+    rows.sort(key=lambda r: r['own_s'], reverse=True)
+    return rows[:PROFILE_TOP]
+
+
+def _tracemalloc_top():
+    snapshot = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    top = snapshot.statistics('lineno')[:PROFILE_TOP]
+    return {
+        'traced_peak_bytes': peak,
+        'top': [{'where': f"{os.path.basename(s.traceback[0].filename)}:{s.traceback[0].lineno}",
+                 'bytes': s.size, 'blocks': s.count} for s in top],
+    }
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# (metric suffix, stage field, help)
+STAGE_METRICS = [
+    ('stage_duration_seconds', 'wall_s', 'Wall time of the stage in the last run'),
+    ('stage_cpu_seconds', 'cpu_s', 'CPU time of the importer process during the stage'),
+    ('stage_children_cpu_seconds', 'children_cpu_s', 'CPU time of child processes reaped during the stage'),
+    ('stage_rows_in', 'rows_in', 'Rows read by the stage'),
+    ('stage_rows_out', 'rows_out', 'Rows written by the stage'),
+    ('stage_bytes_read', 'bytes_read', 'Input bytes consumed by the stage'),
+    ('stage_io_read_bytes', 'io_read_bytes', 'Bytes read by the importer process during the stage'),
+    ('stage_peak_rss_bytes', 'peak_rss_bytes', 'Peak resident set size during the stage'),
+]
+
+
+def stage_totals(stages):
+    """
+    Merge stage entries with the same path (e.g. one per diff file), in start order:
+    times, rows and bytes are summed, peak RSS is the maximum, count is the number merged.
+    """
+    totals = {}
+    # Parents sort before children that started in the same millisecond
+    for entry in sorted(stages, key=lambda e: (e.get('start_s') or 0, (e['parent'] or '').count('/') + bool(e['parent']))):
+        path = '/'.join(filter(None, [entry['parent'], entry['stage']]))
+        total = totals.get(path)
+        if total is None:
+            totals[path] = dict(entry, path=path, count=1)
+            continue
+        total['count'] += 1
+        for field in ('wall_s', 'cpu_s', 'children_cpu_s', 'rows_in', 'rows_out', 'bytes_read', 'io_read_bytes'):
+            if entry.get(field) is not None:
+                total[field] = round((total.get(field) or 0) + entry[field], 3)
+        total['peak_rss_bytes'] = max(total['peak_rss_bytes'] or 0, entry['peak_rss_bytes'] or 0) or None
+        total['rows_per_s'] = round(total['rows_out'] / total['wall_s'], 1) if total['wall_s'] and total['rows_out'] else None
+        if entry['status'] != 'ok':
+            total['status'] = entry['status']
+    return list(totals.values())
+
+
+def prometheus_text(summary):
+    """Prometheus text exposition of a run summary (gauges, one series per stage path)"""
+    run = _label(summary['run'])
+    totals = stage_totals(summary['stages'])
+    lines = []
+    for suffix, field, help_text in STAGE_METRICS:
+        metric = f"{METRIC_PREFIX}_{suffix}"
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge"]
+        for total in totals:
+            if total.get(field) is None:
+                continue
+            lines.append(f'{metric}{{run="{run}",stage="{_label(total["path"])}"}} {total[field]}')
+    finished = datetime.fromisoformat(summary['finished_at']).timestamp()
+    for suffix, value, help_text in [
+        ('run_duration_seconds', summary['wall_s'], 'Wall time of the last run'),
+        ('run_success', int(summary['status'] == 'ok'), '1 if the last run finished without error'),
+        ('run_finished_timestamp_seconds', round(finished, 3), 'Unix time the last run finished'),
+    ]:
+        metric = f"{METRIC_PREFIX}_{suffix}"
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge", f'{metric}{{run="{run}"}} {value}']
+    return '\n'.join(lines) + '\n'
+
+
+def _write_atomic(path, text):
+    # The textfile collector may read at any moment: never expose a half-written file
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def _mb(value):
+    return f"{value / 1024 / 1024:,.0f}" if value else '-'
+
+
+def print_stage_table(summary, out=None):
+    out = out or sys.stdout
+    print(f"\n{'stage':32} {'n':>5} {'wall s':>8} {'cpu s':>8} {'child s':>8} {'rows in':>10} {'rows out':>10} "
+          f"{'rows/s':>10} {'read MB':>8} {'rss MB':>7}", file=out)
+    for entry in stage_totals(summary['stages']):
+        depth = entry['path'].count('/')
+        name = ('  ' * depth + entry['stage'])[:32]
+        print(f"{name:32} {entry['count']:5} {entry['wall_s']:8.1f} {entry['cpu_s']:8.1f} {entry['children_cpu_s']:8.1f} "
+              f"{entry['rows_in']:10} {entry['rows_out']:10} {entry['rows_per_s'] or 0:10,.0f} "
+              f"{_mb(entry['bytes_read'] or entry['io_read_bytes']):>8} {_mb(entry['peak_rss_bytes']):>7}"
+              + ('  FAILED' if entry['status'] != 'ok' else ''), file=out)
+    print(f"{'total':32} {'':5} {summary['wall_s']:8.1f} {summary['cpu_s']:8.1f} {summary['children_cpu_s']:8.1f}",
+          file=out)
+
+
+@contextmanager
+def import_run(name, report=None, metrics=None, profile=None):
+    """
+    Collect the stages of one importer run. On exit (also on failure) prints the stage table
+    and writes the JSON report / Prometheus textfile when report / metrics paths are set.
+    A run started inside another one (e.g. generalize after an import) reports into the outer run.
+    """
+    if _runs:
+        yield _runs[0]
+        return
+
+    run = ImportRun(name, report or os.environ.get('IMPORT_REPORT'),
+                    metrics or os.environ.get('IMPORT_METRICS'),
+                    profile or os.environ.get('IMPORT_PROFILE') or None)
+    _runs.append(run)
+    status, error = 'ok', None
+    try:
+        yield run
+    except BaseException as exc:
+        status, error = 'failed', f"{type(exc).__name__}: {exc}"
+        raise
+    finally:
+        _runs.pop()
+        if status == 'ok' and any(entry['status'] != 'ok' for entry in run.stages):
+            status, error = 'failed', next(e['error'] for e in run.stages if e['status'] != 'ok')
+        summary = run.summary(status, error)
+        if run.stages:
+            print_stage_table(summary)
+        if run.report:
+            _write_atomic(run.report, json.dumps(summary, indent=2, default=str))
+            print(f"Run report written to {run.report}")
+        if run.metrics:
+            _write_atomic(run.metrics, prometheus_text(summary))
+
+
+def pop_run_options(args):
+    """Remove --report / --metrics / --profile <value> from args (in place); returns import_run kwargs"""
+    options = {}
+    for flag, key in RUN_OPTIONS.items():
+        while flag in args:
+            index = args.index(flag)
+            if index + 1 < len(args):
+                options[key] = args[index + 1]
+            del args[index:index + 2]
+    return options
+
+
+if __name__ == '__main__':
+    # Re-print the stage table of a saved report, or its Prometheus form with --prometheus
+    if len(sys.argv) < 2:
+        print("Usage: python instrumentation.py <report.json> [--prometheus]")
+        sys.exit(1)
+    with open(sys.argv[1], 'r', encoding='utf-8') as f:
+        saved = json.load(f)
+    if '--prometheus' in sys.argv:
+        sys.stdout.write(prometheus_text(saved))
+    else:
+        print(f"{saved['run']} ({saved['status']}) started {saved['started_at']}")
+        print_stage_table(saved)
@@ -0,0 +1,573 @@
+#!/usr/bin/env python3
+"""
+Load test for the spatial API endpoints
+Replays a weighted mix of /analysis/buffer, /analysis/score, /data/search,
+/data/filter, /data/identify and /district-safety requests against a running
+backend from a pool of concurrent clients. Click points are sampled around
+real POIs (and uniformly) inside the imported data extent, filter bboxes are
+map viewports at zoom 12-17, and search terms are fragments of real names.
+
+Reports throughput, latency percentiles and a latency histogram per endpoint.
+With --explain N the SQL behind the N slowest requests of each endpoint is
+re-run with EXPLAIN (ANALYZE, BUFFERS) and the plans are added to the report.
+
+Requires aiohttp and psycopg2.
+
+Usage:
+  python loadtest.py [--url http://localhost:3000] [--concurrency 32] [--duration 60]
+                     [--mix filter=30,identify=20,...] [--explain 3] [--output report.json]
+"""
+
+import argparse
+import asyncio
+import bisect
+import json
+import math
+import random
+import sys
+import time
+
+import aiohttp
+import psycopg2
+
+BASE_URL = 'http://localhost:3000'
+CONCURRENCY = 32
+DURATION = 60  # seconds
+WARMUP = 5  # seconds of requests that are not recorded
+TIMEOUT = 30  # seconds per request
+SAMPLE_POINTS = 2000
+SAMPLE_NAMES = 500
+
+ENDPOINTS = {
+    'buffer': '/api/analysis/buffer',
+    'score': '/api/analysis/score',
+    'search': '/api/data/search',
+    'filter': '/api/data/filter',
+    'identify': '/api/data/identify',
+    'district-safety': '/api/district-safety',
+}
+# Roughly what the map UI sends: panning triggers filter, clicks identify
+DEFAULT_MIX = {'filter': 30, 'identify': 20, 'search': 20, 'score': 15, 'buffer': 10, 'district-safety': 5}
+
+FILTER_ZOOMS = (12, 13, 14, 15, 16, 17)
+VIEWPORT = (1280, 800)  # pixels
+BUFFER_RADII = (250, 500, 1000, 2000)  # metres
+NEAR_POI_SHARE = 0.7  # clicks land near a real feature this often
+CLICK_JITTER = 50  # metres around the sampled POI
+
+HISTOGRAM_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+PERCENTILES = (50, 90, 95, 99)
+
+# Used when the database cannot be sampled (generate_more_sample_data grid)
+FALLBACK_EXTENT = (-0.135, 51.495, -0.105, 51.515)
+FALLBACK_AMENITIES = ['restaurant', 'cafe', 'school', 'hospital', 'bank', 'parking', 'fuel', 'pharmacy']
+FALLBACK_TERMS = ['st', 'park', 'cafe', 'bank', 'school', 'station', 'road', 'house']
+
+
+# SQL behind each endpoint, kept in step with backend/src/routes/*.ts (used for --explain only)
+EXPLAIN_SQL = {
+    'buffer': """
+        WITH buffer_geom AS (
+          SELECT ST_Buffer(ST_Transform(ST_SetSRID(ST_MakePoint(%(lon)s, %(lat)s), 4326), 3857), %(radius)s) as geom
+        )
+        SELECT json_build_object('type', 'FeatureCollection', 'features', COALESCE(json_agg(
+          json_build_object('type', 'Feature',
+            'geometry', json_build_object('type', 'Point',
+              'coordinates', json_build_array(ST_X(ST_Transform(way, 4326)), ST_Y(ST_Transform(way, 4326)))),
+            'properties', json_build_object('name', name, 'amenity', amenity, 'type', 'point'))
+        ), '[]'::json)) as geojson
+        FROM planet_osm_point, buffer_geom
+        WHERE ST_Intersects(way, buffer_geom.geom)
+        AND amenity IS NOT NULL
+        LIMIT 200;
+    """,
+    'score/grid': """
+        WITH p AS (SELECT ST_Transform(ST_SetSRID(ST_MakePoint(%(lon)s, %(lat)s), 4326), 3857) AS geom)
+        SELECT m.water_mask, COALESCE(g.water, false) AS water, g.*
+        FROM amenity_grid_meta m
+        CROSS JOIN p
+        LEFT JOIN amenity_grid g
+          ON g.cell_x = floor(ST_X(p.geom) / m.cell_size)::int
+         AND g.cell_y = floor(ST_Y(p.geom) / m.cell_size)::int
+        WHERE m.radius = 1000 AND ST_Contains(m.extent, p.geom)
+        LIMIT 1;
+    """,
+    'score': """
+        SELECT
+          COUNT(*) FILTER (WHERE amenity = 'school') as schools,
+          COUNT(*) FILTER (WHERE amenity IN ('university', 'college')) as universities,
+          COUNT(*) FILTER (WHERE amenity = 'kindergarten') as kindergartens,
+          COUNT(*) FILTER (WHERE amenity IN ('hospital', 'clinic', 'doctors', 'pharmacy')) as health,
+          COUNT(*) FILTER (WHERE amenity IN ('bank', 'atm', 'post_office', 'police', 'fire_station')) as services,
+          COUNT(*) FILTER (WHERE amenity IN ('marketplace', 'supermarket', 'convenience')) as shopping,
+          COUNT(*) FILTER (WHERE amenity IN ('cafe', 'restaurant', 'fast_food', 'bar', 'pub', 'cinema', 'park')) as leisure,
+          COUNT(*) FILTER (WHERE amenity = 'parking') as parking,
+          COUNT(*) FILTER (WHERE amenity = 'fuel') as fuel
+        FROM planet_osm_point
+        WHERE ST_DWithin(way, ST_Transform(ST_SetSRID(ST_MakePoint(%(lon)s, %(lat)s), 4326), 3857), 1000);
+    """,
+    'search': """
+        SELECT name, address, 'charging_station' as type, lon, lat
+        FROM charge_stations
+        WHERE name ILIKE %(term)s OR address ILIKE %(term)s
+        UNION
+        SELECT name, NULL as address, 'point' as type, ST_X(ST_Transform(way, 4326)) as lon, ST_Y(ST_Transform(way, 4326)) as lat
+        FROM planet_osm_point
+        WHERE name ILIKE %(term)s
+        UNION
+        SELECT name, NULL as address, 'polygon' as type, ST_X(ST_Centroid(ST_Transform(way, 4326))) as lon, ST_Y(ST_Centroid(ST_Transform(way, 4326))) as lat
+        FROM planet_osm_polygon
+        WHERE name ILIKE %(term)s
+        LIMIT 20;
+    """,
+    'filter': """
+        SELECT json_build_object('type', 'FeatureCollection', 'features', json_agg(
+          json_build_object('type', 'Feature',
+            'geometry', json_build_object('type', 'Point',
+              'coordinates', json_build_array(ST_X(ST_Transform(way, 4326)), ST_Y(ST_Transform(way, 4326)))),
+            'properties', json_build_object('name', name, 'amenity', amenity))
+        )) as geojson
+        FROM planet_osm_point
+        WHERE amenity = ANY(%(types)s)
+        AND ST_Intersects(way, ST_Transform(ST_MakeEnvelope(%(minx)s, %(miny)s, %(maxx)s, %(maxy)s, 4326), 3857))
+        LIMIT 500;
+    """,
+    'identify': """
+        WITH search_point AS (
+          SELECT ST_Transform(ST_SetSRID(ST_MakePoint(%(lon)s, %(lat)s), 4326), 3857) as geom
+        )
+        SELECT * FROM (
+          SELECT 1 as priority, 0::float as area, 'point' as type, name, NULL as "natural", NULL as building, amenity, place
+          FROM planet_osm_point, search_point
+          WHERE ST_DWithin(way, search_point.geom, 20)
+          AND (name IS NOT NULL OR amenity IS NOT NULL)
+          UNION ALL
+          SELECT 2 as priority, 0::float as area, 'line' as type, name, NULL as "natural", NULL as building, NULL as amenity, NULL as place
+          FROM planet_osm_line, search_point
+          WHERE ST_DWithin(way, search_point.geom, 10)
+          AND name IS NOT NULL
+          UNION ALL
+          SELECT 3 as priority, ST_Area(way) as area, 'polygon' as type, name, "natural", building, amenity, place
+          FROM planet_osm_polygon, search_point
+          WHERE ST_Intersects(way, search_point.geom)
+          AND (name IS NOT NULL OR building IS NOT NULL OR "natural" IS NOT NULL)
+        ) as features
+        ORDER BY priority ASC, area ASC
+        LIMIT 1;
+    """,
+    'district-safety/precomputed': """
+        SELECT d.id, d.ten_xa, d.dan_so, ST_AsGeoJSON(d.geom) AS geom_geojson, st.*
+        FROM hanoi_districts d
+        LEFT JOIN district_station_stats st ON st.district_id = d.id;
+    """,
+    'district-safety': """
+        SELECT d.id, d.ten_xa, d.dan_so, ST_AsGeoJSON(d.geom) AS geom_geojson,
+          COUNT(DISTINCT s.geom) AS total_stations,
+          COUNT(DISTINCT CASE WHEN LOWER(s.category) LIKE '%%pin%%' OR LOWER(s.name) LIKE '%%pin%%' THEN s.geom END) AS battery_stations,
+          COUNT(DISTINCT CASE WHEN LOWER(s.category) NOT LIKE '%%pin%%' AND LOWER(s.name) NOT LIKE '%%pin%%' THEN s.geom END) AS charging_stations,
+          COUNT(DISTINCT CASE WHEN s.status = 'Open' OR s.status = 'Hoạt động' OR s.status = 'Đang hoạt động' OR s.status = '1' THEN s.geom END) AS open_stations,
+          COUNT(DISTINCT CASE WHEN s.status = 'Maintenance' OR s.status = 'Bảo trì' THEN s.geom END) AS maintenance_stations
+        FROM hanoi_districts d
+        LEFT JOIN charge_stations s
+          ON ST_Intersects(d.geom, ST_Transform(s.geom, ST_SRID(d.geom)))
+        GROUP BY d.id, d.ten_xa, d.dan_so, d.geom;
+    """,
+}
+
+
+def _indexed_search_sql(short_query, stations_fresh):
+    """search_index variant of /data/search (see buildIndexedSearchQuery in routes/data.ts)"""
+    match = ("s.tsv @@ to_tsquery('simple', quote_literal(q.text) || ':*')" if short_query
+             else "s.search_text LIKE '%%' || q.text || '%%'")
+    stations = '' if stations_fresh else """
+          UNION ALL
+          SELECT c.name, c.address, 'charging_station' AS type, c.lon, c.lat,
+                 similarity(search_normalize(concat_ws(' ', c.name, c.address)), q.text) AS rank
+          FROM charge_stations c, q
+          WHERE c.name ILIKE %(term)s OR c.address ILIKE %(term)s"""
+    return f"""
+        WITH q AS (SELECT search_normalize(%(q)s) AS text)
+        SELECT name, address, type, lon, lat FROM (
+          SELECT s.name, s.address, s.type, s.lon, s.lat, similarity(s.search_text, q.text) AS rank
+          FROM search_index s, q
+          WHERE {match}{'' if stations_fresh else " AND s.type <> 'charging_station'"}{stations}
+        ) matches
+        {'' if short_query else 'ORDER BY rank DESC'}
+        LIMIT 20;
+    """
+
+
+# Variants reading the generated columns from projections.py instead of reprojecting per row
+EXPLAIN_SQL.update({
+    'buffer/projected': EXPLAIN_SQL['buffer'].replace(
+        "json_build_array(ST_X(ST_Transform(way, 4326)), ST_Y(ST_Transform(way, 4326)))",
+        "json_build_array(ST_X(way_4326), ST_Y(way_4326))"),
+    'filter/projected': EXPLAIN_SQL['filter'].replace(
+        "json_build_array(ST_X(ST_Transform(way, 4326)), ST_Y(ST_Transform(way, 4326)))",
+        "json_build_array(ST_X(way_4326), ST_Y(way_4326))").replace(
+        "ST_Intersects(way, ST_Transform(ST_MakeEnvelope(%(minx)s, %(miny)s, %(maxx)s, %(maxy)s, 4326), 3857))",
+        "way_4326 && ST_MakeEnvelope(%(minx)s, %(miny)s, %(maxx)s, %(maxy)s, 4326)"),
+    'district-safety/projected': EXPLAIN_SQL['district-safety'].replace(
+        "ST_Intersects(d.geom, ST_Transform(s.geom, ST_SRID(d.geom)))", "ST_Intersects(d.geom_3857, s.geom)"),
+})
+
+EXPLAIN_SQL.update({
+    f"search/index{'/short' if short else ''}{'' if fresh else '/live-stations'}": _indexed_search_sql(short, fresh)
+    for short in (False, True) for fresh in (False, True)
+})
+
+
+class Workload:
+    """Builds request (endpoint, params) pairs from a sample of the imported data"""
+
+    def __init__(self, extent, points, amenities, terms, mix, seed=None):
+        self.extent = extent
+        self.points = points
+        self.amenities = amenities
+        self.terms = terms
+        self.endpoints = list(mix)
+        self.weights = [mix[name] for name in self.endpoints]
+        self.rng = random.Random(seed)
+
+    def click(self):
+        """(lon, lat) near a real POI most of the time, anywhere in the extent otherwise"""
+        if self.points and self.rng.random() < NEAR_POI_SHARE:
+            lon, lat = self.rng.choice(self.points)
+            dx, dy = self.rng.gauss(0, CLICK_JITTER), self.rng.gauss(0, CLICK_JITTER)
+            return (lon + dx / (111320 * math.cos(math.radians(lat))), lat + dy / 111320)
+        min_x, min_y, max_x, max_y = self.extent
+        return self.rng.uniform(min_x, max_x), self.rng.uniform(min_y, max_y)
+
+    def viewport(self):
+        """minx,miny,maxx,maxy of a VIEWPORT-sized map view at a random zoom"""
+        zoom = self.rng.choice(FILTER_ZOOMS)
+        lon, lat = self.click()
+        width = 360 / 2 ** zoom * VIEWPORT[0] / 256
+        height = 360 / 2 ** zoom * VIEWPORT[1] / 256 * math.cos(math.radians(lat))
+        return zoom, (lon - width / 2, lat - height / 2, lon + width / 2, lat + height / 2)
+
+    def request(self):
+        endpoint = self.rng.choices(self.endpoints, self.weights)[0]
+        if endpoint in ('buffer', 'score', 'identify'):
+            lon, lat = self.click()
+            params = {'lat': f"{lat:.6f}", 'lon': f"{lon:.6f}"}
+            if endpoint == 'buffer':
+                params['radius'] = str(self.rng.choice(BUFFER_RADII))
+        elif endpoint == 'search':
+            params = {'q': self.rng.choice(self.terms)}
+        elif endpoint == 'filter':
+            zoom, bbox = self.viewport()
+            types = self.rng.sample(self.amenities, min(len(self.amenities), self.rng.randint(1, 3)))
+            params = {'type': ','.join(types), 'bbox': ','.join(f"{v:.6f}" for v in bbox), '_zoom': str(zoom)}
+        else:
+            params = {}
+        return endpoint, params
+
+
+def _name_fragment(rng, name):
+    """A 3-8 character piece of one word of name, like a user typing into the search box"""
+    words = [w for w in name.split() if len(w) >= 3]
+    if not words:
+        return None
+    word = rng.choice(words)
+    length = rng.randint(3, min(8, len(word)))
+    start = rng.randint(0, len(word) - length)
+    return word[start:start + length].lower()
+
+
+def sample_workload(db_config, mix, seed=None):
+    """Workload sampled from planet_osm_point / charge_stations, or FALLBACK_* without a database"""
+    rng = random.Random(seed)
+    try:
+        conn = psycopg2.connect(**db_config)
+    except psycopg2.OperationalError as e:
+        print(f"⚠ Cannot sample the database ({e}); using the built-in London extent", file=sys.stderr)
+        return Workload(FALLBACK_EXTENT, [], FALLBACK_AMENITIES, FALLBACK_TERMS, mix, seed)
+
+    cur = conn.cursor()
+    extent, points, amenities, names = None, [], [], []
+    for table, column in (('planet_osm_point', 'way'), ('charge_stations', 'geom'), ('buildings', 'geom')):
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (table,))
+        if not cur.fetchone()[0]:
+            continue
+        cur.execute(f"""
+            SELECT ST_XMin(e), ST_YMin(e), ST_XMax(e), ST_YMax(e)
+            FROM (SELECT ST_Transform(ST_SetSRID(ST_Extent({column})::geometry,
+                         (SELECT ST_SRID({column}) FROM {table} WHERE {column} IS NOT NULL LIMIT 1)), 4326) AS e
+                  FROM {table}) t;
+        """)
+        row = cur.fetchone()
+        if row and row[0] is not None:
+            extent = row
+            break
+
+    cur.execute("SELECT to_regclass('planet_osm_point') IS NOT NULL;")
+    if cur.fetchone()[0]:
+        cur.execute("""
+            SELECT ST_X(ST_Transform(way, 4326)), ST_Y(ST_Transform(way, 4326)) FROM planet_osm_point
+            WHERE amenity IS NOT NULL ORDER BY random() LIMIT %s;
+        """, (SAMPLE_POINTS,))
+        points = cur.fetchall()
+        cur.execute("""
+            SELECT amenity FROM planet_osm_point WHERE amenity IS NOT NULL
+            GROUP BY amenity ORDER BY COUNT(*) DESC LIMIT 20;
+        """)
+        amenities = [row[0] for row in cur.fetchall()]
+        cur.execute("SELECT name FROM planet_osm_point WHERE name IS NOT NULL ORDER BY random() LIMIT %s;",
+                    (SAMPLE_NAMES,))
+        names += [row[0] for row in cur.fetchall()]
+    cur.execute("SELECT to_regclass('charge_stations') IS NOT NULL;")
+    if cur.fetchone()[0]:
+        cur.execute("SELECT name FROM charge_stations WHERE name IS NOT NULL ORDER BY random() LIMIT %s;",
+                    (SAMPLE_NAMES // 5,))
+        names += [row[0] for row in cur.fetchall()]
+    cur.close()
+    conn.close()
+
+    terms = [t for t in (_name_fragment(rng, name) for name in names) if t]
+    print(f"Sampled {len(points)} POIs, {len(amenities)} amenity types, {len(terms)} search terms", file=sys.stderr)
+    return Workload(extent or FALLBACK_EXTENT, points, amenities or FALLBACK_AMENITIES,
+                    terms or FALLBACK_TERMS, mix, seed)
+
+
+class Recorder:
+    """Per-endpoint latency samples (ms), status counts and response sizes"""
+
+    def __init__(self):
+        self.samples = {}
+        self.started = None
+        self.stopped = None
+
+    def add(self, endpoint, latency_ms, status, size, params):
+        self.samples.setdefault(endpoint, []).append((latency_ms, status, size, params))
+
+    def summary(self):
+        elapsed = max((self.stopped or time.perf_counter()) - self.started, 1e-9)
+        report = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            latencies = sorted(s[0] for s in samples)
+            statuses = {}
+            for s in samples:
+                statuses[str(s[1])] = statuses.get(str(s[1]), 0) + 1
+            histogram = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+            for latency in latencies:
+                histogram[bisect.bisect_left(HISTOGRAM_BOUNDS_MS, latency)] += 1
+            report[endpoint] = {
+                'requests': len(samples),
+                'errors': sum(1 for s in samples if not isinstance(s[1], int) or s[1] >= 400),
+                'rps': round(len(samples) / elapsed, 2),
+                'mean_ms': round(sum(latencies) / len(latencies), 2),
+                **{f"p{p}_ms": round(percentile(latencies, p), 2) for p in PERCENTILES},
+                'max_ms': round(latencies[-1], 2),
+                'mean_bytes': round(sum(s[2] for s in samples) / len(samples)),
+                'statuses': statuses,
+                'histogram_ms': {f"<={bound}": count for bound, count in zip(HISTOGRAM_BOUNDS_MS, histogram)}
+                                | {f">{HISTOGRAM_BOUNDS_MS[-1]}": histogram[-1]},
+            }
+        return report
+
+    def slowest(self, endpoint, n):
+        return sorted(self.samples.get(endpoint, []), key=lambda s: s[0], reverse=True)[:n]
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+async def _client(session, base_url, workload, recorder, warmup_until, deadline):
+    while time.perf_counter() < deadline:
+        endpoint, params = workload.request()
+        query = {k: v for k, v in params.items() if not k.startswith('_')}
+        start = time.perf_counter()
+        try:
+            async with session.get(base_url + ENDPOINTS[endpoint], params=query) as resp:
+                body = await resp.read()
+                status, size = resp.status, len(body)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            status, size = type(e).__name__, 0
+        latency_ms = (time.perf_counter() - start) * 1000
+        if start >= warmup_until:
+            recorder.add(endpoint, latency_ms, status, size, params)
+
+
+async def run_load(base_url, workload, concurrency=CONCURRENCY, duration=DURATION, warmup=WARMUP):
+    """Closed-loop load: concurrency clients send back-to-back requests for warmup + duration seconds"""
+    recorder = Recorder()
+    timeout = aiohttp.ClientTimeout(total=TIMEOUT)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        now = time.perf_counter()
+        recorder.started = now + warmup
+        deadline = recorder.started + duration
+        await asyncio.gather(*(_client(session, base_url.rstrip('/'), workload, recorder, recorder.started, deadline)
+                               for _ in range(concurrency)))
+        recorder.stopped = time.perf_counter()
+    return recorder
+
+
+def _explain_params(endpoint, params):
+    if endpoint == 'search':
+        return {'q': params['q'], 'term': f"%{params['q']}%"}
+    if endpoint == 'filter':
+        minx, miny, maxx, maxy = (float(v) for v in params['bbox'].split(','))
+        return {'types': [t.strip().lower() for t in params['type'].split(',')],
+                'minx': minx, 'miny': miny, 'maxx': maxx, 'maxy': maxy}
+    if endpoint in ('buffer', 'score', 'identify'):
+        return {'lon': float(params['lon']), 'lat': float(params['lat']),
+                'radius': float(params.get('radius', 0))}
+    return {}
+
+
+def _has_column(cur, table, column):
+    cur.execute("""
+        SELECT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = %s);
+    """, (table, column))
+    return cur.fetchone()[0]
+
+
+def _endpoint_sql(cur, endpoint, params):
+    """The statement the endpoint actually runs for these params (grid / precomputed tables when used)"""
+    if endpoint in ('buffer', 'filter') and _has_column(cur, 'planet_osm_point', 'way_4326'):
+        return f"{endpoint}/projected"
+    if endpoint == 'score':
+        cur.execute("SELECT to_regclass('amenity_grid_meta') IS NOT NULL;")
+        if cur.fetchone()[0]:
+            cur.execute(EXPLAIN_SQL['score/grid'], params)
+            if cur.fetchone():
+                return 'score/grid'
+    if endpoint == 'search':
+        cur.execute("SELECT to_regclass('search_index_meta') IS NOT NULL;")
+        if cur.fetchone()[0]:
+            cur.execute("""
+                SELECT (m.stations_count = c.total AND m.stations_updated_at IS NOT DISTINCT FROM c.latest)
+                FROM search_index_meta m,
+                     (SELECT COUNT(*) AS total, MAX(last_updated) AS latest FROM charge_stations) c;
+            """)
+            row = cur.fetchone()
+            short = len(params['q'].strip()) < 3
+            return f"search/index{'/short' if short else ''}{'' if row and row[0] else '/live-stations'}"
+    if endpoint == 'district-safety':
+        cur.execute("SELECT to_regclass('district_station_stats_meta') IS NOT NULL;")
+        if cur.fetchone()[0]:
+            cur.execute("""
+                SELECT (m.source_count = c.total AND m.source_updated_at IS NOT DISTINCT FROM c.latest)
+                FROM district_station_stats_meta m,
+                     (SELECT COUNT(*) AS total, MAX(last_updated) AS latest FROM charge_stations) c;
+            """)
+            row = cur.fetchone()
+            if row and row[0]:
+                return 'district-safety/precomputed'
+        if _has_column(cur, 'hanoi_districts', 'geom_3857'):
+            return 'district-safety/projected'
+    return endpoint
+
+
+def _plan_summary(plan):
+    root = plan['Plan']
+    return {
+        'execution_ms': plan.get('Execution Time'),
+        'planning_ms': plan.get('Planning Time'),
+        'shared_hit_blocks': root.get('Shared Hit Blocks'),
+        'shared_read_blocks': root.get('Shared Read Blocks'),
+        'root_node': root.get('Node Type'),
+    }
+
+
+def capture_plans(db_config, recorder, n):
+    """EXPLAIN (ANALYZE, BUFFERS) the n slowest requests of every endpoint"""
+    conn = psycopg2.connect(**db_config)
+    cur = conn.cursor()
+    plans = {}
+    for endpoint in sorted(recorder.samples):
+        for latency_ms, status, _, params in recorder.slowest(endpoint, n):
+            sql_params = _explain_params(endpoint, params)
+            try:
+                variant = _endpoint_sql(cur, endpoint, sql_params)
+                cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + EXPLAIN_SQL[variant], sql_params)
+                plan = cur.fetchone()[0][0]
+                entry = {'latency_ms': round(latency_ms, 2), 'status': status, 'params': params,
+                         'query': variant, **_plan_summary(plan), 'plan': plan}
+            except psycopg2.Error as e:
+                entry = {'latency_ms': round(latency_ms, 2), 'status': status, 'params': params,
+                         'error': str(e).strip()}
+            conn.rollback()
+            plans.setdefault(endpoint, []).append(entry)
+    cur.close()
+    conn.close()
+    return plans
+
+
+def print_report(report, plans=None, out=sys.stderr):
+    header = f"{'endpoint':16} {'reqs':>7} {'rps':>8} {'err':>5} " + ' '.join(
+        f"{'p' + str(p):>8}" for p in PERCENTILES) + f" {'max':>8}  (ms)"
+    print(header, file=out)
+    for endpoint, stats in report.items():
+        print(f"{endpoint:16} {stats['requests']:>7} {stats['rps']:>8.1f} {stats['errors']:>5} "
+              + ' '.join(f"{stats[f'p{p}_ms']:>8.1f}" for p in PERCENTILES)
+              + f" {stats['max_ms']:>8.1f}", file=out)
+    for endpoint, entries in (plans or {}).items():
+        for entry in entries:
+            if 'error' in entry:
+                print(f"  {endpoint}: {entry['latency_ms']:.0f} ms -> EXPLAIN failed: {entry['error']}", file=out)
+            else:
+                print(f"  {endpoint}: {entry['latency_ms']:.0f} ms over HTTP, {entry['execution_ms']:.1f} ms in "
+                      f"{entry['query']} ({entry['root_node']}, shared hit {entry['shared_hit_blocks']} / "
+                      f"read {entry['shared_read_blocks']})", file=out)
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"unknown endpoint '{name}' (choose from {', '.join(ENDPOINTS)})")
+        mix[name] = float(weight or 1)
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Concurrent latency test for the spatial API endpoints")
+    parser.add_argument('--url', default=BASE_URL, help="Backend base URL")
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY, help="Concurrent clients")
+    parser.add_argument('--duration', type=float, default=DURATION, help="Measured seconds")
+    parser.add_argument('--warmup', type=float, default=WARMUP, help="Unrecorded seconds before measuring")
+    parser.add_argument('--mix', help="endpoint=weight,... (default: " +
+                        ','.join(f"{k}={v}" for k, v in DEFAULT_MIX.items()) + ")")
+    parser.add_argument('--explain', type=int, default=0, metavar='N',
+                        help="EXPLAIN (ANALYZE, BUFFERS) the N slowest requests per endpoint")
+    parser.add_argument('--seed', type=int, help="Seed for a reproducible request sequence")
+    parser.add_argument('--output', help="Write the JSON report here")
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix) if args.mix else DEFAULT_MIX
+    except ValueError as e:
+        parser.error(str(e))
+
+    from import_osm_data import DB_CONFIG
+
+    workload = sample_workload(DB_CONFIG, mix, args.seed)
+    print(f"{args.concurrency} clients x {args.duration:g}s against {args.url} "
+          f"(+{args.warmup:g}s warm-up)", file=sys.stderr)
+    recorder = asyncio.run(run_load(args.url, workload, args.concurrency, args.duration, args.warmup))
+    report = recorder.summary()
+    plans = capture_plans(DB_CONFIG, recorder, args.explain) if args.explain else None
+    print_report(report, plans)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'url': args.url,
+                'concurrency': args.concurrency,
+                'duration_s': args.duration,
+                'mix': mix,
+                'extent': list(workload.extent),
+                'endpoints': report,
+                'explain': plans or {},
+            }, f, indent=2, ensure_ascii=False, default=str)
+        print(f"Report written to {args.output}", file=sys.stderr)
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Tiled Overpass fetcher for city-scale building pulls
+The bbox is cut into CELL_SIZE cells, one Overpass query each. A cell whose
+query times out (or runs out of memory) is split into its four quadrants and
+queued again, down to MAX_DEPTH, so dense areas end up with small cells and
+empty ones with large cells.
+
+- queries run on a small thread pool under a politeness limit: at most
+  `concurrency` in flight, starts spaced by MIN_INTERVAL, everyone backs off
+  after a 429 (honouring Retry-After)
+- every raw response is cached on disk under the hash of its query, so
+  re-runs (and retries after a failure half-way) hit Overpass only for cells
+  not fetched yet; "timed out" answers are cached too, so a re-run goes
+  straight to the smaller cells
+- a way crossing cell boundaries is returned by every cell it touches
+  (`>;` pulls all of its nodes), so each cell is self-contained and the
+  duplicates are dropped by way id
+
+Only one cell's response is in memory at a time per worker; features are
+yielded as cells complete. Like import_from_overpass, building ways only.
+
+Usage:
+  python overpass_tiles.py S,W,N,E [--output buildings_overpass.geojsonl] [--concurrency 2]
+                                   [--cell-size 0.02] [--cache-dir .overpass_cache]
+                                   [--url http://localhost:8080/api/interpreter] [--refresh]
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import math
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+OVERPASS_URL = os.environ.get('OVERPASS_URL', 'https://overpass-api.de/api/interpreter')
+USER_AGENT = 'webgis-osm-import (tiled building fetch)'
+CELL_SIZE = 0.02  # degrees, starting cell edge (~2 km)
+MAX_DEPTH = 6  # splits per cell: 0.02° / 2**6 ≈ 35 m
+QUERY_TIMEOUT = 60  # [timeout:] per cell; short, so slow cells are split early instead of waited on
+CONCURRENCY = 2  # overpass-api.de gives each IP about two slots
+MIN_INTERVAL = 1.0  # seconds between request starts
+MAX_RETRIES = 5  # per cell, for 429 / 5xx / network errors
+RETRY_WAIT = 10  # seconds, multiplied by the attempt number
+CACHE_DIR = '.overpass_cache'
+
+BUILDING_QUERY = """[out:json][timeout:{timeout}];
+(
+  way["building"]({bbox});
+  relation["building"]({bbox});
+);
+out body;
+>;
+out skel qt;
+"""
+
+# 'remark' of a 200 response whose query was aborted: the cell is too big
+TOO_LARGE_REMARKS = ('timed out', 'out of memory')
+
+
+class OverpassError(Exception):
+    pass
+
+
+class CellTooLarge(Exception):
+    """The cell's query timed out or ran out of memory; split it"""
+
+
+def building_query(cell, timeout=QUERY_TIMEOUT):
+    south, west, north, east = cell
+    # Fixed precision so the same cell always hashes to the same cache entry
+    return BUILDING_QUERY.format(timeout=timeout, bbox=f"{south:.7f},{west:.7f},{north:.7f},{east:.7f}")
+
+
+def grid(bbox, cell_size=CELL_SIZE):
+    """Cut (south, west, north, east) into cells of at most cell_size degrees"""
+    south, west, north, east = bbox
+    rows = max(1, math.ceil(round((north - south) / cell_size, 9)))
+    cols = max(1, math.ceil(round((east - west) / cell_size, 9)))
+    lats = [south + (north - south) * i / rows for i in range(rows + 1)]
+    lons = [west + (east - west) * j / cols for j in range(cols + 1)]
+    return [(lats[i], lons[j], lats[i + 1], lons[j + 1]) for i in range(rows) for j in range(cols)]
+
+
+def quadrants(cell):
+    south, west, north, east = cell
+    mid_lat, mid_lon = (south + north) / 2, (west + east) / 2
+    return [(south, west, mid_lat, mid_lon), (south, mid_lon, mid_lat, east),
+            (mid_lat, west, north, mid_lon), (mid_lat, mid_lon, north, east)]
+
+
+class ResponseCache:
+    """Raw Overpass responses, gzipped, keyed by the SHA-256 of the query"""
+
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = directory
+
+    def _path(self, query):
+        key = hashlib.sha256(query.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key[:2], key + '.json.gz')
+
+    def load(self, query):
+        try:
+            with gzip.open(self._path(query), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def save(self, query, body):
+        path = self._path(query)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp, 'wb') as f:
+            f.write(body)
+        os.replace(tmp, path)  # readers never see a half-written entry
+
+
+class Politeness:
+    """Spaces request starts by min_interval; pause() holds every worker back (429 / 5xx)"""
+
+    def __init__(self, min_interval=MIN_INTERVAL):
+        self.min_interval = min_interval
+        self.next_start = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.min_interval
+        time.sleep(start - now)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.next_start = max(self.next_start, time.monotonic() + seconds)
+
+
+def _retry_after(exc, attempt):
+    try:
+        return float(exc.headers.get('Retry-After'))
+    except (TypeError, ValueError, AttributeError):
+        return RETRY_WAIT * attempt
+
+
+class TileFetcher:
+    """Fetches one cell at a time (thread-safe); see fetch_buildings for the quadtree walk"""
+
+    def __init__(self, url=OVERPASS_URL, cache_dir=CACHE_DIR, timeout=QUERY_TIMEOUT,
+                 min_interval=MIN_INTERVAL, refresh=False):
+        self.url = url
+        self.cache = ResponseCache(cache_dir)
+        self.timeout = timeout
+        self.politeness = Politeness(min_interval)
+        self.refresh = refresh
+
+    def _post(self, query):
+        data = urllib.parse.urlencode({'data': query}).encode('utf-8')
+        for attempt in range(1, MAX_RETRIES + 1):
+            self.politeness.wait()
+            req = urllib.request.Request(self.url, data=data, headers={'User-Agent': USER_AGENT})
+            try:
+                # Client timeout a little above the server's, so the server gets to say "timed out" first
+                with urllib.request.urlopen(req, timeout=self.timeout + 30) as resp:
+                    return resp.read()
+            except urllib.error.HTTPError as exc:
+                if exc.code != 429 and exc.code < 500:
+                    raise OverpassError(f"HTTP {exc.code}: {exc.read()[:500].decode('utf-8', 'replace')}")
+                if exc.code == 504 and attempt == MAX_RETRIES:
+                    raise CellTooLarge(f"HTTP 504 after {attempt} attempts")
+                wait_for = _retry_after(exc, attempt)
+                self.politeness.pause(wait_for)
+                print(f"⚠ Overpass HTTP {exc.code}; backing off {wait_for:.0f}s "
+                      f"(attempt {attempt}/{MAX_RETRIES})")
+            except TimeoutError as exc:
+                raise CellTooLarge(f"no answer within {self.timeout + 30}s") from exc
+            except (urllib.error.URLError, OSError) as exc:
+                if isinstance(getattr(exc, 'reason', None), TimeoutError):
+                    raise CellTooLarge(f"no answer within {self.timeout + 30}s") from exc
+                if attempt == MAX_RETRIES:
+                    raise OverpassError(f"{exc} (after {attempt} attempts)")
+                self.politeness.pause(RETRY_WAIT * attempt)
+        raise OverpassError(f"Overpass still refusing after {MAX_RETRIES} attempts")
+
+    def fetch(self, cell):
+        """Return ([(way_id, feature), ...], from_cache) for one cell; raises CellTooLarge"""
+        query = building_query(cell, self.timeout)
+        body = None if self.refresh else self.cache.load(query)
+        cached = body is not None
+        if not cached:
+            body = self._post(query)
+        try:
+            data = json.loads(body)
+        except ValueError as exc:
+            raise OverpassError(f"Invalid JSON for cell {cell}: {exc}")
+        if not cached:
+            self.cache.save(query, body)
+        remark = data.get('remark') or ''
+        if any(marker in remark for marker in TOO_LARGE_REMARKS):
+            raise CellTooLarge(remark)
+        return list(_building_features(data.get('elements', []))), cached
+
+
+def _building_features(elements):
+    """(way_id, GeoJSON feature) for every building way whose nodes are all present"""
+    nodes = {e['id']: (e['lon'], e['lat']) for e in elements if e['type'] == 'node'}
+    for element in elements:
+        tags = element.get('tags') or {}
+        if element['type'] != 'way' or 'building' not in tags:
+            continue
+        refs = element.get('nodes') or []
+        if not refs or any(ref not in nodes for ref in refs):
+            continue
+        yield element['id'], {
+            'type': 'Feature',
+            'id': f"way/{element['id']}",
+            'properties': tags,
+            'geometry': {'type': 'Polygon', 'coordinates': [[nodes[ref] for ref in refs]]},
+        }
+
+
+def fetch_buildings(bbox, concurrency=CONCURRENCY, cell_size=CELL_SIZE, stats=None, **fetcher_options):
+    """
+    Yield GeoJSON features for the building ways in bbox (south, west, north, east), each way once.
+    fetcher_options go to TileFetcher (url, cache_dir, timeout, min_interval, refresh).
+    stats, if given, is filled with cells / cached / split / duplicates counts.
+    Raises OverpassError when a cell cannot be fetched even at MAX_DEPTH.
+    """
+    fetcher = TileFetcher(**fetcher_options)
+    stats = stats if stats is not None else {}
+    stats.update(cells=0, cached=0, split=0, duplicates=0, buildings=0)
+    seen = set()
+    start = time.time()
+
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    pending = {pool.submit(fetcher.fetch, cell): (cell, 0) for cell in grid(bbox, cell_size)}
+    print(f"Fetching {len(pending)} Overpass cells with {concurrency} concurrent requests...")
+    try:
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                cell, depth = pending.pop(future)
+                try:
+                    features, cached = future.result()
+                except CellTooLarge as exc:
+                    if depth >= MAX_DEPTH:
+                        raise OverpassError(f"Cell {cell} still too large after {depth} splits: {exc}")
+                    stats['split'] += 1
+                    for child in quadrants(cell):
+                        pending[pool.submit(fetcher.fetch, child)] = (child, depth + 1)
+                    continue
+                stats['cells'] += 1
+                stats['cached'] += cached
+                for way_id, feature in features:
+                    if way_id in seen:
+                        stats['duplicates'] += 1
+                        continue
+                    seen.add(way_id)
+                    stats['buildings'] += 1
+                    yield feature
+    finally:
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=True)
+
+    print(f"Overpass: {stats['cells']} cells ({stats['cached']} from cache, {stats['split']} split), "
+          f"{stats['buildings']} buildings, {stats['duplicates']} cross-cell duplicates dropped "
+          f"in {time.time() - start:.1f}s")
+
+
+def parse_bbox(text):
+    """'S,W,N,E' -> (south, west, north, east)"""
+    try:
+        south, west, north, east = (float(v) for v in text.split(','))
+    except ValueError:
+        raise ValueError(f"bbox must be S,W,N,E, got {text!r}")
+    if not (south < north and west < east):
+        raise ValueError(f"bbox {text!r} is empty (expected S < N and W < E)")
+    return south, west, north, east
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fetch OSM buildings from Overpass in adaptive tiles')
+    parser.add_argument('bbox', help='S,W,N,E')
+    parser.add_argument('--output', default='buildings_overpass.geojsonl', help='GeoJSONSeq file')
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY)
+    parser.add_argument('--cell-size', type=float, default=CELL_SIZE, help='starting cell edge in degrees')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--url', default=OVERPASS_URL)
+    parser.add_argument('--refresh', action='store_true', help='ignore cached responses (still updates the cache)')
+    args = parser.parse_args()
+
+    try:
+        bbox = parse_bbox(args.bbox)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # Written to a temp file first so a failed run never leaves a partial output behind
+    tmp = args.output + '.part'
+    try:
+        with open(tmp, 'w', encoding='utf-8') as out:
+            for feature in fetch_buildings(bbox, args.concurrency, args.cell_size, url=args.url,
+                                           cache_dir=args.cache_dir, refresh=args.refresh):
+                out.write(json.dumps(feature, ensure_ascii=False) + '\n')
+    except OverpassError as e:
+        print(f"Error fetching from Overpass: {e}")
+        print("Cells fetched so far are cached; re-run to resume")
+        sys.exit(1)
+    os.replace(tmp, args.output)
+    print(f"✓ Wrote {args.output} (load it with: python import_osm_data.py geojson {args.output} --bulk)")
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Multi-process building loader
+Each worker parses/encodes its share of the input and COPYs it into its own
+partition table over its own connection, then validates that partition (see
+validate_geometry.py); the partitions are then merged into a single staging
+table and swapped in place of buildings (or of one region's partition of it,
+see regions.py).
+"""
+
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+import psycopg2
+
+from bulk_load import (
+    BUILDING_COLUMNS, apply_upsert, copy_rows, create_incoming_table, create_staging_table,
+    ensure_building_columns, geojson_rows, print_upsert_summary, staging_indexes_sql, swap_in_staging,
+    with_content_hash,
+)
+from dirty_tiles import DIRTY_MAX_ZOOM, DIRTY_MIN_ZOOM
+from geojson_stream import batched, is_geojson_seq, iter_features, iter_features_in_range, split_byte_ranges
+from hilbert import HILBERT_FUNCTION_DDL, hilbert_order_by, is_hilbert_clustered, record_order_sql
+from instrumentation import stage
+from regions import (
+    RegionError, attach_partition, check_region, is_partitioned, record_region, region_columns_sql, region_target,
+    staging_name,
+)
+from validate_geometry import QUARANTINE_DDL, print_validation_summary, record_rejects, validate_table
+
+RANGES_PER_WORKER = 4  # more ranges than workers keeps the pool balanced
+FEATURE_BATCH_SIZE = 5000  # features per task when the input is not GeoJSONSeq
+
+# Per-process state, set up by _init_worker
+_worker = {}
+
+
+def _init_worker(db_config, partitions, target):
+    """Give each pool process its own connection and partition table"""
+    _worker['conn'] = psycopg2.connect(**db_config)
+    _worker['table'] = partitions.get()
+    _worker['target'] = target
+
+
+def _copy_features(features):
+    """Returns (rows loaded, rows rejected while encoding)"""
+    cur = _worker['conn'].cursor()
+    rejects = []
+    count = copy_rows(cur, _worker['table'], BUILDING_COLUMNS, with_content_hash(geojson_rows(features, rejects)))
+    rejected = record_rejects(cur, rejects, _worker['target'])
+    _worker['conn'].commit()
+    cur.close()
+    return count, rejected
+
+
+def _load_byte_range(task):
+    path, start, end = task
+    return _copy_features(iter_features_in_range(path, start, end))
+
+
+def _load_feature_batch(features):
+    return _copy_features(features)
+
+
+def _imap_bounded(pool, func, tasks, limit):
+    """
+    pool.imap_unordered(func, tasks) that pulls a task from the iterator only when
+    fewer than limit are in flight. imap_unordered's feeder thread drains the whole
+    iterator up front, which would parse and pickle an entire FeatureCollection.
+    """
+    slots = threading.BoundedSemaphore(limit)
+    done = queue.Queue()
+
+    def finished(result):
+        slots.release()
+        done.put((True, result))
+
+    def failed(exc):
+        slots.release()
+        done.put((False, exc))
+
+    pending = 0
+    for task in tasks:
+        slots.acquire()
+        pool.apply_async(func, (task,), callback=finished, error_callback=failed)
+        pending += 1
+        while not done.empty():
+            ok, result = done.get()
+            pending -= 1
+            if not ok:
+                raise result
+            yield result
+    while pending:
+        ok, result = done.get()
+        pending -= 1
+        if not ok:
+            raise result
+        yield result
+
+
+def _validate_partition(name):
+    """Repair / quarantine invalid geometries in one partition (any worker can take any partition)"""
+    cur = _worker['conn'].cursor()
+    counts = validate_table(cur, name, _worker['target'])
+    _worker['conn'].commit()
+    cur.close()
+    return counts
+
+
+def _create_partitions(conn, target, workers, region=None):
+    cur = conn.cursor()
+    ensure_building_columns(cur, target)
+    # Checked before any work is done: the swap at the end would replace every region
+    if region is None and is_partitioned(cur, target):
+        cur.close()
+        raise RegionError(f"{target} is partitioned by region: pass --region")
+    # Created up front so concurrent workers never race on CREATE TABLE IF NOT EXISTS
+    cur.execute(QUARANTINE_DDL)
+    names = []
+    for i in range(workers):
+        name = f"{target}_staging_p{i}"
+        cur.execute(f"DROP TABLE IF EXISTS {name};")
+        cur.execute(f"""
+            CREATE UNLOGGED TABLE {name} AS
+            SELECT {', '.join(BUILDING_COLUMNS)} FROM {target} WITH NO DATA;
+        """)
+        names.append(name)
+    conn.commit()
+    cur.close()
+    return names
+
+
+def _drop_partitions(conn, names):
+    cur = conn.cursor()
+    for name in names:
+        cur.execute(f"DROP TABLE IF EXISTS {name};")
+    conn.commit()
+    cur.close()
+
+
+def parallel_load_geojson(geojson_file, db_config, workers, target='buildings', upsert=False, hilbert=False,
+                          region=None):
+    """
+    Load a GeoJSON file into target with a pool of worker processes.
+    GeoJSONSeq input is split into byte ranges that workers read directly;
+    a FeatureCollection is streamed by this process and handed out in batches.
+    With upsert=True the merged rows are diffed into target instead of replacing it.
+    hilbert=True merges the partitions in Hilbert order (see hilbert.py).
+    region='london' loads into target's london partition only (see regions.py).
+    Returns the number of rows loaded.
+    """
+    start = time.time()
+    conn = psycopg2.connect(**db_config)
+    partitions = _create_partitions(conn, target, workers, region)
+
+    try:
+        # Each worker takes one partition name off the queue; the manager process goes with the pool
+        with multiprocessing.Manager() as manager:
+            partition_queue = manager.Queue()
+            for name in partitions:
+                partition_queue.put(name)
+            with multiprocessing.Pool(workers, initializer=_init_worker,
+                                      initargs=(db_config, partition_queue, target)) as pool:
+                if is_geojson_seq(geojson_file):
+                    ranges = split_byte_ranges(geojson_file, workers * RANGES_PER_WORKER)
+                    tasks = [(geojson_file, a, b) for a, b in ranges]
+                    print(f"Loading {len(tasks)} byte ranges with {workers} workers...")
+                    results = pool.imap_unordered(_load_byte_range, tasks)
+                else:
+                    print(f"Loading feature batches with {workers} workers (GeoJSONSeq input splits better)...")
+                    batches = batched(iter_features(geojson_file), FEATURE_BATCH_SIZE)
+                    results = _imap_bounded(pool, _load_feature_batch, batches, workers * 2)
+
+                # Worker CPU time only shows up in children_cpu_s once the pool has exited
+                count = rejected = 0
+                with stage('parallel_copy') as st:
+                    for loaded, rejected_early in results:
+                        count += loaded
+                        rejected += rejected_early
+                    st.add(rows_in=count + rejected, rows_out=count, bytes_read=os.path.getsize(geojson_file))
+                    st.extra['workers'] = workers
+
+                # One set-based pass per partition, in parallel, before anything is indexed
+                validation = {'repaired': 0, 'rejected': rejected}
+                with stage('validate') as st:
+                    st.add(rows_in=count)
+                    for counts in pool.imap_unordered(_validate_partition, partitions):
+                        validation['repaired'] += counts['repaired']
+                        validation['rejected'] += counts['rejected']
+                        count -= counts['rejected']
+                    st.add(rows_out=count)
+        loaded_at = time.time()
+        print_validation_summary(validation)
+
+        # Single merge of all partitions, then the usual index + swap (or diff)
+        columns = ', '.join(BUILDING_COLUMNS)
+        union = ' UNION ALL '.join(f"SELECT {columns} FROM {name}" for name in partitions)
+        cur = conn.cursor()
+        if upsert:
+            table = region_target(cur, target, region)
+            incoming = create_incoming_table(cur, table)
+            with stage('merge') as st:
+                cur.execute(f"INSERT INTO {incoming} ({columns}) {union};")
+                st.add(rows_out=cur.rowcount)
+            with stage('diff'):
+                counts = apply_upsert(cur, incoming, table, dirty_zooms=(DIRTY_MIN_ZOOM, DIRTY_MAX_ZOOM),
+                                      validate=False, hilbert=hilbert or is_hilbert_clustered(cur, table))
+                if region:
+                    record_region(cur, target, region)
+            counts['unchanged'] = max(0, count - counts['inserted'] - counts['updated'])
+            print_upsert_summary(counts, time.time() - loaded_at)
+        else:
+            if region:
+                staging = create_staging_table(cur, target, staging_name(target, check_region(region)))
+                cur.execute(region_columns_sql(staging, region))
+            else:
+                staging = create_staging_table(cur, target)
+            with stage('merge') as st:
+                if hilbert:
+                    # The merge is a full pass anyway: sorting it here saves a CLUSTER rewrite
+                    cur.execute(HILBERT_FUNCTION_DDL)
+                    cur.execute(f"INSERT INTO {staging} ({columns}) SELECT {columns} FROM ({union}) u "
+                                f"{hilbert_order_by()};")
+                else:
+                    cur.execute(f"INSERT INTO {staging} ({columns}) {union};")
+                st.add(rows_out=cur.rowcount)
+            with stage('index_swap'):
+                if hilbert:
+                    cur.execute(record_order_sql(staging))
+                if region:
+                    cur.execute(staging_indexes_sql(staging, 'id, region'))
+                    attach_partition(cur, target, region, staging)
+                else:
+                    swap_in_staging(cur, staging, target, hilbert)
+        conn.commit()
+        cur.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        _drop_partitions(conn, partitions)
+        conn.close()
+
+    elapsed = max(time.time() - start, 1e-9)
+    load_elapsed = max(loaded_at - start, 1e-9)
+    print(f"Parallel COPY: {count} rows in {load_elapsed:.1f}s ({count / load_elapsed:,.0f} rows/sec)")
+    print(f"Total incl. merge + index + swap: {elapsed:.1f}s ({count / elapsed:,.0f} rows/sec)")
+    return count
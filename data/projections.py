@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Pre-projected geometry columns for the hot API queries
+osm2pgsql stores planet_osm_* in EPSG:3857 while the API answers in EPSG:4326,
+and hanoi_districts is in 4326 while charge_stations is in 3857, so the routes
+used to reproject every row they touched. This adds STORED generated columns
+holding the other projection, each with its own GIST index; PostGIS keeps them
+in step on every INSERT/UPDATE (osm2pgsql --append, apply_osc.py, ...).
+
+buildings gets geom_3857 and centroid from bulk_load.building_columns_ddl,
+which every building importer already runs.
+
+osm2pgsql -c recreates planet_osm_*, so run this again after each full import
+(import_with_osm2pgsql.ps1 does).
+
+Usage:
+  python projections.py
+"""
+
+import sys
+import time
+
+import psycopg2
+
+from bulk_load import ensure_building_columns
+from import_osm_data import DB_CONFIG
+
+# table -> [(column, geometry type, expression)]
+PROJECTED_COLUMNS = {
+    'planet_osm_point': [('way_4326', 'Point, 4326', 'ST_Transform(way, 4326)')],
+    'hanoi_districts': [('geom_3857', 'Geometry, 3857', 'ST_Transform(geom, 3857)')],
+}
+
+
+def _table_exists(cur, table):
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (table,))
+    return cur.fetchone()[0]
+
+
+def projected_columns_ddl(table, source=None):
+    """SQL adding table's (or source's, for a table built to become its partition) generated columns and indexes"""
+    columns = PROJECTED_COLUMNS[source or table]
+    adds = ',\n'.join(f"ADD COLUMN IF NOT EXISTS {column} GEOMETRY({geom_type}) "
+                      f"GENERATED ALWAYS AS ({expression}) STORED"
+                      for column, geom_type, expression in columns)
+    indexes = '\n'.join(f"CREATE INDEX IF NOT EXISTS {table}_{column}_idx ON {table} USING GIST ({column});"
+                        for column, _, _ in columns)
+    return f"ALTER TABLE {table}\n{adds};\n{indexes}\nANALYZE {table};"
+
+
+def add_projected_columns(conn):
+    """Add the generated columns to every existing table; returns the tables touched"""
+    cur = conn.cursor()
+    done = []
+    if _table_exists(cur, 'buildings'):
+        ensure_building_columns(cur)
+        done.append('buildings')
+    for table in PROJECTED_COLUMNS:
+        if not _table_exists(cur, table):
+            print(f"{table} not found, skipping")
+            continue
+        start = time.time()
+        cur.execute(projected_columns_ddl(table))
+        conn.commit()
+        done.append(table)
+        print(f"✓ {table}: {', '.join(c for c, _, _ in PROJECTED_COLUMNS[table])} in {time.time() - start:.1f}s")
+    conn.commit()
+    cur.close()
+    return done
+
+
+if __name__ == '__main__':
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        add_projected_columns(conn)
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"Error adding projected columns: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Region partitions of buildings and the planet_osm_* tables
+Every city lives in its own LIST (region) partition, e.g. buildings_london and
+planet_osm_point_hanoi. An import builds the new partition offline as a plain
+table (COPY, validation, indexes, CHECK (region = ...)) and only then swaps it
+in: DETACH + DROP of that region's old partition and ATTACH of the new one is a
+catalog change, so other regions are never rewritten and the parent is only
+locked for the moment it takes to commit. The CHECK lets ATTACH skip its
+validation scan, and indexes matching the parent's are adopted, not rebuilt.
+
+import_regions records each partition's row count and lon/lat bounds; the API
+prunes to the regions whose bounds meet the viewport.
+
+The logic lives in SQL functions (REGIONS_DDL, read from the migration
+backend/sql/20261018_region_partitions.sql) so psql-driven importers can call
+them too:
+  region_attach(parent, region, staging)  swap staging in as parent_region
+  region_ensure(parent, region)           parent_region, created empty if needed
+  region_partition(parent, region)        convert an unpartitioned table in place
+  region_record(parent, region)           refresh import_regions
+
+Usage:
+  python regions.py                               # list regions
+  python regions.py partition <table ...> --region NAME
+                                                  # existing rows become region NAME
+  python regions.py attach-osm <region> [--prefix osm_<region>]
+                                                  # attach osm2pgsql --prefix tables
+"""
+
+import os
+import re
+import sys
+
+REGION_PATTERN = re.compile(r'^[a-z][a-z0-9_]{0,23}$')  # short enough for parent_region_staging_..._idx names
+REGIONS_TABLE = 'import_regions'
+OSM_KINDS = ('point', 'line', 'polygon', 'roads')
+OSM_MIDDLE = ('nodes', 'ways', 'rels')
+
+# The migration is the single copy of the region DDL; running it again is a no-op
+# (CREATE IF NOT EXISTS / CREATE OR REPLACE)
+REGIONS_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'sql',
+                           '20261018_region_partitions.sql')
+with open(REGIONS_SQL, encoding='utf-8') as f:
+    REGIONS_DDL = f.read()
+
+
+class RegionError(Exception):
+    """Bad region name, or a partitioned table written without one"""
+
+
+def check_region(region):
+    """Return region if it is usable in a table name, else raise RegionError"""
+    if not REGION_PATTERN.match(region or ''):
+        raise RegionError(f"Invalid region {region!r}: use lowercase letters, digits and _ (max 24)")
+    return region
+
+
+def partition_name(parent, region):
+    return f"{parent}_{region}"
+
+
+def staging_name(parent, region):
+    return f"{parent}_{region}_staging"
+
+
+def osm_tables(region=None):
+    """
+    Tables apply_osc.py reads and writes for a region: the planet_osm_* partitions,
+    and the osm2pgsql middle tables of its --prefix osm_<region> import.
+    """
+    tables = {f"planet_osm_{kind}": f"planet_osm_{kind}" for kind in OSM_KINDS + OSM_MIDDLE}
+    tables['buildings'] = 'buildings'
+    if region:
+        check_region(region)
+        tables.update({f"planet_osm_{kind}": partition_name(f"planet_osm_{kind}", region) for kind in OSM_KINDS})
+        tables.update({f"planet_osm_{kind}": f"osm_{region}_{kind}" for kind in OSM_MIDDLE})
+        tables['buildings'] = partition_name('buildings', region)
+    return tables
+
+
+def region_columns_sql(table, region):
+    """SQL giving an offline-built table the region column, default and CHECK of its partition"""
+    return f"""
+        ALTER TABLE {table} ADD COLUMN IF NOT EXISTS region VARCHAR(32) NOT NULL DEFAULT '{region}';
+        ALTER TABLE {table} ALTER COLUMN region SET DEFAULT '{region}';
+        ALTER TABLE {table} DROP CONSTRAINT IF EXISTS region_check;
+        ALTER TABLE {table} ADD CONSTRAINT region_check CHECK (region = '{region}');
+    """
+
+
+def require_unpartitioned_sql(table):
+    """SQL for psql scripts failing when table is partitioned: a reload or diff without a region hits every region"""
+    return f"""
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('{table}')) THEN
+                RAISE EXCEPTION '{table} is partitioned by region: pass --region';
+            END IF;
+        END
+        $$;
+    """
+
+
+def attach_sql(parent, region, staging):
+    """SQL swapping the indexed staging table in as parent's region partition"""
+    return f"""
+        {REGIONS_DDL}
+        ANALYZE {staging};
+        SELECT region_attach('{parent}', '{region}', '{staging}');
+    """
+
+
+def is_partitioned(cur, table):
+    cur.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s));", (table,))
+    return cur.fetchone()[0]
+
+
+def attach_partition(cur, parent, region, staging):
+    """Swap staging in as parent's region partition (no commit); returns the partition name"""
+    cur.execute(attach_sql(parent, check_region(region), staging))
+    return cur.fetchone()[0]
+
+
+def region_target(cur, parent, region=None):
+    """
+    Table an in-place importer writes to: parent itself, or its region partition
+    (created empty if needed). Writing a partitioned parent without a region raises
+    RegionError, since a full reload or DELETE there would hit every region.
+    """
+    if region is None:
+        if is_partitioned(cur, parent):
+            raise RegionError(f"{parent} is partitioned by region: pass --region")
+        return parent
+    cur.execute(REGIONS_DDL)
+    cur.execute("SELECT region_ensure(%s, %s);", (parent, check_region(region)))
+    return cur.fetchone()[0]
+
+
+def record_region(cur, parent, region):
+    """Refresh parent_region's row count and bounds in import_regions"""
+    cur.execute("SELECT region_record(%s, %s);", (parent, region))
+
+
+def extend_bounds(cur, parent, region, osm_ids, geom_column='geom'):
+    """
+    Grow a region's recorded bounds to cover rows a diff wrote (osm_id = ANY(osm_ids)),
+    so the API does not prune them away; cheaper than region_record on every diff.
+    """
+    if not osm_ids:
+        return
+    part = partition_name(parent, region)
+    cur.execute(f"""
+        UPDATE import_regions r
+        SET bounds = ST_Envelope(COALESCE(ST_Collect(r.bounds, e.box), e.box))
+        FROM (
+            SELECT ST_Transform(ST_SetSRID(ST_Extent({geom_column})::geometry,
+                                           Find_SRID(current_schema(), %s, %s)), 4326) AS box
+            FROM {part} WHERE osm_id = ANY(%s)
+        ) e
+        WHERE r.parent = %s AND r.region = %s AND e.box IS NOT NULL;
+    """, (part, geom_column, list(osm_ids), parent, region))
+
+
+def partition_tables(conn, tables, region):
+    """Convert existing unpartitioned tables in place; their rows become region"""
+    cur = conn.cursor()
+    cur.execute(REGIONS_DDL)
+    for table in tables:
+        cur.execute("SELECT region_partition(%s, %s);", (table, check_region(region)))
+        print(f"✓ {table}: rows moved to partition {cur.fetchone()[0]}")
+    conn.commit()
+    cur.close()
+
+
+def attach_osm(conn, region, prefix=None):
+    """
+    Attach the render tables of an osm2pgsql --prefix import as the region's
+    planet_osm_* partitions; returns the partitions attached.
+    The middle tables (<prefix>_nodes/_ways/_rels) stay as they are, for apply_osc.py --region.
+    """
+    from projections import PROJECTED_COLUMNS, projected_columns_ddl
+
+    region = check_region(region)
+    prefix = prefix or f"osm_{region}"
+    cur = conn.cursor()
+    attached = []
+    for kind in OSM_KINDS:
+        staging = f"{prefix}_{kind}"
+        parent = f"planet_osm_{kind}"
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (staging,))
+        if not cur.fetchone()[0]:
+            print(f"{staging} not found, skipping")
+            continue
+        cur.execute(region_columns_sql(staging, region))
+        if parent in PROJECTED_COLUMNS:
+            # The partition needs every column of the parent, generated ones included
+            cur.execute(projected_columns_ddl(staging, parent))
+        attached.append(attach_partition(cur, parent, region, staging))
+        conn.commit()
+        print(f"✓ {staging} attached as {attached[-1]}")
+    cur.close()
+    return attached
+
+
+def list_regions(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (REGIONS_TABLE,))
+    if not cur.fetchone()[0]:
+        print("No regions recorded yet")
+        cur.close()
+        return []
+    cur.execute("""
+        SELECT parent, region, partition, row_count, ST_AsText(bounds), loaded_at
+        FROM import_regions ORDER BY region, parent;
+    """)
+    rows = cur.fetchall()
+    cur.close()
+    for parent, region, partition, row_count, bounds, loaded_at in rows:
+        print(f"{region:<16} {partition:<32} {row_count:>10,} rows  loaded {loaded_at:%Y-%m-%d %H:%M}  {bounds}")
+    return rows
+
+
+if __name__ == '__main__':
+    import psycopg2
+
+    from import_osm_data import DB_CONFIG
+
+    args = sys.argv[1:]
+    region = None
+    if '--region' in args:
+        i = args.index('--region')
+        region = args[i + 1] if i + 1 < len(args) else None
+        del args[i:i + 2]
+    prefix = None
+    if '--prefix' in args:
+        i = args.index('--prefix')
+        prefix = args[i + 1] if i + 1 < len(args) else None
+        del args[i:i + 2]
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        if not args:
+            list_regions(conn)
+        elif args[0] == 'partition' and len(args) > 1 and region:
+            partition_tables(conn, args[1:], region)
+        elif args[0] == 'attach-osm' and len(args) == 2:
+            attach_osm(conn, args[1], prefix)
+        else:
+            print(__doc__.split('Usage:')[1])
+            sys.exit(1)
+    except (psycopg2.Error, RegionError) as e:
+        conn.rollback()
+        print(f"Error: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
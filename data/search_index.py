@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Denormalized search_index for /api/data/search
+One row per named charging station, planet_osm_point and planet_osm_polygon
+feature with its lon/lat precomputed (polygon centroids included) and an
+accent-free, lower-cased search_text ('Đường Láng' -> 'duong lang') indexed
+with pg_trgm for substring matches and a tsvector for short prefix matches.
+
+Refreshes are diffs: only rows whose name, address or position changed are
+written, and apply_osc.py / the station sink (station_sink.py) refresh just the
+ids they touched. The sink only does so while the index is current, so station
+changes made elsewhere (the VinFast sync) still show it as stale.
+
+Usage:
+  python search_index.py [charging_station|point|polygon ...]
+"""
+
+import sys
+import time
+
+import psycopg2
+
+from import_osm_data import DB_CONFIG
+
+# type (as returned by /data/search) -> rows (source_id, name, address, lon, lat)
+SOURCES = {
+    'charging_station': ('charge_stations', 'id', """
+        SELECT id::text, name, address, lon, lat
+        FROM charge_stations
+        WHERE (name IS NOT NULL OR address IS NOT NULL) {ids}
+    """),
+    'point': ('planet_osm_point', 'osm_id', """
+        SELECT osm_id::text, name, NULL, ST_X(ST_Transform(way, 4326)), ST_Y(ST_Transform(way, 4326))
+        FROM planet_osm_point
+        WHERE name IS NOT NULL {ids}
+    """),
+    # osm2pgsql can split one relation into several rows: keep the largest part
+    'polygon': ('planet_osm_polygon', 'osm_id', """
+        SELECT DISTINCT ON (osm_id) osm_id::text, name, NULL,
+               ST_X(ST_Centroid(ST_Transform(way, 4326))), ST_Y(ST_Centroid(ST_Transform(way, 4326)))
+        FROM planet_osm_polygon
+        WHERE name IS NOT NULL {ids}
+        ORDER BY osm_id, ST_Area(way) DESC
+    """),
+}
+
+SEARCH_INDEX_DDL = """
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    CREATE EXTENSION IF NOT EXISTS unaccent;
+
+    -- IMMUTABLE wrapper so the same normalization can be used in queries and indexes
+    CREATE OR REPLACE FUNCTION search_normalize(text) RETURNS text
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+        SELECT regexp_replace(lower(public.unaccent('public.unaccent'::regdictionary, $1)), '\\s+', ' ', 'g')
+    $$;
+
+    CREATE TABLE IF NOT EXISTS search_index (
+        type VARCHAR(20) NOT NULL,
+        source_id TEXT NOT NULL,
+        name TEXT,
+        address TEXT,
+        lon DOUBLE PRECISION,
+        lat DOUBLE PRECISION,
+        search_text TEXT NOT NULL,
+        tsv TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', search_text)) STORED,
+        PRIMARY KEY (type, source_id)
+    );
+    CREATE INDEX IF NOT EXISTS search_index_trgm_idx ON search_index USING GIN (search_text gin_trgm_ops);
+    CREATE INDEX IF NOT EXISTS search_index_tsv_idx ON search_index USING GIN (tsv);
+
+    -- charge_stations snapshot the station rows were built from (see routes/data.ts)
+    CREATE TABLE IF NOT EXISTS search_index_meta (
+        stations_updated_at TIMESTAMP,
+        stations_count BIGINT NOT NULL,
+        refreshed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+"""
+
+
+def _table_exists(cur, table):
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (table,))
+    return cur.fetchone()[0]
+
+
+def ensure_search_index(cur):
+    cur.execute(SEARCH_INDEX_DDL)
+
+
+def update_search_index(cur, source_type, ids=None):
+    """
+    Diff one source into search_index (no commit); ids limits the refresh to those
+    source ids, e.g. the osm_ids an osmChange file touched.
+    Returns (inserted, updated, deleted).
+    """
+    table, key, select = SOURCES[source_type]
+    id_filter = f"AND {key} = ANY(%(ids)s)" if ids is not None else ''
+    params = {'type': source_type, 'ids': [int(i) for i in ids] if ids is not None else None,
+              'text_ids': [str(i) for i in ids] if ids is not None else None}
+
+    cur.execute("DROP TABLE IF EXISTS search_index_incoming;")
+    cur.execute("""
+        CREATE TEMP TABLE search_index_incoming (
+            source_id TEXT,
+            name TEXT,
+            address TEXT,
+            lon DOUBLE PRECISION,
+            lat DOUBLE PRECISION
+        ) ON COMMIT DROP;
+    """)
+    cur.execute("INSERT INTO search_index_incoming " + select.format(ids=id_filter) + ";", params)
+    cur.execute("CREATE INDEX ON search_index_incoming (source_id); ANALYZE search_index_incoming;")
+
+    cur.execute("""
+        WITH merged AS (
+            INSERT INTO search_index (type, source_id, name, address, lon, lat, search_text)
+            SELECT %(type)s, i.source_id, i.name, i.address, i.lon, i.lat,
+                   search_normalize(concat_ws(' ', i.name, i.address))
+            FROM search_index_incoming i
+            ON CONFLICT (type, source_id) DO UPDATE SET
+                name = EXCLUDED.name,
+                address = EXCLUDED.address,
+                lon = EXCLUDED.lon,
+                lat = EXCLUDED.lat,
+                search_text = EXCLUDED.search_text
+            WHERE (search_index.name, search_index.address, search_index.lon, search_index.lat)
+                  IS DISTINCT FROM (EXCLUDED.name, EXCLUDED.address, EXCLUDED.lon, EXCLUDED.lat)
+            RETURNING (xmax = 0) AS inserted
+        )
+        SELECT COUNT(*) FILTER (WHERE inserted), COUNT(*) FILTER (WHERE NOT inserted) FROM merged;
+    """, params)
+    inserted, updated = cur.fetchone()
+
+    cur.execute(f"""
+        DELETE FROM search_index s
+        WHERE s.type = %(type)s {'AND s.source_id = ANY(%(text_ids)s)' if ids is not None else ''}
+          AND NOT EXISTS (SELECT 1 FROM search_index_incoming i WHERE i.source_id = s.source_id);
+    """, params)
+    deleted = cur.rowcount
+    cur.execute("DROP TABLE search_index_incoming;")
+    return inserted, updated, deleted
+
+
+def station_snapshot_current(cur):
+    """True when search_index_meta still matches charge_stations: no station changed since the last refresh"""
+    if not _table_exists(cur, 'search_index_meta'):
+        return False
+    cur.execute("""
+        SELECT EXISTS (
+            SELECT 1 FROM search_index_meta m,
+                   (SELECT COUNT(*) AS total, MAX(last_updated) AS latest FROM charge_stations) c
+            WHERE m.stations_count = c.total AND m.stations_updated_at IS NOT DISTINCT FROM c.latest
+        );
+    """)
+    return cur.fetchone()[0]
+
+
+def record_station_snapshot(cur):
+    cur.execute("DELETE FROM search_index_meta;")
+    cur.execute("""
+        INSERT INTO search_index_meta (stations_updated_at, stations_count)
+        SELECT MAX(last_updated), COUNT(*) FROM charge_stations;
+    """)
+
+
+def refresh_search_index(conn, sources=None):
+    """Create search_index if needed and diff every available source into it; returns rows changed"""
+    start = time.time()
+    cur = conn.cursor()
+    ensure_search_index(cur)
+    changed = 0
+    for source_type in sources or SOURCES:
+        if not _table_exists(cur, SOURCES[source_type][0]):
+            continue
+        inserted, updated, deleted = update_search_index(cur, source_type)
+        if source_type == 'charging_station':
+            record_station_snapshot(cur)
+        changed += inserted + updated + deleted
+        print(f"search_index {source_type}: {inserted} inserted, {updated} updated, {deleted} deleted")
+    conn.commit()
+    if changed:
+        cur.execute("ANALYZE search_index;")
+        conn.commit()
+    cur.close()
+    print(f"✓ search_index refreshed in {time.time() - start:.1f}s")
+    return changed
+
+
+if __name__ == '__main__':
+    sources = sys.argv[1:] or None
+    unknown = [s for s in sources or [] if s not in SOURCES]
+    if unknown:
+        print(f"Unknown source(s): {', '.join(unknown)} (choose from {', '.join(SOURCES)})")
+        sys.exit(1)
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        refresh_search_index(conn, sources)
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"Error refreshing search index: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
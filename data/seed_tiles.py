@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Pre-seed Mapbox Vector Tiles from PostGIS into an MBTiles (SQLite) cache
+Tiles are rendered with ST_AsMVT / ST_AsMVTGeom from buildings and the
+planet_osm_* tables by a pool of worker connections, gzip-compressed and
+written into the MBTiles file by the main thread.
+
+Usage:
+  python seed_tiles.py <minlon,minlat,maxlon,maxlat> <minzoom> <maxzoom> [output.mbtiles] [--workers N]
+  python seed_tiles.py extent 12 16                  # bbox taken from the buildings table
+  python seed_tiles.py dirty [output.mbtiles]        # re-render only tiles marked by --upsert imports
+"""
+
+import gzip
+import json
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import psycopg2
+
+from dirty_tiles import clear_dirty_tiles, fetch_dirty_tiles
+from import_osm_data import DB_CONFIG
+
+DEFAULT_OUTPUT = 'tiles.mbtiles'
+DEFAULT_WORKERS = 8
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+COMMIT_EVERY = 1000
+
+# layer name -> table, geometry column, SRID, attribute columns, min zoom
+LAYERS = {
+    'buildings': ('buildings', 'geom', 4326, ['name', 'type'], 13),
+    'landuse': ('planet_osm_polygon', 'way', 3857, ['name', 'building', 'natural', 'landuse', 'amenity'], 10),
+    'roads': ('planet_osm_line', 'way', 3857, ['name', 'highway', 'waterway'], 10),
+    'pois': ('planet_osm_point', 'way', 3857, ['name', 'amenity'], 14),
+}
+
+
+def lonlat_to_tile(lon, lat, zoom):
+    """Slippy-map tile containing lon/lat at zoom"""
+    lat = max(min(lat, 85.0511), -85.0511)
+    n = 2 ** zoom
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tiles_in_bbox(bbox, min_zoom, max_zoom):
+    """Yield (z, x, y) for every tile covering bbox (minlon, minlat, maxlon, maxlat)"""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    for z in range(min_zoom, max_zoom + 1):
+        x0, y0 = lonlat_to_tile(min_lon, max_lat, z)
+        x1, y1 = lonlat_to_tile(max_lon, min_lat, z)
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                yield z, x, y
+
+
+def _existing_layers(cur):
+    """LAYERS restricted to tables/columns that exist in this database, on geom_3857 where it exists"""
+    layers = {}
+    for name, (table, geom_col, srid, columns, min_zoom) in LAYERS.items():
+        cur.execute("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = 'public' AND table_name = %s;
+        """, (table,))
+        present = {row[0] for row in cur.fetchall()}
+        if geom_col not in present:
+            continue
+        if srid != 3857 and f"{geom_col}_3857" in present:
+            # Pre-projected copy from projections.py: no per-row ST_Transform and its own GIST index
+            geom_col, srid = f"{geom_col}_3857", 3857
+        layers[name] = (table, geom_col, srid, [c for c in columns if c in present], min_zoom)
+    return layers
+
+
+def build_tile_sql(layers):
+    """
+    One query per tile returning the concatenated MVT layers.
+    The tile envelope is transformed to each table's SRID so the GIST index is used.
+    """
+    parts = []
+    for name, (table, geom_col, srid, columns, min_zoom) in layers.items():
+        attrs = ''.join(f', "{c}"' for c in columns)
+        envelope = 'bounds.geom' if srid == 3857 else f'ST_Transform(bounds.geom, {srid})'
+        geom = f'"{geom_col}"' if srid == 3857 else f'ST_Transform("{geom_col}", 3857)'
+        parts.append(f"""
+            (SELECT COALESCE(ST_AsMVT(t, '{name}', {TILE_EXTENT}, 'geom'), '')
+             FROM (
+                SELECT ST_AsMVTGeom({geom}, bounds.geom, {TILE_EXTENT}, {TILE_BUFFER}, true) AS geom{attrs}
+                FROM {table}, bounds
+                WHERE %(z)s >= {min_zoom} AND "{geom_col}" && {envelope}
+             ) t WHERE t.geom IS NOT NULL)""")
+    return ("WITH bounds AS (SELECT ST_TileEnvelope(%(z)s, %(x)s, %(y)s) AS geom)\nSELECT "
+            + ' || '.join(parts) + ';')
+
+
+def buildings_extent():
+    """(minlon, minlat, maxlon, maxlat) of the buildings table"""
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT ST_XMin(e), ST_YMin(e), ST_XMax(e), ST_YMax(e)
+        FROM (SELECT ST_Extent(geom) AS e FROM buildings) t;
+    """)
+    extent = cur.fetchone()
+    cur.close()
+    conn.close()
+    return None if extent[0] is None else tuple(extent)
+
+
+def open_mbtiles(path, bbox, min_zoom, max_zoom, layers):
+    db = sqlite3.connect(path)
+    db.executescript("""
+        PRAGMA journal_mode = WAL;
+        PRAGMA synchronous = NORMAL;
+        CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS tiles (
+            zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row);
+    """)
+    center_lon = (bbox[0] + bbox[2]) / 2
+    center_lat = (bbox[1] + bbox[3]) / 2
+    vector_layers = [{'id': name, 'minzoom': max(min_zoom, spec[4]), 'maxzoom': max_zoom,
+                      'fields': {c: 'String' for c in spec[3]}}
+                     for name, spec in layers.items()]
+    metadata = {
+        'name': 'webgis',
+        'format': 'pbf',
+        'type': 'overlay',
+        'minzoom': str(min_zoom),
+        'maxzoom': str(max_zoom),
+        'bounds': ','.join(str(v) for v in bbox),
+        'center': f"{center_lon},{center_lat},{min_zoom}",
+        'json': json.dumps({'vector_layers': vector_layers}),
+    }
+    db.executemany("INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)", metadata.items())
+    db.commit()
+    return db
+
+
+def _tile_renderer(layers):
+    """render((z, x, y)) -> (z, x, y, mvt bytes) using one connection per pool thread"""
+    sql = build_tile_sql(layers)
+    local = threading.local()
+    connections = []
+    lock = threading.Lock()
+
+    def render(tile):
+        if not hasattr(local, 'cur'):
+            local.conn = psycopg2.connect(**DB_CONFIG)
+            local.conn.autocommit = True
+            local.cur = local.conn.cursor()
+            with lock:
+                connections.append(local.conn)
+        z, x, y = tile
+        local.cur.execute(sql, {'z': z, 'x': x, 'y': y})
+        data = local.cur.fetchone()[0]
+        return z, x, y, bytes(data) if data else b''
+
+    return render, connections
+
+
+def _write_tiles(db, layers, tiles, total, workers):
+    """
+    Render tiles into db: non-empty tiles are (re)written, empty ones removed.
+    Returns (written, removed).
+    """
+    render, connections = _tile_renderer(layers)
+    start = time.time()
+    done = written = removed = 0
+    pending, empty = [], []
+
+    def flush():
+        db.executemany("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)", pending)
+        db.executemany("DELETE FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?", empty)
+        db.commit()
+
+    try:
+        with ThreadPool(workers) as pool:
+            for z, x, y, data in pool.imap_unordered(render, tiles, chunksize=16):
+                done += 1
+                # MBTiles uses TMS row numbering and gzip-compressed pbf
+                if data:
+                    pending.append((z, x, (2 ** z - 1) - y, gzip.compress(data, 6)))
+                else:
+                    empty.append((z, x, (2 ** z - 1) - y))
+                if len(pending) + len(empty) >= COMMIT_EVERY:
+                    flush()
+                    written += len(pending)
+                    removed += len(empty)
+                    pending, empty = [], []
+                if done % 500 == 0 or done == total:
+                    rate = done / max(time.time() - start, 1e-9)
+                    print(f"\r{done}/{total} tiles ({rate:.0f} tiles/sec)", end='', flush=True)
+        flush()
+        written += len(pending)
+        removed += len(empty)
+    finally:
+        for c in connections:
+            c.close()
+    print()
+    return written, removed
+
+
+def _layers_or_none():
+    conn = psycopg2.connect(**DB_CONFIG)
+    layers = _existing_layers(conn.cursor())
+    conn.close()
+    if not layers:
+        print("Error: none of the tile layers' tables exist")
+    return layers
+
+
+def seed_tiles(bbox, min_zoom, max_zoom, output=DEFAULT_OUTPUT, workers=DEFAULT_WORKERS):
+    """Render every tile in bbox/zoom range into output; returns the number of tiles written"""
+    layers = _layers_or_none()
+    if not layers:
+        return 0
+
+    total = sum(1 for _ in tiles_in_bbox(bbox, min_zoom, max_zoom))
+    print(f"Seeding {total} tiles z{min_zoom}-{max_zoom} for bbox {bbox} with {workers} workers")
+    print(f"Layers: {', '.join(layers)} -> {output}")
+
+    db = open_mbtiles(output, bbox, min_zoom, max_zoom, layers)
+    start = time.time()
+    try:
+        written, _ = _write_tiles(db, layers, tiles_in_bbox(bbox, min_zoom, max_zoom), total, workers)
+    finally:
+        db.close()
+
+    print(f"✓ Wrote {written} non-empty tiles in {time.time() - start:.1f}s "
+          f"({os.path.getsize(output) / 1024 / 1024:.1f} MB)")
+    return written
+
+
+def refresh_dirty_tiles(output=DEFAULT_OUTPUT, workers=DEFAULT_WORKERS):
+    """
+    Re-render only the tiles marked in dirty_tiles into an existing MBTiles file
+    (within its zoom range), then clear them. Returns the number of tiles refreshed.
+    """
+    if not os.path.exists(output):
+        print(f"Error: {output} not found; seed it first")
+        return 0
+    layers = _layers_or_none()
+    if not layers:
+        return 0
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    tiles, marked_before = fetch_dirty_tiles(cur)
+    conn.commit()
+
+    db = sqlite3.connect(output)
+    zooms = dict(db.execute("SELECT name, value FROM metadata WHERE name IN ('minzoom', 'maxzoom')"))
+    min_zoom, max_zoom = int(zooms.get('minzoom', 0)), int(zooms.get('maxzoom', 22))
+    tiles = [t for t in tiles if min_zoom <= t[0] <= max_zoom]
+    print(f"Refreshing {len(tiles)} dirty tiles z{min_zoom}-{max_zoom} in {output} with {workers} workers")
+
+    start = time.time()
+    try:
+        written, removed = _write_tiles(db, layers, tiles, len(tiles), workers)
+    finally:
+        db.close()
+    clear_dirty_tiles(cur, marked_before)
+    conn.commit()
+    conn.close()
+
+    print(f"✓ {written} tiles re-rendered, {removed} now empty in {time.time() - start:.1f}s")
+    return len(tiles)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    workers = DEFAULT_WORKERS
+    if '--workers' in args:
+        i = args.index('--workers')
+        workers = int(args[i + 1])
+        del args[i:i + 2]
+
+    if args and args[0] == 'dirty':
+        refresh_dirty_tiles(args[1] if len(args) > 1 else DEFAULT_OUTPUT, workers)
+        sys.exit(0)
+
+    if len(args) < 3:
+        print("Usage:")
+        print("  python seed_tiles.py <minlon,minlat,maxlon,maxlat> <minzoom> <maxzoom> [output.mbtiles] [--workers N]")
+        print("  python seed_tiles.py extent 12 16                  # bbox taken from the buildings table")
+        print("  python seed_tiles.py dirty [output.mbtiles]        # re-render only tiles marked by --upsert imports")
+        sys.exit(1)
+
+    if args[0] == 'extent':
+        bbox = buildings_extent()
+        if bbox is None:
+            print("Error: buildings table is empty")
+            sys.exit(1)
+    else:
+        bbox = tuple(float(v) for v in args[0].split(','))
+    seed_tiles(bbox, int(args[1]), int(args[2]), args[3] if len(args) > 3 else DEFAULT_OUTPUT, workers)
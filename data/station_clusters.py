@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Precomputed cluster pyramid of the charging stations for /api/stations/clusters
+/api/stations/geojson sends every row of charge_stations on every map load and
+the browser clusters thousands of markers itself. This job clusters them once,
+supercluster-style: MAX_ZOOM holds the single stations, and each zoom level
+below greedily merges the items of the level above that lie within RADIUS
+pixels (of an EXTENT-pixel tile) into their weighted centroid, down to zoom 0.
+Every cluster keeps its station count per category and per status.
+
+The result goes to station_clusters, one row per (zoom, cluster or station),
+keyed by the slippy-map tile the item falls in at that zoom. Below MAX_ZOOM
+the items of one zoom are at least RADIUS pixels apart, so a viewport holds a
+bounded number of rows however many stations there are. /api/stations/clusters
+reads the table while it is newer than the last station sync
+(station_clusters_meta).
+
+Usage:
+  python station_clusters.py
+"""
+
+import math
+import sys
+import time
+from collections import Counter
+
+MAX_ZOOM = 18
+RADIUS = 40   # cluster radius in pixels
+EXTENT = 512  # tile size in pixels the radius is measured against
+MIN_POINTS = 2
+
+# Same box as /api/stations/geojson: rows outside it are crawler noise
+STATION_BOUNDS = (102, 8, 115, 24)
+
+CLUSTERS_DDL = """
+    CREATE TABLE IF NOT EXISTS station_clusters (
+        zoom SMALLINT NOT NULL,
+        tile_x INTEGER NOT NULL,
+        tile_y INTEGER NOT NULL,
+        cluster_id INTEGER,  -- NULL for a single station
+        station_id INTEGER,  -- charge_stations.id of a single station
+        point_count INTEGER NOT NULL,
+        expansion_zoom SMALLINT,  -- first zoom the cluster splits at
+        lon DOUBLE PRECISION NOT NULL,
+        lat DOUBLE PRECISION NOT NULL,
+        categories JSONB NOT NULL,
+        statuses JSONB NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS station_clusters_tile_idx ON station_clusters (zoom, tile_x, tile_y);
+    CREATE TABLE IF NOT EXISTS station_clusters_meta (
+        source_updated_at TIMESTAMP,
+        source_count BIGINT NOT NULL,
+        refreshed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+"""
+
+
+def mercator_x(lon):
+    """Longitude -> [0, 1] web mercator x"""
+    return lon / 360 + 0.5
+
+
+def mercator_y(lat):
+    """Latitude -> [0, 1] web mercator y (0 at the top, like tile rows)"""
+    sin = math.sin(lat * math.pi / 180)
+    y = 0.5 - 0.25 * math.log((1 + sin) / (1 - sin)) / math.pi
+    return min(1.0, max(0.0, y))
+
+
+def mercator_lon(x):
+    return (x - 0.5) * 360
+
+
+def mercator_lat(y):
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y))))
+
+
+class Item:
+    """A station or cluster at one zoom level, in [0, 1] mercator coordinates"""
+    __slots__ = ('x', 'y', 'count', 'categories', 'statuses', 'cluster_id', 'station_id', 'expansion_zoom')
+
+    def __init__(self, x, y, count, categories, statuses, cluster_id=None, station_id=None, expansion_zoom=None):
+        self.x = x
+        self.y = y
+        self.count = count
+        self.categories = categories
+        self.statuses = statuses
+        self.cluster_id = cluster_id
+        self.station_id = station_id
+        self.expansion_zoom = expansion_zoom
+
+
+def _grid(items, r):
+    """{cell: [item indexes]} over r-sized cells, so a radius search only looks at 3x3 cells"""
+    grid = {}
+    for i, item in enumerate(items):
+        grid.setdefault((int(item.x // r), int(item.y // r)), []).append(i)
+    return grid
+
+
+def _within(items, grid, i, r):
+    """Indexes of the items within r of items[i], itself excluded"""
+    item = items[i]
+    cx, cy = int(item.x // r), int(item.y // r)
+    found = []
+    for gx in (cx - 1, cx, cx + 1):
+        for gy in (cy - 1, cy, cy + 1):
+            for j in grid.get((gx, gy), ()):
+                if j != i and (items[j].x - item.x) ** 2 + (items[j].y - item.y) ** 2 <= r * r:
+                    found.append(j)
+    return found
+
+
+def cluster_level(items, zoom, next_id):
+    """
+    Items of zoom + 1 -> (items of zoom, next free cluster id). Like supercluster,
+    items are visited in order and each unvisited one absorbs its unvisited
+    neighbours within RADIUS pixels when they add up to MIN_POINTS stations.
+    """
+    r = RADIUS / (EXTENT * 2 ** zoom)
+    visited = [False] * len(items)
+    grid = _grid(items, r)
+    merged = []
+    for i in range(len(items)):
+        if visited[i]:
+            continue
+        visited[i] = True
+        neighbours = [j for j in _within(items, grid, i, r) if not visited[j]]
+        item = items[i]
+        if not neighbours or item.count + sum(items[j].count for j in neighbours) < MIN_POINTS:
+            merged.append(item)  # carried up unchanged, keeps its id and expansion zoom
+            continue
+        members = [item] + [items[j] for j in neighbours]
+        for j in neighbours:
+            visited[j] = True
+        count = sum(m.count for m in members)
+        categories, statuses = Counter(), Counter()
+        for m in members:
+            categories.update(m.categories)
+            statuses.update(m.statuses)
+        merged.append(Item(sum(m.x * m.count for m in members) / count,
+                           sum(m.y * m.count for m in members) / count,
+                           count, categories, statuses, cluster_id=next_id, expansion_zoom=zoom + 1))
+        next_id += 1
+    return merged, next_id
+
+
+def build_pyramid(stations, max_zoom=MAX_ZOOM):
+    """
+    {zoom: items} for zoom 0..max_zoom from (id, lon, lat, category, status) rows.
+    max_zoom keeps every station on its own, so any cluster's expansion zoom has rows.
+    """
+    items = [Item(mercator_x(lon), mercator_y(lat), 1, Counter({category or '': 1}), Counter({status or '': 1}),
+                  station_id=station_id)
+             for station_id, lon, lat, category, status in stations]
+    levels = {max_zoom: items}
+    next_id = 1
+    for zoom in range(max_zoom - 1, -1, -1):
+        items, next_id = cluster_level(items, zoom, next_id)
+        levels[zoom] = items
+    return levels
+
+
+def _tile(value, zoom):
+    n = 1 << zoom
+    return min(n - 1, max(0, int(value * n)))
+
+
+def pyramid_rows(levels):
+    """station_clusters rows, ordered by (zoom, tile) like the index"""
+    rows = []
+    for zoom, items in levels.items():
+        for item in items:
+            rows.append((zoom, _tile(item.x, zoom), _tile(item.y, zoom), item.cluster_id, item.station_id,
+                         item.count, item.expansion_zoom, mercator_lon(item.x), mercator_lat(item.y),
+                         dict(item.categories), dict(item.statuses)))
+    rows.sort(key=lambda row: row[:3])
+    return rows
+
+
+def _load_stations(cur):
+    """(id, lon, lat, category, status) of every station inside STATION_BOUNDS"""
+    cur.execute("""
+        SELECT id, ST_X(p), ST_Y(p), category, status
+        FROM (SELECT id, category, status, ST_Transform(geom, 4326) AS p
+              FROM charge_stations WHERE geom IS NOT NULL) s
+        WHERE ST_X(p) BETWEEN %s AND %s AND ST_Y(p) BETWEEN %s AND %s
+        ORDER BY id;
+    """, (STATION_BOUNDS[0], STATION_BOUNDS[2], STATION_BOUNDS[1], STATION_BOUNDS[3]))
+    return cur.fetchall()
+
+
+def refresh_station_clusters(conn):
+    """Rebuild station_clusters; returns the number of rows written"""
+    from psycopg2.extras import Json, execute_values
+
+    start = time.time()
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass('charge_stations') IS NOT NULL;")
+    if not cur.fetchone()[0]:
+        print("charge_stations not found, skipping station clusters")
+        cur.close()
+        return 0
+
+    # Snapshot of the station table the pyramid is built from
+    cur.execute("SELECT MAX(last_updated), COUNT(*) FROM charge_stations;")
+    source_updated_at, source_count = cur.fetchone()
+
+    stations = _load_stations(cur)
+    rows = pyramid_rows(build_pyramid(stations))
+    computed = time.time()
+
+    cur.execute(CLUSTERS_DDL)
+    cur.execute("DELETE FROM station_clusters; DELETE FROM station_clusters_meta;")
+    execute_values(cur, """
+        INSERT INTO station_clusters (zoom, tile_x, tile_y, cluster_id, station_id, point_count,
+                                      expansion_zoom, lon, lat, categories, statuses) VALUES %s
+    """, [(*row[:9], Json(row[9]), Json(row[10])) for row in rows], page_size=1000)
+    cur.execute("""
+        INSERT INTO station_clusters_meta (source_updated_at, source_count) VALUES (%s, %s);
+    """, (source_updated_at, source_count))
+    conn.commit()
+    cur.execute("ANALYZE station_clusters;")
+    conn.commit()
+    cur.close()
+
+    top = sum(1 for row in rows if row[0] == 0)
+    print(f"✓ station_clusters: {len(stations)} stations -> {len(rows)} rows over zoom 0-{MAX_ZOOM} "
+          f"({top} at zoom 0; cluster {computed - start:.2f}s, total {time.time() - start:.2f}s)")
+    return len(rows)
+
+
+if __name__ == '__main__':
+    import psycopg2
+
+    from import_osm_data import DB_CONFIG
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        refresh_station_clusters(conn)
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"Error refreshing station clusters: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
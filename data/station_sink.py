@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+PostGIS sink for crawled charging stations
+Rows are COPYed into a temp table and merged into charge_stations with one
+INSERT ... ON CONFLICT (external_id); rows whose content hash is unchanged are
+skipped, and geom is built from lat/lon in SQL. When search_index is current,
+the stations written are re-indexed in the same transaction.
+
+external_id is shared with the VinFast sync in backend/src/routes/stations.ts,
+which writes bare store ids, so crawlers pass a source and their keys are
+stored as '<source>:<id>' (e.g. 'vgreen:123').
+"""
+
+import hashlib
+import time
+
+from bulk_load import COPY_BATCH_SIZE, copy_rows
+from search_index import record_station_snapshot, station_snapshot_current, update_search_index
+
+STATION_COLUMNS = ('external_id', 'name', 'address', 'city', 'category', 'status', 'lat', 'lon', 'content_hash')
+# Text fields and the widths of their charge_stations columns (data/init_stations.sql)
+FIELD_WIDTHS = (('name', 255), ('address', None), ('city', 100), ('category', 50), ('status', 100))
+
+
+def station_row(record, source=None):
+    """
+    (external_id, name, address, city, category, status, lat, lon, content_hash) for a
+    crawled record, or None without valid coordinates.
+    Records without an id are keyed 'h<md5 of name and coordinates>'; with a source the
+    key is prefixed '<source>:'. Without one it is stored as is (snapshot restores).
+    """
+    try:
+        lat = float(record.get('lat'))
+        lon = float(record.get('lng', record.get('lon')))
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+
+    fields = [None if record.get(key) is None else str(record.get(key))[:width]
+              for key, width in FIELD_WIDTHS]
+    content = '\x1f'.join('' if v is None else v for v in fields + [repr(lat), repr(lon)])
+    digest = hashlib.md5(content.encode('utf-8')).hexdigest()
+    external_id = record.get('external_id')
+    external_id = str(external_id) if external_id not in (None, '') else 'h' + digest
+    if source:
+        external_id = f"{source}:{external_id}"
+    return (external_id[:50], *fields, lat, lon, digest)
+
+
+def ensure_station_columns(cur):
+    cur.execute("""
+        ALTER TABLE charge_stations
+          ADD COLUMN IF NOT EXISTS status VARCHAR(100),
+          ADD COLUMN IF NOT EXISTS content_hash CHAR(32);
+    """)
+
+
+def create_station_incoming(cur):
+    cur.execute("DROP TABLE IF EXISTS charge_stations_incoming;")
+    cur.execute("""
+        CREATE TEMP TABLE charge_stations_incoming (
+            external_id VARCHAR(50),
+            name VARCHAR(255),
+            address TEXT,
+            city VARCHAR(100),
+            category VARCHAR(50),
+            status VARCHAR(100),
+            lat FLOAT,
+            lon FLOAT,
+            content_hash CHAR(32)
+        ) ON COMMIT DROP;
+    """)
+    return 'charge_stations_incoming'
+
+
+def merge_stations(cur, incoming):
+    """Upsert incoming into charge_stations in one statement; returns (inserted, updated, ids written)"""
+    cur.execute(f"""
+        WITH merged AS (
+            INSERT INTO charge_stations
+                (external_id, name, address, city, category, status, lat, lon, geom, content_hash, last_updated)
+            SELECT DISTINCT ON (i.external_id)
+                i.external_id, i.name, i.address, i.city, i.category, i.status, i.lat, i.lon,
+                ST_Transform(ST_SetSRID(ST_MakePoint(i.lon, i.lat), 4326), 3857),
+                i.content_hash, NOW()
+            FROM {incoming} i
+            WHERE NOT EXISTS (
+                SELECT 1 FROM charge_stations s
+                WHERE s.external_id = i.external_id AND s.content_hash = i.content_hash
+            )
+            ORDER BY i.external_id
+            ON CONFLICT (external_id) DO UPDATE SET
+                name = EXCLUDED.name,
+                address = EXCLUDED.address,
+                city = EXCLUDED.city,
+                category = EXCLUDED.category,
+                status = EXCLUDED.status,
+                lat = EXCLUDED.lat,
+                lon = EXCLUDED.lon,
+                geom = EXCLUDED.geom,
+                content_hash = EXCLUDED.content_hash,
+                last_updated = NOW()
+            WHERE charge_stations.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+            RETURNING id, (xmax = 0) AS inserted
+        )
+        SELECT COUNT(*) FILTER (WHERE inserted), COUNT(*) FILTER (WHERE NOT inserted),
+               COALESCE(array_agg(id), '{{}}')
+        FROM merged;
+    """)
+    return cur.fetchone()
+
+
+async def sink_stations(conn, records, batch_size=COPY_BATCH_SIZE, source=None):
+    """
+    Consume an async iterable of crawled records into charge_stations.
+    Records are COPYed batch_size at a time while the crawl is still running,
+    then merged in a single statement. source prefixes external_id (see station_row).
+    Returns dict(received, skipped, inserted, updated, unchanged).
+    """
+    start = time.time()
+    cur = conn.cursor()
+    ensure_station_columns(cur)
+    incoming = create_station_incoming(cur)
+
+    received = skipped = copied = 0
+    batch = []
+    async for record in records:
+        received += 1
+        row = station_row(record, source)
+        if row is None:
+            skipped += 1
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            copied += copy_rows(cur, incoming, STATION_COLUMNS, batch)
+            batch = []
+    if batch:
+        copied += copy_rows(cur, incoming, STATION_COLUMNS, batch)
+
+    # Checked before the merge: an index that was already stale must stay marked stale
+    indexed = station_snapshot_current(cur)
+    inserted, updated, ids = merge_stations(cur, incoming)
+    if indexed and ids:
+        update_search_index(cur, 'charging_station', ids)
+        record_station_snapshot(cur)
+    conn.commit()
+    cur.close()
+
+    counts = {'received': received, 'skipped': skipped, 'inserted': inserted, 'updated': updated,
+              'unchanged': max(0, copied - inserted - updated)}
+    print(f"charge_stations: {inserted} inserted, {updated} updated, {counts['unchanged']} unchanged, "
+          f"{skipped} without coordinates in {time.time() - start:.1f}s")
+    return counts
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Offline checks for apply_osc.py against the osmChange fixtures in fixtures/osc
+(000/000/001.osc creates a building and a cafe, 002.osc.gz moves a node and
+renames the building, 003.osc deletes both). apply_change_file runs for real
+against FakeDatabase, a cursor that answers the statements apply_osc sends
+from in-memory tables, so no PostGIS is needed.
+
+apply_upsert's set-based SQL only runs in PostGIS; the fake stands in for its
+'updated' and 'inserted' statements by applying the rows COPY'd into
+buildings_incoming. Everything before that (parsing, node resolution,
+encode_geometry, the delete list) and after it is the real code.
+
+Usage:
+  python -m unittest test_apply_osc
+"""
+
+import copy
+import os
+import re
+import shutil
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+import apply_osc
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'osc')
+
+MOVE_NODE = """<?xml version="1.0" encoding="UTF-8"?>
+<osmChange version="0.6" generator="test">
+  <modify>
+    <node id="2" version="2" lat="51.5000000" lon="-0.1298000"/>
+  </modify>
+</osmChange>
+"""
+
+ROAD = """<?xml version="1.0" encoding="UTF-8"?>
+<osmChange version="0.6" generator="test">
+  <create>
+    <way id="20" version="1">
+      <nd ref="1"/>
+      <nd ref="2"/>
+      <tag k="highway" v="residential"/>
+    </way>
+  </create>
+</osmChange>
+"""
+
+
+class FakeDatabase:
+    """
+    buildings (osm_id -> (name, type, geom_hex, content_hash)), the render tables
+    (osm_id -> column values) and the slim middle (id -> (lat, lon) / (nodes, tags)),
+    with commit / rollback snapshots like a transaction
+    """
+
+    def __init__(self):
+        self.tables = {
+            'buildings': {},
+            'planet_osm_point': {},
+            'planet_osm_line': {},
+            'planet_osm_polygon': {},
+            'planet_osm_nodes': {},
+            'planet_osm_ways': {},
+        }
+        self.columns = {
+            'planet_osm_point': {'osm_id', 'amenity', 'name', 'way'},
+            'planet_osm_polygon': {'osm_id', 'building', 'name', 'way'},
+        }
+        self.incoming = {}
+        self.statements = []
+        self.fail_on = None
+        self.committed = copy.deepcopy(self.tables)
+
+    def connect(self, **kwargs):
+        return FakeConnection(self)
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self):
+        return FakeCursor(self.db)
+
+    def commit(self):
+        self.db.committed = copy.deepcopy(self.db.tables)
+
+    def rollback(self):
+        self.db.tables = copy.deepcopy(self.db.committed)
+
+    def close(self):
+        pass
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.rowcount = 0
+        self.result = []
+
+    def execute(self, sql, params=None):
+        sql = ' '.join(sql.split())
+        self.db.statements.append(sql)
+        if self.db.fail_on and sql.startswith(self.db.fail_on):
+            raise RuntimeError(f"simulated failure at {sql}")
+        tables = self.db.tables
+        self.rowcount, self.result = 0, []
+
+        if sql == "SELECT to_regclass(%s);":
+            self.result = [(params[0] if params[0] in tables else None,)]
+        elif sql.startswith("SELECT column_name FROM information_schema.columns"):
+            self.result = [(c,) for c in self.db.columns.get(params[0], ())]
+        elif sql.startswith("SELECT data_type FROM information_schema.columns"):
+            self.result = [('jsonb',)] if params == ('planet_osm_ways', 'tags') else []
+        elif sql.startswith("SELECT id, lon, lat FROM planet_osm_nodes"):
+            nodes = tables['planet_osm_nodes']
+            self.result = [(nid, nodes[nid][1], nodes[nid][0]) for nid in params[0] if nid in nodes]
+        elif 'w.nodes && %s::bigint[]' in sql:
+            buildings = tables['buildings']
+            self.result = [(wid, nodes, tags, *buildings[f"w{wid}"][:2])
+                           for wid, (nodes, tags) in tables['planet_osm_ways'].items()
+                           if set(nodes) & set(params[0]) and f"w{wid}" in buildings]
+        elif sql.startswith("SELECT osm_id FROM buildings WHERE osm_id = ANY"):
+            self.result = [(osm_id,) for osm_id in params[0] if osm_id in tables['buildings']]
+        elif m := re.match(r"DELETE FROM (\w+) WHERE (?:osm_)?id = ANY", sql):
+            table = tables[m.group(1)]
+            gone = [key for key in params[0] if key in table]
+            for key in gone:
+                del table[key]
+            self.rowcount = len(gone)
+        elif sql.startswith("UPDATE buildings t SET"):
+            changed = {osm_id: row for osm_id, row in self.db.incoming.items()
+                       if osm_id in tables['buildings'] and tables['buildings'][osm_id][3] != row[3]}
+            tables['buildings'].update(changed)
+            self.rowcount = len(changed)
+        elif sql.startswith("INSERT INTO buildings") and 'FROM buildings_incoming' in sql:
+            new = {osm_id: row for osm_id, row in self.db.incoming.items() if osm_id not in tables['buildings']}
+            tables['buildings'].update(new)
+            self.rowcount = len(new)
+        elif sql == "DROP TABLE IF EXISTS buildings_incoming;":
+            self.db.incoming = {}
+
+    def executemany(self, sql, rows):
+        for row in rows:
+            self.execute(sql, row)
+
+    def copy_expert(self, sql, buf):
+        assert sql.startswith("COPY buildings_incoming "), sql
+        for line in buf.read().splitlines():
+            osm_id, name, building_type, geom_hex, content_hash = line.split('\t')
+            self.db.incoming[osm_id] = (name, building_type, geom_hex, content_hash)
+
+    def insert_values(self, sql, rows):
+        """execute_values: INSERT ... VALUES %s into a render or middle table"""
+        m = re.match(r"\s*INSERT INTO (\w+) \(([^)]*)\)", sql)
+        table = self.db.tables[m.group(1)]
+        columns = [c.strip().strip('"') for c in m.group(2).split(',')]
+        for row in rows:
+            values = dict(zip(columns, row))
+            if 'osm_id' in values:
+                table[values.pop('osm_id')] = values
+            elif 'nodes' in values:
+                tags = values.get('tags')
+                table[values['id']] = (values['nodes'], getattr(tags, 'adapted', tags))
+            else:
+                table[values['id']] = (values['lat'], values['lon'])
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+def fake_execute_values(cur, sql, rows, template=None, page_size=100):
+    cur.insert_values(sql, rows)
+
+
+def ring(geom_hex):
+    """Outer ring of a hex EWKB polygon as (lon, lat) pairs"""
+    data = bytes.fromhex(geom_hex)
+    count, = struct.unpack_from('<I', data, 13)  # header (9 bytes) + ring count
+    return [struct.unpack_from('<dd', data, 17 + 16 * i) for i in range(count)]
+
+
+class ApplyOscFixtureTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.diffs = os.path.join(self.tmp, 'osc')
+        shutil.copytree(FIXTURES, self.diffs)
+        self.state = os.path.join(self.diffs, apply_osc.STATE_FILE)
+        self.db = FakeDatabase()
+        patches = [
+            mock.patch.object(apply_osc.psycopg2, 'connect', self.db.connect),
+            mock.patch.object(apply_osc, 'execute_values', fake_execute_values),
+            mock.patch.object(apply_osc, '_check_region'),
+            mock.patch.object(apply_osc, '_check_way_nodes_index'),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def apply_fixture(self, name):
+        return apply_osc.apply_change_file(self.db.connect(), os.path.join(self.diffs, '000', '000', name))
+
+    def apply(self, name, text):
+        path = os.path.join(self.tmp, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return apply_osc.apply_change_file(self.db.connect(), path)
+
+    def test_finds_plain_and_gzipped_diffs_in_sequence_order(self):
+        found = apply_osc.find_diff_files(self.diffs)
+        self.assertEqual([seq for seq, _ in found], [1, 2, 3])
+        self.assertTrue(found[1][1].endswith('002.osc.gz'))
+
+    def test_parse_actions(self):
+        created = apply_osc.parse_osc(os.path.join(self.diffs, '000', '000', '001.osc'))
+        self.assertEqual(created['way'][10]['action'], 'create')
+        self.assertEqual(created['way'][10]['refs'], [1, 2, 3, 4, 1])
+        self.assertEqual(created['node'][5]['tags'], {'amenity': 'cafe', 'name': 'Corner Cafe'})
+        modified = apply_osc.parse_osc(os.path.join(self.diffs, '000', '000', '002.osc.gz'))
+        self.assertEqual(modified['way'][10]['action'], 'modify')
+        self.assertEqual(modified['node'][3]['lat'], 51.50015)
+        deleted = apply_osc.parse_osc(os.path.join(self.diffs, '000', '000', '003.osc'))
+        self.assertEqual({deleted['way'][10]['action'], deleted['node'][5]['action']}, {'delete'})
+
+    def test_create_modify_delete_round_trip(self):
+        tables = self.db.tables
+        created = self.apply_fixture('001.osc')
+        self.assertEqual((created['buildings_inserted'], created['points'], created['polygons']), (1, 1, 1))
+        self.assertEqual(tables['buildings']['w10'][:2], ('Fixture House', 'yes'))
+        self.assertEqual(tables['planet_osm_point'][5]['name'], 'Corner Cafe')
+
+        modified = self.apply_fixture('002.osc.gz')
+        self.assertEqual((modified['buildings_inserted'], modified['buildings_updated']), (0, 1))
+        name, building_type, geom_hex, _ = tables['buildings']['w10']
+        self.assertEqual((name, building_type), ('Fixture House (renamed)', 'house'))
+        self.assertEqual(ring(geom_hex)[2], (-0.1299, 51.50015))
+        self.assertEqual(tables['planet_osm_polygon'][10]['name'], 'Fixture House (renamed)')
+        self.assertEqual(tables['planet_osm_ways'][10][1]['building'], 'house')
+
+        deleted = self.apply_fixture('003.osc')
+        self.assertEqual(deleted['buildings_deleted'], 1)
+        for table in ('buildings', 'planet_osm_point', 'planet_osm_polygon', 'planet_osm_ways'):
+            self.assertEqual(tables[table], {}, table)
+
+    def test_apply_diffs_records_state(self):
+        self.assertEqual(apply_osc.apply_diffs(self.diffs), 3)
+        self.assertEqual(apply_osc.read_state(self.state), 3)
+        self.assertEqual(self.db.tables['buildings'], {})
+        # Nothing newer than the state file: nothing is applied again
+        self.db.statements.clear()
+        self.assertEqual(apply_osc.apply_diffs(self.diffs), 0)
+        self.assertEqual(self.db.statements, [])
+
+    def test_state_resumes_after_failed_diff(self):
+        self.db.fail_on = "DELETE FROM buildings WHERE"
+        with self.assertRaises(RuntimeError):
+            apply_osc.apply_diffs(self.diffs)
+        # The state file only moves past diffs that were applied, and the failed one was rolled back
+        self.assertEqual(apply_osc.read_state(self.state), 2)
+        self.assertIn('w10', self.db.tables['buildings'])
+        self.assertIn(5, self.db.tables['planet_osm_point'])
+
+        self.db.fail_on = None
+        self.assertEqual(apply_osc.apply_diffs(self.diffs), 1)
+        self.assertEqual(apply_osc.read_state(self.state), 3)
+        self.assertNotIn('w10', self.db.tables['buildings'])
+
+    def test_separate_state_file(self):
+        state = os.path.join(self.tmp, 'elsewhere.txt')
+        apply_osc.write_state(state, 2)
+        self.assertEqual(apply_osc.apply_diffs(self.diffs, state), 1)
+        self.assertEqual(apply_osc.read_state(state), 3)
+        self.assertFalse(os.path.exists(self.state))
+
+    def test_moved_node_rebuilds_building_from_middle_tags(self):
+        self.apply_fixture('001.osc')
+        self.apply_fixture('002.osc.gz')
+        self.db.tables['planet_osm_polygon'].clear()
+
+        stats = self.apply('move.osc', MOVE_NODE)
+        self.assertEqual(stats['buildings_updated'], 1)
+        name, building_type, geom_hex, _ = self.db.tables['buildings']['w10']
+        self.assertEqual((name, building_type), ('Fixture House (renamed)', 'house'))
+        self.assertEqual(ring(geom_hex)[1], (-0.1298, 51.5))
+        # The way's tags come from planet_osm_ways, so its polygon row is rebuilt too
+        self.assertEqual(self.db.tables['planet_osm_polygon'][10]['building'], 'house')
+
+    def test_moved_node_with_broken_ring_is_quarantined(self):
+        self.apply_fixture('001.osc')
+        before = self.db.tables['buildings']['w10']
+        stats = self.apply('broken.osc', MOVE_NODE.replace('lon="-0.1298000"', 'lon="190.0000000"'))
+        self.assertEqual((stats['rejected'], stats['buildings_updated']), (1, 0))
+        self.assertEqual(self.db.tables['buildings']['w10'], before)
+        self.assertTrue(any(sql.startswith("INSERT INTO geometry_quarantine") for sql in self.db.statements))
+
+    def test_modified_road_does_not_touch_buildings(self):
+        self.apply_fixture('001.osc')
+        self.db.statements.clear()
+        stats = self.apply('road.osc', ROAD)
+        self.assertEqual(stats['buildings_deleted'], 0)
+        self.assertFalse(any(sql.startswith("DELETE FROM buildings") for sql in self.db.statements))
+        self.assertIn('w10', self.db.tables['buildings'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Offline checks for downloader.py against a local http.server: one that honours
+Range requests and one that advertises Accept-Ranges but always sends the
+whole file with 200, as some mirrors and proxies do.
+
+Usage:
+  python -m unittest test_downloader
+"""
+
+import http.server
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import downloader
+
+BODY = bytes(range(256)) * 40  # 10240 bytes
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    honour_range = True
+
+    def log_message(self, *args):
+        pass
+
+    def _headers(self, status, length, extra=()):
+        self.send_response(status)
+        self.send_header('Content-Length', str(length))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', '"fixture"')
+        for key, value in extra:
+            self.send_header(key, value)
+        self.end_headers()
+
+    def do_HEAD(self):
+        self._headers(200, len(BODY))
+
+    def do_GET(self):
+        ranged = self.headers.get('Range')
+        if ranged and self.honour_range:
+            first, _, last = ranged.split('=', 1)[1].partition('-')
+            first, last = int(first), int(last) if last else len(BODY) - 1
+            body = BODY[first:last + 1]
+            self._headers(206, len(body), [('Content-Range', f"bytes {first}-{last}/{len(BODY)}")])
+        else:
+            body = BODY
+            self._headers(200, len(body))
+        self.wfile.write(body)
+
+
+class IgnoresRange(Handler):
+    honour_range = False
+
+
+class DownloaderTest(unittest.TestCase):
+    def serve(self, handler):
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return f"http://127.0.0.1:{server.server_address[1]}/extract.osm.pbf"
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.output = os.path.join(self.tmp, 'extract.osm.pbf')
+
+    def read_output(self):
+        with open(self.output, 'rb') as f:
+            return f.read()
+
+    def test_parallel_segments(self):
+        url = self.serve(Handler)
+        self.assertEqual(downloader.download(url, self.output, connections=4, verify=False), 'downloaded')
+        self.assertEqual(self.read_output(), BODY)
+        self.assertEqual(sorted(os.listdir(self.tmp)), ['extract.osm.pbf', 'extract.osm.pbf.meta.json'])
+
+    def test_segment_starting_at_zero_rejects_full_body(self):
+        url = self.serve(IgnoresRange)
+        path = self.output + '.part.0'
+        progress = downloader._Progress(len(BODY))
+        with self.assertRaises(downloader.RangeNotSupported):
+            downloader._fetch_range(url, path, 0, 2559, progress)
+        self.assertFalse(os.path.exists(path))
+
+    def test_parallel_falls_back_to_single_stream(self):
+        url = self.serve(IgnoresRange)
+        self.assertEqual(downloader.download(url, self.output, connections=4, verify=False), 'downloaded')
+        self.assertEqual(self.read_output(), BODY)
+        self.assertFalse([name for name in os.listdir(self.tmp) if '.part' in name])
+
+    def test_resume_restarts_when_range_is_ignored(self):
+        url = self.serve(IgnoresRange)
+        with open(self.output + '.part', 'wb') as f:
+            f.write(BODY[:1000])
+        self.assertEqual(downloader.download(url, self.output, verify=False), 'downloaded')
+        self.assertEqual(self.read_output(), BODY)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Geometry validation for the building importers
+Two passes, both kept out of the per-row hot path:
+
+* check_ring runs while rings are packed into WKB: unclosed rings are closed,
+  degenerate holes dropped, and rings with too few points or non-finite /
+  out-of-range coordinates reported (PostGIS would reject the whole COPY).
+* validation_statements is one set-based pass over a staging table before it
+  is indexed: invalid geometries (self-intersections, bad nesting, ...) are
+  repaired with ST_MakeValid, keeping holes and every polygonal part, and
+  anything that cannot be repaired is removed. Both outcomes are logged in
+  geometry_quarantine with the reason.
+"""
+
+import json
+import math
+
+MIN_RING_POINTS = 4  # closed ring: 3 distinct corners + the repeated first point
+MAX_LATITUDE = 85.0511287798  # Web Mercator limit; buildings.geom_3857 cannot hold anything beyond it
+QUARANTINE_TABLE = 'geometry_quarantine'
+
+QUARANTINE_DDL = f"""
+    CREATE TABLE IF NOT EXISTS {QUARANTINE_TABLE} (
+        id BIGSERIAL PRIMARY KEY,
+        source_table TEXT NOT NULL,
+        osm_id VARCHAR(32),
+        name TEXT,
+        type TEXT,
+        action VARCHAR(10) NOT NULL,  -- repaired | rejected
+        reason TEXT NOT NULL,
+        geom GEOMETRY,                -- original geometry, when PostGIS could parse it
+        raw TEXT,                     -- original GeoJSON geometry otherwise
+        quarantined_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    CREATE INDEX IF NOT EXISTS {QUARANTINE_TABLE}_osm_id_idx ON {QUARANTINE_TABLE} (osm_id);
+"""
+
+
+class GeometryProblem(Exception):
+    """A ring that cannot be encoded; str() is the quarantine reason"""
+
+
+def check_ring(flat):
+    """
+    Validate one ring given as a flat [x0, y0, x1, y1, ...] list.
+    Returns the (possibly closed) list; raises GeometryProblem otherwise.
+    """
+    if len(flat) >= 4 and (flat[0] != flat[-2] or flat[1] != flat[-1]):
+        flat = flat + flat[:2]
+    if len(flat) < 2 * MIN_RING_POINTS:
+        raise GeometryProblem(f"Ring has {len(flat) // 2} points (needs {MIN_RING_POINTS})")
+    # sum() is NaN / inf as soon as one coordinate is
+    if not math.isfinite(sum(flat)):
+        raise GeometryProblem("Non-finite coordinates")
+    xs, ys = flat[0::2], flat[1::2]
+    if min(xs) < -180 or max(xs) > 180 or min(ys) < -MAX_LATITUDE or max(ys) > MAX_LATITUDE:
+        raise GeometryProblem("Coordinates out of range")
+    return flat
+
+
+def reject_row(osm_id, name, building_type, reason, geometry):
+    """Quarantine row for a geometry that never reached PostGIS"""
+    return (osm_id, name, building_type, 'rejected', reason, json.dumps(geometry)[:100000])
+
+
+def record_rejects(cur, rejects, source_table='buildings'):
+    """Write reject_row tuples to geometry_quarantine (no commit)"""
+    if not rejects:
+        return 0
+    cur.execute(QUARANTINE_DDL)
+    cur.executemany(f"""
+        INSERT INTO {QUARANTINE_TABLE} (source_table, osm_id, name, type, action, reason, raw)
+        VALUES (%s, %s, %s, %s, %s, %s, %s);
+    """, [(source_table, *row) for row in rejects])
+    return len(rejects)
+
+
+def validation_statements(table, source_table='buildings'):
+    """
+    Set-based check / repair / quarantine of every geometry in table, as (label, sql) pairs.
+    'repaired' and 'rejected' report the affected row counts.
+    """
+    invalid = f"{table}_invalid"
+    return [
+        ('quarantine', QUARANTINE_DDL),
+        ('check', f"""
+            DROP TABLE IF EXISTS {invalid};
+            CREATE TEMP TABLE {invalid} ON COMMIT DROP AS
+            SELECT row_ctid, osm_id, name, type, geom,
+                   CASE WHEN out_of_range THEN 'Coordinates out of range' ELSE reason END AS reason,
+                   CASE WHEN out_of_range THEN NULL
+                        ELSE ST_CollectionExtract(ST_MakeValid(geom), 3) END AS fixed
+            FROM (
+                SELECT ctid AS row_ctid, osm_id, name, type, geom,
+                       ST_IsValidReason(geom) AS reason,
+                       ST_SRID(geom) = 4326 AND NOT geom @ ST_MakeEnvelope(-180, -{MAX_LATITUDE}, 180, {MAX_LATITUDE}, 4326) AS out_of_range
+                FROM {table}
+                WHERE geom IS NOT NULL
+            ) t
+            WHERE out_of_range OR reason <> 'Valid Geometry';
+        """),
+        ('quarantined', f"""
+            INSERT INTO {QUARANTINE_TABLE} (source_table, osm_id, name, type, action, reason, geom)
+            SELECT '{source_table}', osm_id, name, type,
+                   CASE WHEN fixed IS NULL OR ST_IsEmpty(fixed) THEN 'rejected' ELSE 'repaired' END,
+                   reason, geom
+            FROM {invalid};
+        """),
+        ('repaired', f"""
+            UPDATE {table} t
+            -- keep MultiPolygon typed columns (ogr2ogr -nlt MULTIPOLYGON) happy
+            SET geom = CASE WHEN ST_GeometryType(t.geom) = 'ST_MultiPolygon' THEN ST_Multi(i.fixed) ELSE i.fixed END
+            FROM {invalid} i
+            WHERE t.ctid = i.row_ctid AND i.fixed IS NOT NULL AND NOT ST_IsEmpty(i.fixed);
+        """),
+        ('rejected', f"""
+            DELETE FROM {table} t
+            USING {invalid} i
+            WHERE t.ctid = i.row_ctid AND (i.fixed IS NULL OR ST_IsEmpty(i.fixed));
+        """),
+        ('cleanup', f"DROP TABLE {invalid};"),
+    ]
+
+
+def validate_table(cur, table, source_table='buildings'):
+    """Run validation_statements on table (no commit); returns {'repaired': n, 'rejected': m}"""
+    counts = {}
+    for label, sql in validation_statements(table, source_table):
+        cur.execute(sql)
+        if label in ('repaired', 'rejected'):
+            counts[label] = cur.rowcount
+    return counts
+
+
+def print_validation_summary(counts, rejected_early=0):
+    repaired = counts.get('repaired', 0)
+    rejected = counts.get('rejected', 0) + rejected_early
+    if repaired or rejected:
+        print(f"Geometry check: {repaired} repaired, {rejected} rejected (see {QUARANTINE_TABLE})")